@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+@author:XuMing(xuming624@qq.com)
+@description: Benchmark batched ONNX Runtime prediction against the per-row session loop
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append('..')
+from pytextclassifier import BertClassificationModel
+from pytextclassifier.base_classifier import load_data
+
+
+def predict_per_row(model, sentences):
+    """One InferenceSession.run call per sentence, the previous onnx predict behaviour."""
+    input_names = {model_input.name for model_input in model.model.get_inputs()}
+    outputs = np.empty((len(sentences), model.num_labels))
+    for i, sentence in enumerate(sentences):
+        model_inputs = model.tokenizer(sentence, truncation=True, max_length=model.args.max_seq_length,
+                                       return_tensors='np')
+        inputs_onnx = {k: v.astype(np.int64) for k, v in model_inputs.items() if k in input_names}
+        outputs[i] = model.model.run(None, inputs_onnx)[0][0]
+    return outputs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Bert onnx predict benchmark')
+    parser.add_argument('--model_dir', default='models/bert-chinese/onnx', type=str,
+                        help='onnx model dir, created by BertClassificationModel.convert_to_onnx()')
+    parser.add_argument('--model_type', default='bert', type=str, help='huggingface model type')
+    parser.add_argument('--num_classes', default=10, type=int, help='number of classes')
+    parser.add_argument('--data_path', default='thucnews_train_1w.txt', type=str, help='sample data file path')
+    parser.add_argument('--num_samples', default=1000, type=int, help='number of sentences to predict')
+    parser.add_argument('--batch_size', default=32, type=int, help='onnx eval batch size')
+    args = parser.parse_args()
+    print(args)
+
+    model = BertClassificationModel(
+        args.model_type, args.model_dir, num_labels=args.num_classes,
+        args={'onnx': True, 'eval_batch_size': args.batch_size, 'silent': True},
+        use_cuda=False,
+    )
+    X, _, _ = load_data(args.data_path)
+    sentences = X[:args.num_samples].tolist()
+    # warm up the session
+    model.predict(sentences[:args.batch_size])
+
+    t1 = time.time()
+    row_outputs = predict_per_row(model, sentences)
+    row_spend = time.time() - t1
+
+    t2 = time.time()
+    _, batch_outputs = model.predict(sentences)
+    batch_spend = time.time() - t2
+
+    print(f'per-row loop: {row_spend:.3f}s, {len(sentences) / row_spend:.1f} sentences/s')
+    print(f'batched: {batch_spend:.3f}s, {len(sentences) / batch_spend:.1f} sentences/s, '
+          f'speedup: {row_spend / batch_spend:.2f}x')
+    print(f'max abs diff of logits: {np.abs(row_outputs - batch_outputs).max():.6f}')
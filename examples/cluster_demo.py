@@ -33,3 +33,9 @@ if __name__ == '__main__':
     tcluster.show_clusters(feature, labels, 'models/cluster/cluster_train_seg_samples.png')
     r = tcluster.predict(data[:30])
     print(r)
+
+    ########### streaming train on a large data file, chunk by chunk with hashing feature
+    tcluster = TextCluster(model_dir='models/cluster-streaming', n_clusters=10)
+    tcluster.train_streaming('thucnews_train_1w.txt', sep='\t', use_col=1, chunksize=2000, checkpoint_every=2)
+    r = tcluster.predict(data[:30])
+    print(r)
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+@author:XuMing(xuming624@qq.com)
+@description: Cold start benchmark of an exported bundle (ExportedPredictor) against load_model of the classifier,
+each one in a new python process: import, load, predict the first batch.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+sys.path.append('..')
+
+classifier_code = '''
+import sys, time
+start = time.time()
+sys.path.append('..')
+from pytextclassifier import {classifier}
+m = {classifier}(model_dir='{model_dir}')
+m.load_model()
+load_time = time.time() - start
+m.predict({sentences!r})
+print(f'{{load_time:.3f}} {{time.time() - start:.3f}}')
+'''
+
+predictor_code = '''
+import sys, time
+start = time.time()
+sys.path.append('..')
+from pytextclassifier import ExportedPredictor
+m = ExportedPredictor('{bundle_dir}')
+load_time = time.time() - start
+m.predict({sentences!r})
+print(f'{{load_time:.3f}} {{time.time() - start:.3f}}')
+'''
+
+
+def cold_start(code, repeat=3):
+    """Best of repeat runs, seconds of (import + load, import + load + first predict)"""
+    times = []
+    for _ in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', code], text=True)
+        times.append(tuple(float(t) for t in output.split()[-2:]))
+    return min(times)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Exported model cold start benchmark')
+    parser.add_argument('--classifier', default='FastTextClassifier', type=str,
+                        help='TextCNNClassifier, TextRNNClassifier or FastTextClassifier')
+    parser.add_argument('--model_dir', default='models/fasttext', type=str, help='trained model dir')
+    parser.add_argument('--data_path', default='thucnews_train_1w.txt', type=str, help='sample data file path')
+    parser.add_argument('--num_samples', default=64, type=int, help='number of sentences to predict')
+    args = parser.parse_args()
+    print(args)
+    from pytextclassifier import load_data
+    from pytextclassifier.export_util import EXPORT_FORMATS
+    import pytextclassifier
+
+    X, y, df = load_data(args.data_path)
+    sentences = X[:args.num_samples].tolist() if hasattr(X, 'tolist') else list(X[:args.num_samples])
+    m = getattr(pytextclassifier, args.classifier)(model_dir=args.model_dir)
+    if not m.load_model():
+        m.train(args.data_path, num_epochs=1)
+        m.load_model()
+    r, p = m.predict(sentences)
+
+    load_time, total_time = cold_start(classifier_code.format(classifier=args.classifier, model_dir=args.model_dir,
+                                                              sentences=sentences))
+    print(f'{args.classifier} load_model: load {load_time:.3f}s, load + predict {total_time:.3f}s')
+    for fmt in EXPORT_FORMATS:
+        bundle_dir = m.export(os.path.join(args.model_dir, f'export_{fmt}'), format=fmt)
+        r1, p1 = pytextclassifier.ExportedPredictor(bundle_dir).predict(sentences)
+        print(f'{fmt} same labels: {r == r1}, max prob diff: {max(abs(a - b) for a, b in zip(p, p1)):.2e}')
+        load_time, total_time = cold_start(predictor_code.format(bundle_dir=bundle_dir, sentences=sentences))
+        print(f'ExportedPredictor {fmt}: load {load_time:.3f}s, load + predict {total_time:.3f}s')
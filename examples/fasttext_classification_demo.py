@@ -48,3 +48,18 @@ if __name__ == '__main__':
     test_data = df[:100]
     acc_score = m.evaluate_model(test_data)
     print(f'acc_score: {acc_score}')
+
+    #### sparse embedding training, and prune the n-gram hash buckets not seen in training
+    m = FastTextClassifier(model_dir='models/fasttext-sparse', sparse_embedding=True, count_ngram_buckets=True)
+    m.train(data_file, names=('labels', 'text'), num_epochs=3)
+    print(m.prune_ngram_buckets(min_count=1))  # kept buckets, model size(MB) before and after pruning
+    m.load_model()
+    acc_score = m.evaluate_model(test_data)
+    print(f'pruned model acc_score: {acc_score}')
+
+    # quantize for cpu inference: int8 Linear layers and int8 embeddings, about 1/4 model size
+    result = m.quantize(test_data, embedding_dtype='int8')
+    print(f'quantize result: {result}')  # model sizes(MB), acc of fp32 and quantized model on test_data
+    m.load_model(quantized=True)
+    predict_label, predict_proba = m.predict(['顺义北京苏活88平米起精装房在售'])
+    print(f'quantized model predict_label: {predict_label}, predict_proba: {predict_proba}')
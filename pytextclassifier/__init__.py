@@ -1,15 +1,37 @@
 # -*- coding: utf-8 -*-
 """
 @author:XuMing(xuming624@qq.com)
-@description: 
+@description:
 """
 __version__ = '1.3.2'
 
-from pytextclassifier.classic_classifier import ClassicClassifier
-from pytextclassifier.fasttext_classifier import FastTextClassifier
-from pytextclassifier.textcnn_classifier import TextCNNClassifier
-from pytextclassifier.textrnn_classifier import TextRNNClassifier
-from pytextclassifier.bert_classifier import BertClassifier
-from pytextclassifier.base_classifier import load_data
-from pytextclassifier.textcluster import TextCluster
-from pytextclassifier.bert_classification_model import BertClassificationModel, BertClassificationArgs
+import importlib
+
+# classes are imported on first access, so importing ExportedPredictor or ClassicClassifier
+# does not load torch and transformers
+_lazy_imports = {
+    'ClassicClassifier': 'pytextclassifier.classic_classifier',
+    'FastTextClassifier': 'pytextclassifier.fasttext_classifier',
+    'TextCNNClassifier': 'pytextclassifier.textcnn_classifier',
+    'TextRNNClassifier': 'pytextclassifier.textrnn_classifier',
+    'BertClassifier': 'pytextclassifier.bert_classifier',
+    'load_data': 'pytextclassifier.base_classifier',
+    'TextCluster': 'pytextclassifier.textcluster',
+    'BertClassificationModel': 'pytextclassifier.bert_classification_model',
+    'BertClassificationArgs': 'pytextclassifier.bert_classification_model',
+    'ExportedPredictor': 'pytextclassifier.predictor',
+}
+
+__all__ = list(_lazy_imports)
+
+
+def __getattr__(name):
+    if name in _lazy_imports:
+        value = getattr(importlib.import_module(_lazy_imports[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
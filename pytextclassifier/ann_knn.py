@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+@author:XuMing(xuming624@qq.com)
+@description: Approximate KNN classifier, dense reduced vectors with an IVF (inverted file) index
+"""
+import numpy as np
+from sklearn.base import BaseEstimator, ClassifierMixin
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.decomposition import TruncatedSVD
+from sklearn.random_projection import SparseRandomProjection
+
+
+def l2_normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class IVFIndex(object):
+    """
+    Inverted file index of l2 normalized vectors, search by inner product (cosine similarity):
+    vectors are assigned to the nearest of n_lists kmeans centroids, a query scans only the lists of
+    its n_probe nearest centroids, about n_probe / n_lists of the data.
+    """
+
+    def __init__(self, n_lists=None, n_probe=8, random_state=1):
+        """
+        :param n_lists: number of inverted lists, sqrt(n_samples) if None
+        :param n_probe: number of lists scanned per query, larger for higher recall and latency
+        :param random_state: kmeans seed
+        """
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.random_state = random_state
+
+    def build(self, vectors):
+        """
+        :param vectors: (n_samples, dim) l2 normalized array
+        :return: self
+        """
+        n_samples = len(vectors)
+        n_lists = self.n_lists or int(np.sqrt(n_samples))
+        n_lists = max(1, min(n_lists, n_samples))
+        kmeans = MiniBatchKMeans(n_clusters=n_lists, n_init=3, random_state=self.random_state)
+        assign = kmeans.fit_predict(vectors)
+        self.centroids = l2_normalize(kmeans.cluster_centers_).astype(np.float32)
+        # vectors sorted by list, list i is vectors[offsets[i]: offsets[i + 1]]
+        self.ids = np.argsort(assign, kind='stable')
+        self.vectors = np.ascontiguousarray(vectors[self.ids], dtype=np.float32)
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=n_lists))])
+        return self
+
+    def search(self, queries, k=5):
+        """
+        :param queries: (n_queries, dim) l2 normalized array
+        :param k: number of neighbours
+        :return: ids, (n_queries, k) array of vector ids, -1 for missing; sims, (n_queries, k) array
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        list_sizes = np.diff(self.offsets)
+        list_orders = np.argsort(-(queries @ self.centroids.T), axis=1)
+        ids = np.full((len(queries), k), -1, dtype=np.int64)
+        sims = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for i, query in enumerate(queries):
+            # probe n_probe lists, more if they hold less than k vectors
+            cum_sizes = np.cumsum(list_sizes[list_orders[i]])
+            n_probe = max(self.n_probe, int(np.searchsorted(cum_sizes, k)) + 1)
+            lists = list_orders[i, :n_probe]
+            candidates = np.concatenate([np.arange(self.offsets[j], self.offsets[j + 1]) for j in lists])
+            scores = self.vectors[candidates] @ query
+            top = min(k, len(candidates))
+            top_idx = np.argpartition(-scores, top - 1)[:top] if top < len(candidates) else np.arange(top)
+            top_idx = top_idx[np.argsort(-scores[top_idx])]
+            ids[i, :top] = self.ids[candidates[top_idx]]
+            sims[i, :top] = scores[top_idx]
+        return ids, sims
+
+
+class AnnKNNClassifier(BaseEstimator, ClassifierMixin):
+    """
+    KNN classifier on an approximate nearest neighbour index:
+    sparse features are reduced to dense vectors by TruncatedSVD or random projection, l2 normalized,
+    and indexed by IVFIndex, the label probability is the vote ratio of the top k neighbours.
+    """
+
+    def __init__(self, n_neighbors=5, n_components=128, reducer='svd', n_lists=None, n_probe=8, random_state=1):
+        """
+        :param n_neighbors: k
+        :param n_components: dim of the dense vectors
+        :param reducer: svd or random_projection
+        :param n_lists: IVF lists, sqrt(n_samples) if None
+        :param n_probe: IVF lists scanned per query, recall and latency knob
+        :param random_state:
+        """
+        self.n_neighbors = n_neighbors
+        self.n_components = n_components
+        self.reducer = reducer
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.random_state = random_state
+
+    def _reduce(self, X):
+        vectors = X @ self.projection_
+        if hasattr(vectors, 'toarray'):
+            vectors = vectors.toarray()
+        return l2_normalize(np.asarray(vectors, dtype=np.float32))
+
+    def fit(self, X, y):
+        if self.reducer not in ('svd', 'random_projection'):
+            raise ValueError(f'reducer should be svd or random_projection, got {self.reducer}.')
+        self.classes_, y_ids = np.unique(np.asarray(y), return_inverse=True)
+        if self.reducer == 'svd':
+            n_components = max(1, min(self.n_components, X.shape[1] - 1, X.shape[0] - 1))
+            svd = TruncatedSVD(n_components=n_components, random_state=self.random_state).fit(X)
+            self.projection_ = svd.components_.T.astype(np.float32)
+        else:
+            projection = SparseRandomProjection(n_components=self.n_components, random_state=self.random_state).fit(X)
+            self.projection_ = projection.components_.T.tocsr().astype(np.float32)
+        self.index_ = IVFIndex(n_lists=self.n_lists, n_probe=self.n_probe, random_state=self.random_state)
+        self.index_.build(self._reduce(X))
+        self.y_ids_ = y_ids
+        return self
+
+    def kneighbors(self, X):
+        """
+        :return: ids, sims of the top n_neighbors train samples, see IVFIndex.search
+        """
+        return self.index_.search(self._reduce(X), k=self.n_neighbors)
+
+    def predict_proba(self, X):
+        ids, _ = self.kneighbors(X)
+        found = ids >= 0
+        rows = np.repeat(np.arange(len(ids)), found.sum(axis=1))
+        votes = np.zeros((len(ids), len(self.classes_)), dtype=np.float64)
+        np.add.at(votes, (rows, self.y_ids_[ids[found]]), 1.0)
+        return votes / np.maximum(found.sum(axis=1, keepdims=True), 1)
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
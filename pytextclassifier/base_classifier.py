@@ -4,6 +4,9 @@
 @description: 
 """
 import os
+import zlib
+
+import numpy as np
 import pandas as pd
 from loguru import logger
 
@@ -33,6 +36,42 @@ def load_data(data_list_or_path, header=None, names=('labels', 'text'), delimite
     return X, y, data_df
 
 
+def hash_dev_mask(X, test_size=0.1):
+    """
+    Deterministic dev split, a text is a dev sample if the crc32 of it falls in the first test_size of buckets,
+    so the same text is always on the same side, whatever the chunk it is read in
+    @param X: iterable of text
+    @param test_size: dev ratio
+    @return: np.ndarray of bool, True for dev samples
+    """
+    threshold = int(test_size * 10000)
+    return np.fromiter((zlib.crc32(str(text).encode('utf-8')) % 10000 < threshold for text in X),
+                       dtype=bool, count=len(X))
+
+
+def load_data_chunks(data_path, chunksize=100000, test_size=0.1, header=None, names=('labels', 'text'),
+                     delimiter='\t'):
+    """
+    Read a large data file in chunks
+    @param data_path: file path, eg: label\ttext per line; list of (label, text) and DataFrame are one chunk
+    @param chunksize: number of lines per chunk
+    @param test_size: dev ratio for hash_dev_mask
+    @param header: read_csv header
+    @param names: read_csv names
+    @param delimiter: read_csv sep
+    @return: generator of (X, y, is_dev)
+    """
+    if not isinstance(data_path, str):
+        X, y, _ = load_data(data_path, header=header, names=names, delimiter=delimiter)
+        yield X, y, hash_dev_mask(X, test_size)
+        return
+    if not os.path.exists(data_path):
+        raise ValueError(f'{data_path} not exists.')
+    for data_df in pd.read_csv(data_path, header=header, delimiter=delimiter, names=names, chunksize=chunksize):
+        X, y = data_df['text'], data_df['labels']
+        yield X, y, hash_dev_mask(X, test_size)
+
+
 class ClassifierABC:
     """
     Abstract class for classifier
@@ -43,6 +82,21 @@ class ClassifierABC:
     def predict(self, sentences: list):
         raise NotImplementedError('predict method not implemented.')
 
+    def predict_proba(self, sentences: list):
+        raise NotImplementedError('predict_proba method not implemented.')
+
+    def predict_topk(self, sentences: list, k=3):
+        """
+        Top k labels and their probability for sentences, ranked by probability, from one predict_proba pass
+        @param sentences: list, input text list, eg: [text1, text2, ...]
+        @param k: number of labels of each sentence, clipped to the number of labels
+        @return: topk_labels, topk_probs; lists of k labels and k probabilities of each sentence
+        """
+        from pytextclassifier.predict_util import topk
+
+        label_ids, top_probs = topk(np.asarray(self.predict_proba(sentences)), k=k)
+        return self.id_label[label_ids].tolist(), top_probs.astype(np.float64).tolist()
+
     def evaluate_model(self, **kwargs):
         raise NotImplementedError('evaluate_model method not implemented.')
 
@@ -52,5 +106,25 @@ class ClassifierABC:
     def load_model(self):
         raise NotImplementedError('load method not implemented.')
 
+    @property
+    def id_label(self):
+        """
+        Labels in label id order, np.ndarray of object, cached until label_id_map is replaced
+        """
+        from pytextclassifier.predict_util import id_label_array
+
+        label_id_map = self.label_id_map
+        if getattr(self, '_id_label_key', None) is not label_id_map:
+            self._id_label = id_label_array(label_id_map)
+            self._id_label_key = label_id_map
+        return self._id_label
+
+    @property
+    def labels(self):
+        """
+        Labels in the column order of predict_proba
+        """
+        return self.id_label.tolist()
+
     def save_model(self):
         raise NotImplementedError('save method not implemented.')
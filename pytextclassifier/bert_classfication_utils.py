@@ -14,10 +14,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import atexit
 import collections
+import hashlib
+import itertools
 import json
-import linecache
+import mmap
 import os
+import shutil
 import sys
 import warnings
 from collections import Counter, Iterable
@@ -25,15 +29,17 @@ from dataclasses import asdict, dataclass, field
 from io import open
 from multiprocessing import Pool
 from multiprocessing import cpu_count
+from multiprocessing import resource_tracker, shared_memory
 from numbers import Real
 from typing import Optional, Union
 
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from datasets import Dataset as HFDataset
 from datasets import load_dataset
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, Sampler
 from tqdm.auto import tqdm
 from loguru import logger
 
@@ -176,6 +182,8 @@ class BertClassificationArgs(ModelArgs):
     """
 
     model_class: str = "ClassificationModel"
+    dynamic_padding: bool = False
+    dynamic_padding_bucket_batches: int = 50
     labels_list: list = field(default_factory=list)
     labels_map: dict = field(default_factory=dict)
     lazy_delimiter: str = "\t"
@@ -188,10 +196,12 @@ class BertClassificationArgs(ModelArgs):
     onnx: bool = False
     regression: bool = False
     sliding_window: bool = False
+    sliding_window_pooling: str = "mean"
     special_tokens_list: list = field(default_factory=list)
     stride: float = 0.8
     tie_value: int = 1
     threshold: float = 0.5
+    use_fast_tokenizer: bool = True
 
 
 class InputExample(object):
@@ -239,8 +249,45 @@ class InputFeatures(object):
         self.label_id = label_id
 
 
+def load_tokenizer(tokenizer_class, tokenizer_name, use_fast=True, **kwargs):
+    """
+    Load the fast (Rust) variant of tokenizer_class if transformers has one, eg: BertTokenizer -> BertTokenizerFast,
+    falls back to tokenizer_class if there is none or it can not be built, eg: sentencepiece is missing
+    """
+    import transformers
+
+    if use_fast:
+        if tokenizer_class is transformers.AutoTokenizer:
+            kwargs["use_fast"] = True
+            fast_class = tokenizer_class
+        elif tokenizer_class.__name__.endswith("Fast"):
+            fast_class = tokenizer_class
+        else:
+            fast_class = getattr(transformers, tokenizer_class.__name__ + "Fast", None)
+        if fast_class is not None:
+            try:
+                return fast_class.from_pretrained(tokenizer_name, **kwargs)
+            except (OSError, ValueError, ImportError) as e:
+                logger.warning(f"{fast_class.__name__} not loaded, use {tokenizer_class.__name__}: {e}")
+    elif tokenizer_class is transformers.AutoTokenizer:
+        kwargs["use_fast"] = False
+    elif tokenizer_class.__name__.endswith("Fast"):
+        tokenizer_class = getattr(transformers, tokenizer_class.__name__[:-len("Fast")], tokenizer_class)
+    return tokenizer_class.from_pretrained(tokenizer_name, **kwargs)
+
+
 def preprocess_data_multiprocessing(data):
-    text_a, text_b, tokenizer, max_seq_length = data
+    text_a, text_b, tokenizer, max_seq_length, dynamic_padding = data
+
+    if dynamic_padding:
+        # Unpadded id lists, each batch is padded to its own maximum at collate time
+        return tokenizer(
+            text=text_a,
+            text_pair=text_b,
+            max_length=max_seq_length,
+            truncation=True,
+            padding=False,
+        )
 
     examples = tokenizer(
         text=text_a,
@@ -248,149 +295,466 @@ def preprocess_data_multiprocessing(data):
         max_length=max_seq_length,
         truncation=True,
         padding="max_length",
-        return_tensors="pt",
+        return_tensors="np",
     )
 
     return examples
 
 
-def preprocess_batch_for_hf_dataset(dataset, tokenizer, max_seq_length):
+def preprocess_batch_for_hf_dataset(dataset, tokenizer, max_seq_length, dynamic_padding=False):
+    padding = False if dynamic_padding else "max_length"
     if "text_b" in dataset:
         return tokenizer(
             text=dataset["text_a"],
             text_pair=dataset["text_b"],
             truncation=True,
-            padding="max_length",
+            padding=padding,
             max_length=max_seq_length,
         )
     else:
         return tokenizer(
             text=dataset["text"],
             truncation=True,
-            padding="max_length",
+            padding=padding,
             max_length=max_seq_length,
         )
 
 
-def preprocess_data(text_a, text_b, labels, tokenizer, max_seq_length):
+def preprocess_data(text_a, text_b, labels, tokenizer, max_seq_length, dynamic_padding=False):
+    if dynamic_padding:
+        # Unpadded id lists, each batch is padded to its own maximum at collate time
+        return tokenizer(
+            text=text_a,
+            text_pair=text_b,
+            truncation=True,
+            padding=False,
+            max_length=max_seq_length,
+        )
+
     return tokenizer(
         text=text_a,
         text_pair=text_b,
         truncation=True,
         padding="max_length",
         max_length=max_seq_length,
-        return_tensors="pt",
+        return_tensors="np",
     )
 
 
-def build_classification_dataset(
-        data, tokenizer, args, mode, multi_label, output_mode, no_cache
-):
-    cached_features_file = os.path.join(
-        args.cache_dir,
-        "cached_{}_{}_{}_{}_{}".format(
-            mode,
-            args.model_type,
-            args.max_seq_length,
-            len(args.labels_list),
-            len(data),
-        ),
+FEATURES_CACHE_META = "meta.json"
+# preprocessing args of the tokenizer which do not change the features
+_TOKENIZER_PATH_KWARGS = ("name_or_path", "vocab_file", "tokenizer_file", "special_tokens_map_file")
+
+
+def features_cache_key(text_a, text_b, labels, tokenizer, args, output_mode):
+    """
+    Content hash of a feature cache: texts, labels, tokenizer vocabulary and settings, and preprocessing args.
+    Datasets of the same size get different keys, a changed tokenizer or max_seq_length is a cache miss.
+    """
+    key = hashlib.sha1()
+    settings = {
+        "model_type": args.model_type,
+        "max_seq_length": args.max_seq_length,
+        "dynamic_padding": args.dynamic_padding,
+        "output_mode": output_mode,
+        "tokenizer_class": tokenizer.__class__.__name__,
+        "tokenizer_kwargs": {
+            k: v for k, v in tokenizer.init_kwargs.items() if k not in _TOKENIZER_PATH_KWARGS
+        },
+        "padding_side": getattr(tokenizer, "padding_side", None),
+        "truncation_side": getattr(tokenizer, "truncation_side", None),
+    }
+    if args.sliding_window:
+        settings["sliding_window_stride"] = args.stride
+    key.update(json.dumps(settings, sort_keys=True, default=str).encode("utf-8"))
+    key.update(json.dumps(sorted(tokenizer.get_vocab().items()), ensure_ascii=False).encode("utf-8"))
+    for texts in (text_a, text_b):
+        if texts is None:
+            key.update(b"\x00none")
+            continue
+        key.update(len(texts).to_bytes(8, "little"))
+        for text in texts:
+            text = str(text).encode("utf-8")
+            key.update(len(text).to_bytes(8, "little"))
+            key.update(text)
+    key.update(f"{labels.dtype.str}{labels.shape}".encode("utf-8"))
+    key.update(np.ascontiguousarray(labels).tobytes())
+    return key.hexdigest()
+
+
+def to_feature_arrays(examples, dynamic_padding):
+    """
+    Tokenizer outputs to int32 arrays: (n, max_seq_length) arrays if padded, else the rows of each feature
+    concatenated into one flat array, with the row boundaries in "offsets" (n + 1,)
+    """
+    if not dynamic_padding:
+        return {key: np.asarray(value, dtype=np.int32) for key, value in examples.items()}
+    lengths = np.array([len(row) for row in examples["input_ids"]], dtype=np.int64)
+    arrays = {"offsets": np.concatenate([[0], np.cumsum(lengths)])}
+    for key, rows in examples.items():
+        arrays[key] = np.fromiter(
+            itertools.chain.from_iterable(rows), dtype=np.int32, count=int(arrays["offsets"][-1])
+        )
+    return arrays
+
+
+# tokenizer of a TokenizerPool worker, set once by the pool initializer
+_worker_tokenizer = None
+
+
+def _init_tokenizer_worker(tokenizer):
+    global _worker_tokenizer
+    _worker_tokenizer = tokenizer
+
+
+def _encode_to_shared_memory(task):
+    """
+    Tokenize a slice of texts with the worker tokenizer, the arrays of to_feature_arrays are written to one
+    shared memory block, unlinked by the parent after copying
+    @return: block name; layout, list of (name, dtype, shape, byte offset)
+    """
+    text_a, text_b, max_seq_length, dynamic_padding = task
+    examples = preprocess_data_multiprocessing(
+        (text_a, text_b, _worker_tokenizer, max_seq_length, dynamic_padding)
     )
+    arrays = to_feature_arrays(examples, dynamic_padding)
+    block = shared_memory.SharedMemory(create=True, size=max(sum(a.nbytes for a in arrays.values()), 1))
+    layout = []
+    offset = 0
+    for name, array in arrays.items():
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf, offset=offset)[...] = array
+        layout.append((name, array.dtype.str, array.shape, offset))
+        offset += array.nbytes
+    block.close()
+    return block.name, layout
+
+
+class TokenizerPool:
+    """
+    Persistent pool of preprocessing processes. Each worker receives the tokenizer once, by the pool
+    initializer, tasks carry text slices only, and encoded arrays come back in shared memory blocks.
+    Use get_tokenizer_pool to reuse one pool across train, eval and predict.
+    """
+
+    def __init__(self, tokenizer, process_count):
+        self.tokenizer = tokenizer
+        self.process_count = max(1, process_count)
+        # workers share the resource tracker of the parent, which unlinks the blocks
+        resource_tracker.ensure_running()
+        self.pool = Pool(self.process_count, initializer=_init_tokenizer_worker, initargs=(tokenizer,))
 
-    if os.path.exists(cached_features_file) and (
-            (not args.reprocess_input_data and not args.no_cache)
-            or (mode == "dev" and args.use_cached_eval_features and not args.no_cache)
+    def imap(self, func, iterable, chunksize=1):
+        """Pool.imap, func runs in the workers and can use the worker tokenizer"""
+        return self.pool.imap(func, iterable, chunksize=chunksize)
+
+    def encode(self, text_a, text_b, max_seq_length, dynamic_padding=False, chunksize=500, silent=False):
+        """
+        Tokenize texts in the workers, chunksize texts per task
+        @return: arrays of to_feature_arrays for all texts
+        """
+        tasks = [
+            (
+                text_a[i: i + chunksize],
+                text_b[i: i + chunksize] if text_b is not None else None,
+                max_seq_length,
+                dynamic_padding,
+            )
+            for i in range(0, len(text_a), chunksize)
+        ]
+        arrays = {}
+        parts = []
+        start = 0
+        for name, layout in tqdm(self.imap(_encode_to_shared_memory, tasks), total=len(tasks), disable=silent):
+            block = shared_memory.SharedMemory(name=name)
+            try:
+                chunk = {
+                    key: np.ndarray(shape, dtype=dtype, buffer=block.buf, offset=offset)
+                    for key, dtype, shape, offset in layout
+                }
+                if dynamic_padding:
+                    parts.append({key: array.copy() for key, array in chunk.items()})
+                else:
+                    # padded chunks are copied into the preallocated arrays
+                    size = len(chunk["input_ids"])
+                    for key, array in chunk.items():
+                        if key not in arrays:
+                            arrays[key] = np.empty((len(text_a),) + array.shape[1:], dtype=array.dtype)
+                        arrays[key][start: start + size] = array
+                    start += size
+                del chunk
+            finally:
+                block.close()
+                block.unlink()
+        if dynamic_padding and parts:
+            bases = np.cumsum([0] + [part["offsets"][-1] for part in parts[:-1]])
+            arrays["offsets"] = np.concatenate(
+                [[0]] + [part["offsets"][1:] + base for part, base in zip(parts, bases)]
+            )
+            for key in parts[0]:
+                if key != "offsets":
+                    arrays[key] = np.concatenate([part[key] for part in parts])
+        return arrays
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+
+_tokenizer_pool = None
+
+
+def get_tokenizer_pool(tokenizer, process_count):
+    """
+    The TokenizerPool of this process, created again only if the tokenizer or the process_count changes
+    """
+    global _tokenizer_pool
+    if (
+            _tokenizer_pool is None
+            or _tokenizer_pool.tokenizer is not tokenizer
+            or _tokenizer_pool.process_count != max(1, process_count)
     ):
-        data = torch.load(cached_features_file)
-        logger.info(f" Features loaded from cache at {cached_features_file}")
-        examples, labels = data
-    else:
-        logger.info(" Converting to features started. Cache is not used.")
+        close_tokenizer_pool()
+        _tokenizer_pool = TokenizerPool(tokenizer, process_count)
+    return _tokenizer_pool
 
-        if len(data) == 3:
-            # Sentence pair task
-            text_a, text_b, labels = data
-        else:
-            text_a, labels = data
-            text_b = None
 
-        # If labels_map is defined, then labels need to be replaced with ints
-        if args.labels_map and not args.regression:
-            if multi_label:
-                labels = [[args.labels_map[l] for l in label] for label in labels]
-            else:
-                labels = [args.labels_map[label] for label in labels]
+@atexit.register
+def close_tokenizer_pool():
+    global _tokenizer_pool
+    if _tokenizer_pool is not None:
+        _tokenizer_pool.close()
+        _tokenizer_pool = None
 
-        if (mode == "train" and args.use_multiprocessing) or (
-                mode == "dev" and args.use_multiprocessing_for_evaluation
-        ):
-            if args.multiprocessing_chunksize == -1:
-                chunksize = max(len(data) // (args.process_count * 2), 500)
-            else:
-                chunksize = args.multiprocessing_chunksize
-
-            if text_b is not None:
-                data = [
-                    (
-                        text_a[i: i + chunksize],
-                        text_b[i: i + chunksize],
-                        tokenizer,
-                        args.max_seq_length,
-                    )
-                    for i in range(0, len(text_a), chunksize)
-                ]
-            else:
-                data = [
-                    (text_a[i: i + chunksize], None, tokenizer, args.max_seq_length)
-                    for i in range(0, len(text_a), chunksize)
-                ]
-
-            with Pool(args.process_count) as p:
-                examples = list(
-                    tqdm(
-                        p.imap(preprocess_data_multiprocessing, data),
-                        total=len(text_a),
-                        disable=args.silent,
-                    )
-                )
 
-            examples = {
-                key: torch.cat([example[key] for example in examples])
-                for key in examples[0]
-            }
-        else:
-            examples = preprocess_data(
-                text_a, text_b, labels, tokenizer, args.max_seq_length
-            )
+def save_features_cache(cache_path, arrays):
+    """
+    Save feature arrays as .npy files of the dir cache_path, written to a temp dir and renamed,
+    so a cache dir is either complete or absent
+    """
+    tmp_path = f"{cache_path}.tmp{os.getpid()}"
+    os.makedirs(tmp_path, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_path, f"{name}.npy"), array)
+    with open(os.path.join(tmp_path, FEATURES_CACHE_META), "w", encoding="utf-8") as f:
+        json.dump({"names": list(arrays)}, f)
+    try:
+        os.rename(tmp_path, cache_path)
+    except OSError:
+        # written by another process meanwhile, the content is the same
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def load_features_cache(cache_path):
+    """
+    Open the feature arrays of a cache dir as read-only memmaps, pages are read on access
+    """
+    with open(os.path.join(cache_path, FEATURES_CACHE_META), "r", encoding="utf-8") as f:
+        names = json.load(f)["names"]
+    return {name: np.load(os.path.join(cache_path, f"{name}.npy"), mmap_mode="r") for name in names}
 
-        if output_mode == "classification":
-            labels = torch.tensor(labels, dtype=torch.long)
-        elif output_mode == "regression":
-            labels = torch.tensor(labels, dtype=torch.float)
 
-        data = (examples, labels)
+def build_classification_dataset(
+        data, tokenizer, args, mode, multi_label, output_mode, no_cache
+):
+    """
+    Tokenize data to int arrays, see to_feature_arrays, labels in "labels".
+    With args.sliding_window, the rows are the unpadded windows of the texts, see window_texts, labels are
+    repeated for each window and "window_counts" holds the number of windows of each text.
+    The arrays are cached in args.cache_dir, keyed by features_cache_key, and loaded back as memmaps.
+    @return: cache_path, None if the cache is not used; arrays, dict of name -> np.ndarray
+    """
+    if len(data) == 3:
+        # Sentence pair task
+        text_a, text_b, labels = data
+    else:
+        text_a, labels = data
+        text_b = None
 
-        if not args.no_cache and not no_cache:
-            logger.info(" Saving features into cached file %s" % cached_features_file)
-            torch.save(data, cached_features_file)
+    # If labels_map is defined, then labels need to be replaced with ints
+    if args.labels_map and not args.regression:
+        if multi_label:
+            labels = [[args.labels_map[l] for l in label] for label in labels]
+        else:
+            labels = [args.labels_map[label] for label in labels]
+    labels = np.asarray(labels, dtype=np.float32 if output_mode == "regression" else np.int64)
+
+    use_cache = not args.no_cache and not no_cache
+    cache_path = None
+    if use_cache:
+        cache_path = os.path.join(
+            args.cache_dir,
+            "features_" + features_cache_key(text_a, text_b, labels, tokenizer, args, output_mode),
+        )
+        if os.path.exists(cache_path) and (
+                not args.reprocess_input_data
+                or (mode == "dev" and args.use_cached_eval_features)
+        ):
+            logger.info(f" Features loaded from cache at {cache_path}")
+            return cache_path, load_features_cache(cache_path)
+
+    logger.info(" Converting to features started. Cache is not used.")
+    if args.sliding_window:
+        if text_b is not None:
+            raise ValueError("Sequence pair tasks not implemented for sliding window tokenization.")
+        # unpadded windows, batches of windows are bucketed by length and padded at collate time
+        arrays, window_counts = window_texts(text_a, tokenizer, args.max_seq_length, args.stride, True)
+        arrays["window_counts"] = window_counts
+        labels = np.repeat(labels, window_counts, axis=0)
+    elif (mode == "train" and args.use_multiprocessing) or (
+            mode == "dev" and args.use_multiprocessing_for_evaluation
+    ):
+        if args.multiprocessing_chunksize == -1:
+            chunksize = max(len(text_a) // (args.process_count * 2), 500)
+        else:
+            chunksize = args.multiprocessing_chunksize
 
-    return (examples, labels)
+        arrays = get_tokenizer_pool(tokenizer, args.process_count).encode(
+            text_a, text_b, args.max_seq_length, args.dynamic_padding, chunksize=chunksize, silent=args.silent
+        )
+    else:
+        examples = preprocess_data(
+            text_a, text_b, labels, tokenizer, args.max_seq_length, args.dynamic_padding
+        )
+        arrays = to_feature_arrays(examples, args.dynamic_padding)
+    arrays["labels"] = labels
+
+    if use_cache:
+        logger.info(" Saving features into cached file %s" % cache_path)
+        save_features_cache(cache_path, arrays)
+        # serve the memmaps, the tokenized arrays are freed
+        arrays = load_features_cache(cache_path)
+    return cache_path, arrays
 
 
 class ClassificationDataset(Dataset):
+    """
+    Tokenized features of build_classification_dataset, memory-mapped from the feature cache if it is used.
+    Items are (features, label), features are LongTensors, or int arrays of the unpadded rows if dynamic_padding.
+    With sliding_window, items are the windows of the texts.
+    """
+
     def __init__(self, data, tokenizer, args, mode, multi_label, output_mode, no_cache):
-        self.examples, self.labels = build_classification_dataset(
+        self.cache_path, self.arrays = build_classification_dataset(
             data, tokenizer, args, mode, multi_label, output_mode, no_cache
         )
+        self.feature_names = [name for name in self.arrays if name not in ("labels", "offsets", "window_counts")]
+        # sliding windows are always unpadded
+        self.dynamic_padding = "offsets" in self.arrays
+        # windows of each text with args.sliding_window, else None
+        self.window_counts = self.arrays.get("window_counts")
+        self._lengths = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.cache_path is not None:
+            # dataloader workers map the cache again instead of pickling the arrays
+            state["arrays"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.arrays is None:
+            self.arrays = load_features_cache(self.cache_path)
 
     def __len__(self):
-        return len(self.examples["input_ids"])
+        return len(self.arrays["labels"])
 
     def __getitem__(self, index):
-        return (
-            {key: self.examples[key][index] for key in self.examples},
-            self.labels[index],
-        )
+        if self.dynamic_padding:
+            start, end = self.arrays["offsets"][index], self.arrays["offsets"][index + 1]
+            features = {
+                key: self.arrays[key][start:end].astype(np.int64) for key in self.feature_names
+            }
+        else:
+            features = {
+                key: torch.from_numpy(self.arrays[key][index].astype(np.int64))
+                for key in self.feature_names
+            }
+        return features, torch.tensor(self.arrays["labels"][index])
+
+    @property
+    def lengths(self):
+        """Number of non-padding tokens of each example, used to bucket examples by length."""
+        if self._lengths is None:
+            if self.dynamic_padding:
+                self._lengths = np.diff(self.arrays["offsets"])
+            else:
+                self._lengths = self.arrays["attention_mask"].sum(axis=1)
+        return self._lengths
+
+
+class DynamicPaddingCollator:
+    """
+    Pads each batch of unpadded features to the longest row of the batch (or to a fixed pad_to_length).
+
+    Works with ClassificationDataset items, (features, label) tuples, and HF dataset items, dicts with a
+    'labels' key, and returns the batch in the same layout with every feature stacked into a LongTensor.
+    """
+
+    def __init__(self, tokenizer, pad_to_length=None):
+        self.pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else 0
+        self.pad_token_type_id = getattr(tokenizer, "pad_token_type_id", 0)
+        self.pad_on_left = getattr(tokenizer, "padding_side", "right") == "left"
+        self.pad_to_length = pad_to_length
+
+    def pad(self, features):
+        lengths = [len(row) for row in features["input_ids"]]
+        max_length = self.pad_to_length if self.pad_to_length else max(lengths)
+        padded = {}
+        for key, rows in features.items():
+            if key == "input_ids":
+                pad_value = self.pad_token_id
+            elif key == "token_type_ids":
+                pad_value = self.pad_token_type_id
+            else:
+                pad_value = 0
+            array = np.full((len(rows), max_length), pad_value, dtype=np.int64)
+            for i, (row, length) in enumerate(zip(rows, lengths)):
+                if self.pad_on_left:
+                    array[i, max_length - length:] = row
+                else:
+                    array[i, :length] = row
+            padded[key] = torch.from_numpy(array)
+        return padded
+
+    def __call__(self, batch):
+        if isinstance(batch[0], dict):
+            features = {key: [item[key] for item in batch] for key in batch[0] if key != "labels"}
+            padded = self.pad(features)
+            padded["labels"] = torch.stack([torch.as_tensor(item["labels"]) for item in batch])
+            return padded
+        features = {key: [item[0][key] for item in batch] for key in batch[0][0]}
+        labels = torch.stack([torch.as_tensor(item[1]) for item in batch])
+        return self.pad(features), labels
+
+
+class LengthBucketBatchSampler(Sampler):
+    """
+    Yields batches of indices grouped by length, so that dynamic padding pads every batch to a similar length.
+
+    Indices are shuffled, split into buckets of bucket_batches * batch_size, sorted by length inside each
+    bucket and cut into batches; the order of the batches is shuffled again on every epoch.
+    """
+
+    def __init__(self, lengths, batch_size, bucket_batches=50):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.bucket_size = batch_size * max(bucket_batches, 1)
+
+    def __iter__(self):
+        indices = np.random.permutation(len(self.lengths))
+        batches = []
+        for start in range(0, len(indices), self.bucket_size):
+            bucket = indices[start: start + self.bucket_size]
+            bucket = bucket[np.argsort(self.lengths[bucket], kind="stable")]
+            batches.extend(
+                bucket[i: i + self.batch_size] for i in range(0, len(bucket), self.batch_size)
+            )
+        for batch_index in np.random.permutation(len(batches)):
+            yield batches[batch_index].tolist()
+
+    def __len__(self):
+        return (len(self.lengths) + self.batch_size - 1) // self.batch_size
 
 
 def map_labels_to_numeric(example, multi_label, args):
@@ -420,7 +784,10 @@ def load_hf_dataset(data, tokenizer, args, multi_label):
 
     dataset = dataset.map(
         lambda x: preprocess_batch_for_hf_dataset(
-            x, tokenizer=tokenizer, max_seq_length=args.max_seq_length
+            x,
+            tokenizer=tokenizer,
+            max_seq_length=args.max_seq_length,
+            dynamic_padding=args.dynamic_padding,
         ),
         batched=True,
     )
@@ -440,6 +807,151 @@ def load_hf_dataset(data, tokenizer, args, multi_label):
         return dataset
 
 
+def example_texts(examples, add_prefix_space=False):
+    """
+    @return: text_a, list of str; text_b, list of str, None if no example is a sentence pair
+    """
+    def texts(values):
+        values = [str(value) for value in values]
+        if add_prefix_space:
+            values = [value if value.startswith(" ") else " " + value for value in values]
+        return values
+
+    text_b = None
+    if any(example.text_b for example in examples):
+        text_b = texts(example.text_b for example in examples)
+    return texts(example.text_a for example in examples), text_b
+
+
+def encode_examples(examples, tokenizer, max_seq_length, pad_to_max_length=True, add_prefix_space=False):
+    """
+    Tokenize InputExamples in one batched tokenizer call, special tokens, segment ids and the padding side
+    are the ones of the tokenizer
+    @return: arrays of to_feature_arrays, padded to max_seq_length, or flat rows and offsets if not padded
+    """
+    text_a, text_b = example_texts(examples, add_prefix_space)
+    examples = preprocess_data(text_a, text_b, None, tokenizer, max_seq_length, not pad_to_max_length)
+    return to_feature_arrays(examples, not pad_to_max_length)
+
+
+def window_texts(texts, tokenizer, max_seq_length, stride, dynamic_padding=False):
+    """
+    Split each text into windows of max_seq_length tokens, special tokens included, which start stride tokens
+    apart (a fraction of max_seq_length if stride < 1) until the end of the text is covered.
+    Fast tokenizers make all windows in one batched call with their overflow support, other tokenizers
+    tokenize in one batched call and slice the token ids.
+    @return: arrays of to_feature_arrays, one row per window, documents in order;
+        window_counts, np.ndarray (n_texts,), number of windows of each text
+    """
+    if stride < 1:
+        stride = int(max_seq_length * stride)
+    bucket_size = max_seq_length - tokenizer.num_special_tokens_to_add()
+    # tokens shared by consecutive windows
+    overlap = min(max(bucket_size - stride, 0), bucket_size - 1)
+    padding = False if dynamic_padding else "max_length"
+    if getattr(tokenizer, "is_fast", False):
+        features = tokenizer(
+            text=texts,
+            max_length=max_seq_length,
+            truncation=True,
+            stride=overlap,
+            return_overflowing_tokens=True,
+            padding=padding,
+        )
+        window_counts = np.bincount(features.pop("overflow_to_sample_mapping"), minlength=len(texts))
+        return to_feature_arrays(features, dynamic_padding), window_counts
+
+    step = bucket_size - overlap
+    token_ids = tokenizer(text=texts, add_special_tokens=False, truncation=False)["input_ids"]
+    windows = []
+    window_counts = np.empty(len(token_ids), dtype=np.int64)
+    for i, ids in enumerate(token_ids):
+        starts = range(0, max(len(ids) - bucket_size, 0) + step, step)
+        window_counts[i] = len(starts)
+        windows.extend(ids[start: start + bucket_size] for start in starts)
+    features = collections.defaultdict(list)
+    for ids in windows:
+        window = tokenizer.prepare_for_model(ids, max_length=max_seq_length, truncation=False, padding=padding)
+        for key, value in window.items():
+            features[key].append(value)
+    return to_feature_arrays(features, dynamic_padding), window_counts
+
+
+def window_examples(examples, tokenizer, max_seq_length, stride, add_prefix_space=False):
+    """
+    window_texts of single sentence InputExamples, padded to max_seq_length
+    """
+    text_a, text_b = example_texts(examples, add_prefix_space)
+    if text_b is not None:
+        raise ValueError("Sequence pair tasks not implemented for sliding window tokenization.")
+    return window_texts(text_a, tokenizer, max_seq_length, stride)
+
+
+def pool_windows(window_outputs, window_counts, pooling="mean"):
+    """
+    Aggregate the model outputs of the windows of each document, windows of a document are consecutive rows
+    :param window_outputs: np.ndarray (n_windows, num_labels)
+    :param window_counts: np.ndarray (n_documents,), every document has 1 window at least
+    :param pooling: str, mean; max; attention, windows weighted by the softmax, over the windows of the
+        document, of their highest output, confident windows count more; vote, share of the windows
+        predicting each label
+    :return: np.ndarray (n_documents, num_labels)
+    """
+    window_counts = np.asarray(window_counts)
+    starts = np.concatenate([[0], np.cumsum(window_counts)[:-1]]).astype(np.int64)
+    if pooling == "mean":
+        return np.add.reduceat(window_outputs, starts, axis=0) / window_counts[:, None]
+    if pooling == "max":
+        return np.maximum.reduceat(window_outputs, starts, axis=0)
+    if pooling == "attention":
+        scores = window_outputs.max(axis=1)
+        scores = np.exp(scores - np.repeat(np.maximum.reduceat(scores, starts), window_counts))
+        weighted = np.add.reduceat(window_outputs * scores[:, None], starts, axis=0)
+        return weighted / np.add.reduceat(scores, starts)[:, None]
+    if pooling == "vote":
+        votes = np.zeros_like(window_outputs, dtype=np.float64)
+        votes[np.arange(len(window_outputs)), window_outputs.argmax(axis=1)] = 1
+        return np.add.reduceat(votes, starts, axis=0) / window_counts[:, None]
+    raise ValueError(f"Unknown sliding window pooling: {pooling}, use mean, max, attention or vote")
+
+
+def vote_windows(window_outputs, window_counts, tie_value=1):
+    """
+    Majority label of the windows of each document, tie_value if the top labels tie
+    @return: np.ndarray (n_documents,) of label ids
+    """
+    votes = pool_windows(window_outputs, window_counts, "vote")
+    preds = votes.argmax(axis=1)
+    if votes.shape[1] > 1:
+        top2 = np.sort(votes, axis=1)[:, -2:]
+        preds[top2[:, 0] == top2[:, 1]] = tie_value
+    return preds
+
+
+def feature_arrays_to_input_features(arrays, labels):
+    """
+    Rows of to_feature_arrays arrays to InputFeatures, segment ids are zeros for tokenizers without token types
+    """
+    offsets = arrays.get("offsets")
+    num_rows = len(labels)
+    features = []
+    for i in range(num_rows):
+        if offsets is None:
+            rows = {key: array[i] for key, array in arrays.items()}
+        else:
+            rows = {key: array[offsets[i]: offsets[i + 1]] for key, array in arrays.items() if key != "offsets"}
+        input_ids = rows["input_ids"].tolist()
+        features.append(
+            InputFeatures(
+                input_ids=input_ids,
+                input_mask=rows["attention_mask"].tolist(),
+                segment_ids=rows["token_type_ids"].tolist() if "token_type_ids" in rows else [0] * len(input_ids),
+                label_id=labels[i],
+            )
+        )
+    return features
+
+
 def convert_example_to_feature(
         example_row,
         pad_token=0,
@@ -450,116 +962,11 @@ def convert_example_to_feature(
         mask_padding_with_zero=True,
         sep_token_extra=False,
 ):
-    (
-        example,
-        max_seq_length,
-        tokenizer,
-        output_mode,
-        cls_token_at_end,
-        cls_token,
-        sep_token,
-        cls_token_segment_id,
-        pad_on_left,
-        pad_token_segment_id,
-        sep_token_extra,
-        multi_label,
-        stride,
-        pad_token,
-        add_prefix_space,
-        pad_to_max_length,
-    ) = example_row
-
-    if add_prefix_space and not example.text_a.startswith(" "):
-        tokens_a = tokenizer.tokenize(" " + example.text_a)
-    else:
-        tokens_a = tokenizer.tokenize(example.text_a)
-
-    tokens_b = None
-    if example.text_b:
-        if add_prefix_space and not example.text_b.startswith(" "):
-            tokens_b = tokenizer.tokenize(" " + example.text_b)
-        else:
-            tokens_b = tokenizer.tokenize(example.text_b)
-        # Modifies `tokens_a` and `tokens_b` in place so that the total
-        # length is less than the specified length.
-        # Account for [CLS], [SEP], [SEP] with "- 3". " -4" for RoBERTa.
-        special_tokens_count = 4 if sep_token_extra else 3
-        _truncate_seq_pair(tokens_a, tokens_b, max_seq_length - special_tokens_count)
-    else:
-        # Account for [CLS] and [SEP] with "- 2" and with "- 3" for RoBERTa.
-        special_tokens_count = 3 if sep_token_extra else 2
-        if len(tokens_a) > max_seq_length - special_tokens_count:
-            tokens_a = tokens_a[: (max_seq_length - special_tokens_count)]
-
-    # The convention in BERT is:
-    # (a) For sequence pairs:
-    #  tokens:   [CLS] is this jack ##son ##ville ? [SEP] no it is not . [SEP]
-    #  type_ids:   0   0  0    0    0     0       0   0   1  1  1  1   1   1
-    # (b) For single sequences:
-    #  tokens:   [CLS] the dog is hairy . [SEP]
-    #  type_ids:   0   0   0   0  0     0   0
-    #
-    # Where "type_ids" are used to indicate whether this is the first
-    # sequence or the second sequence. The embedding vectors for `type=0` and
-    # `type=1` were learned during pre-training and are added to the wordpiece
-    # embedding vector (and position vector). This is not *strictly* necessary
-    # since the [SEP] token unambiguously separates the sequences, but it makes
-    # it easier for the model to learn the concept of sequences.
-    #
-    # For classification tasks, the first vector (corresponding to [CLS]) is
-    # used as as the "sentence vector". Note that this only makes sense because
-    # the entire model is fine-tuned.
-    tokens = tokens_a + [sep_token]
-    segment_ids = [sequence_a_segment_id] * len(tokens)
-
-    if tokens_b:
-        if sep_token_extra:
-            tokens += [sep_token]
-            segment_ids += [sequence_b_segment_id]
-
-        tokens += tokens_b + [sep_token]
-
-        segment_ids += [sequence_b_segment_id] * (len(tokens_b) + 1)
-
-    if cls_token_at_end:
-        tokens = tokens + [cls_token]
-        segment_ids = segment_ids + [cls_token_segment_id]
-    else:
-        tokens = [cls_token] + tokens
-        segment_ids = [cls_token_segment_id] + segment_ids
-
-    input_ids = tokenizer.convert_tokens_to_ids(tokens)
-
-    # The mask has 1 for real tokens and 0 for padding tokens. Only real
-    # tokens are attended to.
-    input_mask = [1 if mask_padding_with_zero else 0] * len(input_ids)
-
-    # Zero-pad up to the sequence length.
-    if pad_to_max_length:
-        padding_length = max_seq_length - len(input_ids)
-        if pad_on_left:
-            input_ids = ([pad_token] * padding_length) + input_ids
-            input_mask = (
-                                 [0 if mask_padding_with_zero else 1] * padding_length
-                         ) + input_mask
-            segment_ids = ([pad_token_segment_id] * padding_length) + segment_ids
-        else:
-            input_ids = input_ids + ([pad_token] * padding_length)
-            input_mask = input_mask + (
-                    [0 if mask_padding_with_zero else 1] * padding_length
-            )
-            segment_ids = segment_ids + ([pad_token_segment_id] * padding_length)
-
-        assert len(input_ids) == max_seq_length
-        assert len(input_mask) == max_seq_length
-        assert len(segment_ids) == max_seq_length
-
-    return InputFeatures(
-        input_ids=input_ids,
-        input_mask=input_mask,
-        segment_ids=segment_ids,
-        label_id=example.label,
-    )
+    """Features of a single example row of convert_examples_to_features, encoded by the batched path"""
+    example, max_seq_length, tokenizer = example_row[:3]
+    add_prefix_space, pad_to_max_length = example_row[-2:]
+    arrays = encode_examples([example], tokenizer, max_seq_length, pad_to_max_length, add_prefix_space)
+    return feature_arrays_to_input_features(arrays, [example.label])[0]
 
 
 def convert_example_to_feature_sliding_window(
@@ -572,114 +979,16 @@ def convert_example_to_feature_sliding_window(
         mask_padding_with_zero=True,
         sep_token_extra=False,
 ):
-    (
-        example,
-        max_seq_length,
-        tokenizer,
-        output_mode,
-        cls_token_at_end,
-        cls_token,
-        sep_token,
-        cls_token_segment_id,
-        pad_on_left,
-        pad_token_segment_id,
-        sep_token_extra,
-        multi_label,
-        stride,
-        pad_token,
-        add_prefix_space,
-        pad_to_max_length,
-    ) = example_row
-
-    if stride < 1:
-        stride = int(max_seq_length * stride)
-
-    bucket_size = max_seq_length - (3 if sep_token_extra else 2)
-    token_sets = []
-
-    if add_prefix_space and not example.text_a.startswith(" "):
-        tokens_a = tokenizer.tokenize(" " + example.text_a)
-    else:
-        tokens_a = tokenizer.tokenize(example.text_a)
-
-    if len(tokens_a) > bucket_size:
-        token_sets = [
-            tokens_a[i: i + bucket_size] for i in range(0, len(tokens_a), stride)
-        ]
-    else:
-        token_sets.append(tokens_a)
+    """Window features of a single example row of convert_examples_to_features, encoded by the batched path"""
+    example, max_seq_length, tokenizer = example_row[:3]
+    stride, _, add_prefix_space, _ = example_row[-4:]
+    arrays, window_counts = window_examples([example], tokenizer, max_seq_length, stride, add_prefix_space)
+    return feature_arrays_to_input_features(arrays, [example.label] * int(window_counts[0]))
 
-    if example.text_b:
-        raise ValueError(
-            "Sequence pair tasks not implemented for sliding window tokenization."
-        )
 
-    # The convention in BERT is:
-    # (a) For sequence pairs:
-    #  tokens:   [CLS] is this jack ##son ##ville ? [SEP] no it is not . [SEP]
-    #  type_ids:   0   0  0    0    0     0       0   0   1  1  1  1   1   1
-    # (b) For single sequences:
-    #  tokens:   [CLS] the dog is hairy . [SEP]
-    #  type_ids:   0   0   0   0  0     0   0
-    #
-    # Where "type_ids" are used to indicate whether this is the first
-    # sequence or the second sequence. The embedding vectors for `type=0` and
-    # `type=1` were learned during pre-training and are added to the wordpiece
-    # embedding vector (and position vector). This is not *strictly* necessary
-    # since the [SEP] token unambiguously separates the sequences, but it makes
-    # it easier for the model to learn the concept of sequences.
-    #
-    # For classification tasks, the first vector (corresponding to [CLS]) is
-    # used as as the "sentence vector". Note that this only makes sense because
-    # the entire model is fine-tuned.
-
-    input_features = []
-    for tokens_a in token_sets:
-        tokens = tokens_a + [sep_token]
-        segment_ids = [sequence_a_segment_id] * len(tokens)
-
-        if cls_token_at_end:
-            tokens = tokens + [cls_token]
-            segment_ids = segment_ids + [cls_token_segment_id]
-        else:
-            tokens = [cls_token] + tokens
-            segment_ids = [cls_token_segment_id] + segment_ids
-
-        input_ids = tokenizer.convert_tokens_to_ids(tokens)
-
-        # The mask has 1 for real tokens and 0 for padding tokens. Only real
-        # tokens are attended to.
-        input_mask = [1 if mask_padding_with_zero else 0] * len(input_ids)
-
-        # Zero-pad up to the sequence length.
-        padding_length = max_seq_length - len(input_ids)
-        if pad_on_left:
-            input_ids = ([pad_token] * padding_length) + input_ids
-            input_mask = (
-                                 [0 if mask_padding_with_zero else 1] * padding_length
-                         ) + input_mask
-            segment_ids = ([pad_token_segment_id] * padding_length) + segment_ids
-        else:
-            input_ids = input_ids + ([pad_token] * padding_length)
-            input_mask = input_mask + (
-                    [0 if mask_padding_with_zero else 1] * padding_length
-            )
-            segment_ids = segment_ids + ([pad_token_segment_id] * padding_length)
-
-        assert len(input_ids) == max_seq_length
-        assert len(input_mask) == max_seq_length
-        assert len(segment_ids) == max_seq_length
-
-        input_features.append(
-            InputFeatures(
-                input_ids=input_ids,
-                input_mask=input_mask,
-                segment_ids=segment_ids,
-                label_id=example.label,
-            )
-        )
-
-    return input_features
+def _window_examples_in_worker(task):
+    examples, max_seq_length, stride, add_prefix_space = task
+    return window_examples(examples, _worker_tokenizer, max_seq_length, stride, add_prefix_space)
 
 
 def convert_examples_to_features(
@@ -710,109 +1019,105 @@ def convert_examples_to_features(
         args=None,
 ):
     """Loads a data file into a list of `InputBatch`s
-    `cls_token_at_end` define the location of the CLS token:
-        - False (Default, BERT/XLM pattern): [CLS] + A + [SEP] + B + [SEP]
-        - True (XLNet/GPT pattern): A + [SEP] + B + [SEP] + [CLS]
-    `cls_token_segment_id` define the segment id associated to the CLS token (0 for BERT, 2 for XLNet)
+    The examples are tokenized by batched tokenizer calls, in the TokenizerPool if use_multiprocessing.
+    The special tokens, their segment ids and the padding side are the ones of the tokenizer, eg: XLNet
+    tokenizers put the CLS token at the end and pad on the left, the token arguments are kept for compatibility.
     """
-
-    examples = [
-        (
-            example,
-            max_seq_length,
-            tokenizer,
-            output_mode,
-            cls_token_at_end,
-            cls_token,
-            sep_token,
-            cls_token_segment_id,
-            pad_on_left,
-            pad_token_segment_id,
-            sep_token_extra,
-            multi_label,
-            stride,
-            pad_token,
-            add_prefix_space,
-            pad_to_max_length,
-        )
-        for example in examples
-    ]
-
+    labels = [example.label for example in examples]
     if use_multiprocessing:
         if args.multiprocessing_chunksize == -1:
             chunksize = max(len(examples) // (args.process_count * 2), 500)
         else:
             chunksize = args.multiprocessing_chunksize
-        if sliding_window:
-            with Pool(process_count) as p:
-                features = list(
-                    tqdm(
-                        p.imap(
-                            convert_example_to_feature_sliding_window,
-                            examples,
-                            chunksize=chunksize,
-                        ),
-                        total=len(examples),
-                        disable=silent,
-                    )
-                )
-            if flatten:
-                features = [
-                    feature for feature_set in features for feature in feature_set
-                ]
-        else:
-            with Pool(process_count) as p:
-                features = list(
-                    tqdm(
-                        p.imap(
-                            convert_example_to_feature, examples, chunksize=chunksize
-                        ),
-                        total=len(examples),
-                        disable=silent,
-                    )
-                )
-    else:
-        if sliding_window:
-            features = [
-                convert_example_to_feature_sliding_window(example)
-                for example in tqdm(examples, disable=silent)
+        pool = get_tokenizer_pool(tokenizer, process_count)
+
+    if sliding_window:
+        if use_multiprocessing:
+            tasks = [
+                (examples[i: i + chunksize], max_seq_length, stride, add_prefix_space)
+                for i in range(0, len(examples), chunksize)
             ]
-            if flatten:
-                features = [
-                    feature for feature_set in features for feature in feature_set
-                ]
+            chunks = list(tqdm(pool.imap(_window_examples_in_worker, tasks), total=len(tasks), disable=silent))
+            arrays = {key: np.concatenate([chunk[key] for chunk, _ in chunks]) for key in chunks[0][0]}
+            window_counts = np.concatenate([counts for _, counts in chunks])
         else:
-            features = [
-                convert_example_to_feature(example)
-                for example in tqdm(examples, disable=silent)
-            ]
+            arrays, window_counts = window_examples(examples, tokenizer, max_seq_length, stride, add_prefix_space)
+        window_labels = [label for label, count in zip(labels, window_counts) for _ in range(count)]
+        window_features = feature_arrays_to_input_features(arrays, window_labels)
+        if flatten:
+            return window_features
+        bounds = np.concatenate([[0], np.cumsum(window_counts)])
+        return [window_features[bounds[i]: bounds[i + 1]] for i in range(len(examples))]
 
-    return features
+    if use_multiprocessing:
+        text_a, text_b = example_texts(examples, add_prefix_space)
+        arrays = pool.encode(text_a, text_b, max_seq_length, not pad_to_max_length, chunksize, silent)
+    else:
+        arrays = encode_examples(examples, tokenizer, max_seq_length, pad_to_max_length, add_prefix_space)
+    return feature_arrays_to_input_features(arrays, labels)
 
 
-def _truncate_seq_pair(tokens_a, tokens_b, max_length):
-    """Truncates a sequence pair in place to the maximum length."""
+LINE_OFFSETS_SUFFIX = ".offsets.npy"
 
-    # This is a simple heuristic which will always truncate the longer sequence
-    # one token at a time. This makes more sense than truncating an equal percent
-    # of tokens from each, since if one sequence is very short then each token
-    # that's truncated likely contains more information than a longer sequence.
 
-    while True:
-        total_length = len(tokens_a) + len(tokens_b)
-        if total_length <= max_length:
-            break
-        if len(tokens_a) > len(tokens_b):
-            tokens_a.pop()
-        else:
-            tokens_b.pop()
+def build_line_offsets(data_file, chunk_size=1 << 24):
+    """
+    Byte offsets of the line starts of a file, found chunk by chunk with numpy, a final line without newline counts
+    @return: np.uint64 array (n_lines + 1,), the last entry is the file size
+    """
+    starts = [np.zeros(1, dtype=np.uint64)]
+    position = 0
+    with open(data_file, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            newlines = np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == ord("\n"))
+            starts.append((newlines + position + 1).astype(np.uint64))
+            position += len(chunk)
+    offsets = np.concatenate(starts)
+    if offsets[-1] != position:
+        offsets = np.append(offsets, np.uint64(position))
+    return offsets
+
+
+def load_line_offsets(data_file):
+    """
+    Line offsets of data_file, from the index persisted next to it (data_file + LINE_OFFSETS_SUFFIX), built and
+    saved if missing or older than the file. The index is memory-mapped.
+    """
+    index_file = data_file + LINE_OFFSETS_SUFFIX
+    if (
+            os.path.exists(index_file)
+            and os.path.getmtime(index_file) >= os.path.getmtime(data_file)
+    ):
+        offsets = np.load(index_file, mmap_mode="r")
+        if len(offsets) and int(offsets[-1]) == os.path.getsize(data_file):
+            return offsets
+    offsets = build_line_offsets(data_file)
+    tmp_file = f"{index_file}.tmp{os.getpid()}.npy"
+    try:
+        np.save(tmp_file, offsets)
+        os.replace(tmp_file, index_file)
+    except OSError as e:
+        logger.warning(f"line offsets of {data_file} not saved: {e}")
+    return offsets
 
 
 class LazyClassificationDataset(Dataset):
+    """
+    Rows of a delimited text file read on demand, the file stays on disk: lines are located by a persisted
+    byte offset index (see load_line_offsets) and read from a mmap of the file.
+    Items are raw (text, label) or ((text_a, text_b), label), tokenized a batch at a time by collate,
+    use it as the collate_fn of the DataLoader.
+    """
+
     def __init__(self, data_file, tokenizer, args):
         self.data_file = data_file
         self.start_row = args.lazy_loading_start_line
-        self.num_entries = self._get_n_lines(self.data_file, self.start_row)
+        # line i spans offsets[i]: offsets[i + 1]
+        self.offsets = load_line_offsets(data_file)[self.start_row:]
+        self.num_entries = max(len(self.offsets) - 1, 0)
         self.tokenizer = tokenizer
         self.args = args
         self.delimiter = args.lazy_delimiter
@@ -825,62 +1130,54 @@ class LazyClassificationDataset(Dataset):
             self.text_a_column = None
             self.text_b_column = None
         self.labels_column = args.lazy_labels_column
+        self._mmap = None
 
-    @staticmethod
-    def _get_n_lines(data_file, start_row):
-        with open(data_file, encoding="utf-8") as f:
-            for line_idx, _ in enumerate(f, 1):
-                pass
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # each dataloader worker maps the file again
+        state["_mmap"] = None
+        return state
 
-        return line_idx - start_row
+    def _read_line(self, idx):
+        if self._mmap is None:
+            with open(self.data_file, "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        start, end = int(self.offsets[idx]), int(self.offsets[idx + 1])
+        return self._mmap[start:end].decode("utf-8").rstrip("\n")
 
     def __getitem__(self, idx):
-        line = (
-            linecache.getline(self.data_file, idx + 1 + self.start_row)
-                .rstrip("\n")
-                .split(self.delimiter)
-        )
-
+        line = self._read_line(idx).split(self.delimiter)
+        label = line[self.labels_column]
+        # If labels_map is defined, then labels need to be replaced with ints
+        if self.args.labels_map and not self.args.regression:
+            label = self.args.labels_map[label]
+        label = float(label) if self.args.regression else int(label)
         if not self.text_a_column and not self.text_b_column:
-            text = line[self.text_column]
-            label = line[self.labels_column]
-
-            # If labels_map is defined, then labels need to be replaced with ints
-            if self.args.labels_map:
-                label = self.args.labels_map[label]
-            if self.args.regression:
-                label = torch.tensor(float(label), dtype=torch.float)
-            else:
-                label = torch.tensor(int(label), dtype=torch.long)
-
-            return (
-                self.tokenizer.encode_plus(
-                    text,
-                    max_length=self.args.max_seq_length,
-                    pad_to_max_length=self.args.max_seq_length,
-                    return_tensors="pt",
-                ),
-                label,
-            )
-        else:
-            text_a = line[self.text_a_column]
-            text_b = line[self.text_b_column]
-            label = line[self.labels_column]
-            if self.args.regression:
-                label = torch.tensor(float(label), dtype=torch.float)
-            else:
-                label = torch.tensor(int(label), dtype=torch.long)
-
-            return (
-                self.tokenizer.encode_plus(
-                    text_a,
-                    text_pair=text_b,
-                    max_length=self.args.max_seq_length,
-                    pad_to_max_length=self.args.max_seq_length,
-                    return_tensors="pt",
-                ),
-                label,
-            )
+            return line[self.text_column], label
+        return (line[self.text_a_column], line[self.text_b_column]), label
+
+    def collate(self, batch):
+        """
+        Tokenize a batch of items in one tokenizer call
+        @return: features, dict of LongTensor (batch_size, seq_length); labels, tensor (batch_size,)
+        """
+        texts = [text for text, _ in batch]
+        text_pair = None
+        if isinstance(texts[0], tuple):
+            texts, text_pair = [text_a for text_a, _ in texts], [text_b for _, text_b in texts]
+        features = self.tokenizer(
+            text=texts,
+            text_pair=text_pair,
+            max_length=self.args.max_seq_length,
+            truncation=True,
+            # dynamic padding pads to the longest row of the batch
+            padding=True if self.args.dynamic_padding else "max_length",
+            return_tensors="pt",
+        )
+        labels = torch.tensor(
+            [label for _, label in batch], dtype=torch.float if self.args.regression else torch.long
+        )
+        return dict(features), labels
 
     def __len__(self):
         return self.num_entries
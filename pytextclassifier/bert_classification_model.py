@@ -11,7 +11,6 @@ import random
 import sys
 import tempfile
 import warnings
-from collections import Counter
 from dataclasses import asdict
 from pathlib import Path
 
@@ -31,7 +30,7 @@ from sklearn.metrics import (
     classification_report,
     precision_recall_fscore_support,
 )
-from torch.utils.data import DataLoader, RandomSampler, SequentialSampler
+from torch.utils.data import DataLoader, RandomSampler, SequentialSampler, Subset
 from torch.utils.tensorboard import SummaryWriter
 from tqdm.auto import tqdm, trange
 from transformers import (
@@ -99,9 +98,14 @@ from pytextclassifier.bert_classfication_utils import (
     InputExample,
     LazyClassificationDataset,
     ClassificationDataset,
+    DynamicPaddingCollator,
+    LengthBucketBatchSampler,
     load_hf_dataset,
     flatten_results,
     init_loss,
+    load_tokenizer,
+    pool_windows,
+    vote_windows,
 )
 from pytextclassifier.bert_multi_label_classification_model import (
     AlbertForMultiLabelSequenceClassification,
@@ -424,8 +428,13 @@ class BertClassificationModel:
         if tokenizer_name is None:
             tokenizer_name = model_name
 
-        self.tokenizer = tokenizer_class.from_pretrained(
-            tokenizer_name, do_lower_case=self.args.do_lower_case, **kwargs
+        # fast tokenizers encode batches in Rust, the slow class is the fallback
+        self.tokenizer = load_tokenizer(
+            tokenizer_class,
+            tokenizer_name,
+            use_fast=self.args.use_fast_tokenizer,
+            do_lower_case=self.args.do_lower_case,
+            **kwargs,
         )
 
         if self.args.special_tokens_list:
@@ -546,13 +555,7 @@ class BertClassificationModel:
             train_dataset = self.load_and_cache_examples(
                 train_examples, verbose=verbose
             )
-        train_sampler = RandomSampler(train_dataset)
-        train_dataloader = DataLoader(
-            train_dataset,
-            sampler=train_sampler,
-            batch_size=self.args.train_batch_size,
-            num_workers=self.args.dataloader_num_workers,
-        )
+        train_dataloader = self._get_train_dataloader(train_dataset)
 
         os.makedirs(output_dir, exist_ok=True)
 
@@ -1307,6 +1310,8 @@ class BertClassificationModel:
         eval_output_dir = output_dir
 
         results = {}
+        if args.sliding_window and (args.use_hf_datasets or args.lazy_loading):
+            raise ValueError("sliding_window is not supported with use_hf_datasets or lazy_loading")
         if self.args.use_hf_datasets:
             eval_dataset = load_hf_dataset(
                 eval_df, self.tokenizer, self.args, multi_label=self.multi_label
@@ -1351,10 +1356,7 @@ class BertClassificationModel:
                 )
         os.makedirs(eval_output_dir, exist_ok=True)
 
-        eval_sampler = SequentialSampler(eval_dataset)
-        eval_dataloader = DataLoader(
-            eval_dataset, sampler=eval_sampler, batch_size=args.eval_batch_size
-        )
+        eval_dataloader, eval_order = self._get_eval_dataloader(eval_dataset)
 
         if args.n_gpu > 1:
             model = torch.nn.DataParallel(model)
@@ -1425,52 +1427,28 @@ class BertClassificationModel:
 
         eval_loss = eval_loss / nb_eval_steps
 
+        if eval_order is not None:
+            # Batches ran in length-sorted order, put the outputs back in input order
+            preds[eval_order] = preds.copy()
+            out_label_ids[eval_order] = out_label_ids.copy()
+
         if args.sliding_window:
-            count = 0
-            window_ranges = []
-            for n_windows in window_counts:
-                window_ranges.append([count, count + n_windows])
-                count += n_windows
-
-            preds = [
-                preds[window_range[0]: window_range[1]]
-                for window_range in window_ranges
-            ]
-            out_label_ids = [
-                out_label_ids[i]
-                for i in range(len(out_label_ids))
-                if i in [window[0] for window in window_ranges]
-            ]
+            # one row per example, the outputs of its windows pooled
+            window_preds = preds
+            out_label_ids = out_label_ids[np.cumsum(window_counts) - window_counts]
+            preds = self._pool_windows(window_preds, window_counts)
 
-            model_outputs = preds
-            if args.regression is True:
-                preds = [np.squeeze(pred) for pred in preds]
-                final_preds = []
-                for pred_row in preds:
-                    mean_pred = np.mean(pred_row)
-                    print(mean_pred)
-                    final_preds.append(mean_pred)
-            else:
-                preds = [np.argmax(pred, axis=1) for pred in preds]
-                final_preds = []
-                for pred_row in preds:
-                    val_freqs_desc = Counter(pred_row).most_common()
-                    if (
-                            len(val_freqs_desc) > 1
-                            and val_freqs_desc[0][1] == val_freqs_desc[1][1]
-                    ):
-                        final_preds.append(args.tie_value)
-                    else:
-                        final_preds.append(val_freqs_desc[0][0])
-            preds = np.array(final_preds)
-        elif not self.multi_label and args.regression is True:
+        if not self.multi_label and args.regression is True:
             preds = np.squeeze(preds)
             model_outputs = preds
         else:
             model_outputs = preds
 
             if not self.multi_label:
-                preds = np.argmax(preds, axis=1)
+                if args.sliding_window and args.sliding_window_pooling == "vote":
+                    preds = vote_windows(window_preds, window_counts, args.tie_value)
+                else:
+                    preds = np.argmax(preds, axis=1)
 
         result, wrong = self.compute_metrics(
             preds, model_outputs, out_label_ids, eval_examples, **kwargs
@@ -1539,6 +1517,7 @@ class BertClassificationModel:
     ):
         """
         Converts a list of InputExample objects to a TensorDataset containing InputFeatures. Caches the InputFeatures.
+        With args.sliding_window, evaluation returns the dataset of windows and the number of windows of each example.
 
         Utility function for train() and eval() methods. Not intended to be used directly.
         """
@@ -1565,6 +1544,8 @@ class BertClassificationModel:
             output_mode=output_mode,
             no_cache=no_cache,
         )
+        if args.sliding_window and evaluate:
+            return dataset, dataset.window_counts
         return dataset
 
     def compute_metrics(
@@ -1734,52 +1715,10 @@ class BertClassificationModel:
         else:
             out_label_ids = np.empty((len(to_predict)))
 
-        if not self.multi_label and self.args.onnx:
-            model_inputs = self.tokenizer.batch_encode_plus(
-                to_predict, return_tensors="pt", padding=True, truncation=True
-            )
-
-            if self.args.model_type in ["bert", "xlnet", "albert"]:
-                for i, (input_ids, attention_mask, token_type_ids) in enumerate(
-                        zip(
-                            model_inputs["input_ids"],
-                            model_inputs["attention_mask"],
-                            model_inputs["token_type_ids"],
-                        )
-                ):
-                    input_ids = input_ids.unsqueeze(0).detach().cpu().numpy()
-                    attention_mask = attention_mask.unsqueeze(0).detach().cpu().numpy()
-                    token_type_ids = token_type_ids.unsqueeze(0).detach().cpu().numpy()
-                    inputs_onnx = {
-                        "input_ids": input_ids,
-                        "attention_mask": attention_mask,
-                        "token_type_ids": token_type_ids,
-                    }
-
-                    # Run the model (None = get all the outputs)
-                    output = self.model.run(None, inputs_onnx)
-
-                    preds[i] = output[0]
-
-            else:
-                for i, (input_ids, attention_mask) in enumerate(
-                        zip(model_inputs["input_ids"], model_inputs["attention_mask"])
-                ):
-                    input_ids = input_ids.unsqueeze(0).detach().cpu().numpy()
-                    attention_mask = attention_mask.unsqueeze(0).detach().cpu().numpy()
-                    inputs_onnx = {
-                        "input_ids": input_ids,
-                        "attention_mask": attention_mask,
-                    }
-
-                    # Run the model (None = get all the outputs)
-                    output = self.model.run(None, inputs_onnx)
-
-                    preds[i] = output[0]
-
-            model_outputs = preds
-            preds = np.argmax(preds, axis=1)
-
+        if self.args.onnx:
+            preds = self._predict_onnx(to_predict)
+            if self.multi_label:
+                preds = 1 / (1 + np.exp(-preds))
         else:
             self._move_model_to_device()
             dummy_label = (
@@ -1819,9 +1758,9 @@ class BertClassificationModel:
                     eval_examples, evaluate=True, no_cache=True
                 )
 
-            eval_sampler = SequentialSampler(eval_dataset)
-            eval_dataloader = DataLoader(
-                eval_dataset, sampler=eval_sampler, batch_size=args.eval_batch_size
+            # Hidden states are concatenated across batches, so they need one fixed length and the input order
+            eval_dataloader, eval_order = self._get_eval_dataloader(
+                eval_dataset, sort_by_length=not self.config.output_hidden_states
             )
 
             if self.args.fp16:
@@ -1954,30 +1893,41 @@ class BertClassificationModel:
                         inputs["labels"].detach().cpu().numpy()
                     )
 
+                if eval_order is not None:
+                    # Batches ran in length-sorted order, put the outputs back in input order
+                    preds[eval_order] = preds.copy()
+
             eval_loss = eval_loss / nb_eval_steps
 
-            if not self.multi_label and args.regression is True:
-                preds = np.squeeze(preds)
-                model_outputs = preds
-            else:
-                model_outputs = preds
-                if self.multi_label:
-                    if isinstance(args.threshold, list):
-                        threshold_values = args.threshold
-                        preds = [
-                            [
-                                self._threshold(pred, threshold_values[i])
-                                for i, pred in enumerate(example)
-                            ]
-                            for example in preds
-                        ]
-                    else:
-                        preds = [
-                            [self._threshold(pred, args.threshold) for pred in example]
-                            for example in preds
+            if args.sliding_window:
+                # one row per text, the outputs of its windows pooled
+                window_preds = preds
+                preds = self._pool_windows(window_preds, window_counts)
+
+        if not self.multi_label and args.regression is True:
+            preds = np.squeeze(preds)
+            model_outputs = preds
+        else:
+            model_outputs = preds
+            if self.multi_label:
+                if isinstance(args.threshold, list):
+                    threshold_values = args.threshold
+                    preds = [
+                        [
+                            self._threshold(pred, threshold_values[i])
+                            for i, pred in enumerate(example)
                         ]
+                        for example in preds
+                    ]
                 else:
-                    preds = np.argmax(preds, axis=1)
+                    preds = [
+                        [self._threshold(pred, args.threshold) for pred in example]
+                        for example in preds
+                    ]
+            elif args.sliding_window and args.sliding_window_pooling == "vote" and not args.onnx:
+                preds = vote_windows(window_preds, window_counts, args.tie_value)
+            else:
+                preds = np.argmax(preds, axis=1)
 
         if self.args.labels_map and not self.args.regression:
             inverse_labels_map = {
@@ -1990,6 +1940,62 @@ class BertClassificationModel:
         else:
             return preds, model_outputs
 
+    def _predict_onnx(self, to_predict):
+        """
+        Runs ONNX Runtime inference on to_predict.
+
+        Rows are encoded and run in chunks of args.eval_batch_size with one InferenceSession.run call per chunk.
+        Each chunk is padded only to its own longest row and fed to the session as numpy arrays.
+
+        Args:
+            to_predict: A python list of text (str), or of [text_a, text_b] pairs.
+
+        Returns:
+            model_outputs: numpy array of raw logits with shape (len(to_predict), num_labels).
+        """  # noqa: ignore flake8"
+        to_predict = list(to_predict)
+        input_names = {model_input.name for model_input in self.model.get_inputs()}
+        batch_size = self.args.eval_batch_size
+        model_outputs = np.empty((len(to_predict), self.num_labels))
+        if self.args.dynamic_padding:
+            # Chunk rows of similar character length together, so each chunk pads to a similar length
+            order = np.argsort([len(str(row)) for row in to_predict], kind="stable")
+        else:
+            order = np.arange(len(to_predict))
+
+        for start_index in tqdm(
+                range(0, len(to_predict), batch_size),
+                disable=self.args.silent,
+                desc="Running ONNX Prediction",
+        ):
+            batch_indices = order[start_index: start_index + batch_size]
+            batch = [to_predict[i] for i in batch_indices]
+            if isinstance(batch[0], list):
+                text_a = [row[0] for row in batch]
+                text_b = [row[1] for row in batch]
+            else:
+                text_a = batch
+                text_b = None
+            model_inputs = self.tokenizer(
+                text=text_a,
+                text_pair=text_b,
+                padding=True,
+                truncation=True,
+                max_length=self.args.max_seq_length,
+                return_tensors="np",
+            )
+            inputs_onnx = {
+                key: value.astype(np.int64)
+                for key, value in model_inputs.items()
+                if key in input_names
+            }
+
+            # Run the model (None = get all the outputs)
+            output = self.model.run(None, inputs_onnx)
+            model_outputs[batch_indices] = output[0]
+
+        return model_outputs
+
     def convert_to_onnx(self, output_dir=None, set_onnx_arg=True):
         """Convert the model to ONNX format and save to output_dir
 
@@ -2039,6 +2045,16 @@ class BertClassificationModel:
             loss = loss_fct(logits.view(-1, num_labels), labels.view(-1))
         return (loss, *outputs[1:])
 
+    def _pool_windows(self, window_outputs, window_counts):
+        """
+        Outputs of each example pooled over its windows, see pool_windows. Votes are counted for single label
+        classification only, regression and multi-label outputs are averaged instead.
+        """
+        pooling = self.args.sliding_window_pooling
+        if pooling == "vote" and (self.args.regression or self.multi_label):
+            pooling = "mean"
+        return pool_windows(window_outputs, window_counts, pooling)
+
     def _threshold(self, x, threshold):
         if x >= threshold:
             return 1
@@ -2074,6 +2090,100 @@ class BertClassificationModel:
 
         return inputs
 
+    def _pads_dynamically(self, dataset):
+        # ClassificationDataset windows of args.sliding_window are unpadded too
+        if isinstance(dataset, ClassificationDataset):
+            return dataset.dynamic_padding
+        return self.args.dynamic_padding
+
+    def _get_train_dataloader(self, train_dataset):
+        """
+        Builds the training DataLoader.
+
+        With args.dynamic_padding or args.sliding_window, each batch is padded to its own longest row at collate
+        time, and ClassificationDataset examples are additionally bucketed by length to keep the padding small.
+        """
+        if isinstance(train_dataset, LazyClassificationDataset):
+            # rows are read by index, and tokenized a batch at a time
+            return DataLoader(
+                train_dataset,
+                sampler=RandomSampler(train_dataset),
+                batch_size=self.args.train_batch_size,
+                num_workers=self.args.dataloader_num_workers,
+                collate_fn=train_dataset.collate,
+            )
+        if not self._pads_dynamically(train_dataset):
+            return DataLoader(
+                train_dataset,
+                sampler=RandomSampler(train_dataset),
+                batch_size=self.args.train_batch_size,
+                num_workers=self.args.dataloader_num_workers,
+            )
+
+        collate_fn = DynamicPaddingCollator(self.tokenizer)
+        if isinstance(train_dataset, ClassificationDataset):
+            batch_sampler = LengthBucketBatchSampler(
+                train_dataset.lengths,
+                self.args.train_batch_size,
+                bucket_batches=self.args.dynamic_padding_bucket_batches,
+            )
+            return DataLoader(
+                train_dataset,
+                batch_sampler=batch_sampler,
+                num_workers=self.args.dataloader_num_workers,
+                collate_fn=collate_fn,
+            )
+        return DataLoader(
+            train_dataset,
+            sampler=RandomSampler(train_dataset),
+            batch_size=self.args.train_batch_size,
+            num_workers=self.args.dataloader_num_workers,
+            collate_fn=collate_fn,
+        )
+
+    def _get_eval_dataloader(self, eval_dataset, sort_by_length=True):
+        """
+        Builds the sequential evaluation DataLoader.
+
+        With args.dynamic_padding or args.sliding_window, ClassificationDataset examples (or windows) are run
+        sorted by length and the sort order is returned, so callers can restore outputs to input order;
+        otherwise the returned order is None.
+        """
+        if isinstance(eval_dataset, LazyClassificationDataset):
+            eval_dataloader = DataLoader(
+                eval_dataset,
+                sampler=SequentialSampler(eval_dataset),
+                batch_size=self.args.eval_batch_size,
+                collate_fn=eval_dataset.collate,
+            )
+            return eval_dataloader, None
+        if not self._pads_dynamically(eval_dataset):
+            eval_dataloader = DataLoader(
+                eval_dataset,
+                sampler=SequentialSampler(eval_dataset),
+                batch_size=self.args.eval_batch_size,
+            )
+            return eval_dataloader, None
+
+        if not sort_by_length:
+            collate_fn = DynamicPaddingCollator(
+                self.tokenizer, pad_to_length=self.args.max_seq_length
+            )
+            eval_dataloader = DataLoader(
+                eval_dataset, batch_size=self.args.eval_batch_size, collate_fn=collate_fn
+            )
+            return eval_dataloader, None
+
+        collate_fn = DynamicPaddingCollator(self.tokenizer)
+        eval_order = None
+        if isinstance(eval_dataset, ClassificationDataset):
+            eval_order = np.argsort(eval_dataset.lengths, kind="stable")
+            eval_dataset = Subset(eval_dataset, eval_order)
+        eval_dataloader = DataLoader(
+            eval_dataset, batch_size=self.args.eval_batch_size, collate_fn=collate_fn
+        )
+        return eval_dataloader, eval_order
+
     def _get_last_metrics(self, metric_values):
         return {metric: values[-1] for metric, values in metric_values.items()}
 
@@ -157,12 +157,38 @@ class BertClassifier(ClassifierABC):
             return predictions, raw_outputs
         else:
             # predict probability
-            id_label_map = {v: k for k, v in self.label_id_map.items()}
-            predict_labels = [id_label_map.get(i) for i in predictions]
-            predict_probs = [1 - np.exp(-raw_output[prediction]) for raw_output, prediction in
-                             zip(raw_outputs, predictions)]
+            predictions = np.asarray(predictions, dtype=np.int64)
+            predict_labels = self.id_label[predictions].tolist()
+            raw_outputs = np.asarray(raw_outputs)
+            predict_probs = (1 - np.exp(-raw_outputs[np.arange(len(predictions)), predictions])).tolist()
             return predict_labels, predict_probs
 
+    def predict_proba(self, sentences: list):
+        """
+        Predict the probability of all labels for sentences, softmax of the logits,
+        or the sigmoid outputs of each label if multi_label.
+        @param sentences: list, input text list, eg: [text1, text2, ...]
+        @return: probs, array (n_samples, n_labels), columns in the order of self.labels
+        """
+        if not self.is_trained:
+            raise ValueError('model not trained.')
+        _, raw_outputs = self.model.predict(sentences)
+        raw_outputs = np.asarray(raw_outputs, dtype=np.float64)
+        if self.multi_label:
+            return raw_outputs
+        raw_outputs -= raw_outputs.max(axis=1, keepdims=True)
+        np.exp(raw_outputs, out=raw_outputs)
+        return raw_outputs / raw_outputs.sum(axis=1, keepdims=True)
+
+    @property
+    def id_label(self):
+        """
+        Labels in the column order of predict_proba, label indexes if multi_label
+        """
+        if self.multi_label:
+            return np.arange(self.num_classes)
+        return super().id_label
+
     def evaluate_model(self, data_list_or_path, header=None,
                        names=('labels', 'text'), delimiter='\t'):
         X_test, y_test, data_df = load_data(data_list_or_path, header=header, names=names, delimiter=delimiter)
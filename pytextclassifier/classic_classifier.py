@@ -8,21 +8,27 @@ import argparse
 import os
 import sys
 import pickle
+import time
+
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer, CountVectorizer
+from sklearn.feature_extraction.text import TfidfVectorizer, CountVectorizer, HashingVectorizer, TfidfTransformer
+from sklearn.pipeline import Pipeline
 from sklearn import metrics
 from sklearn.ensemble import RandomForestClassifier
-from sklearn.linear_model import LogisticRegression
+from sklearn.exceptions import NotFittedError
+from sklearn.linear_model import LogisticRegression, SGDClassifier
 from sklearn.naive_bayes import MultinomialNB
-from sklearn.neighbors import KNeighborsClassifier
-from sklearn.svm import SVC
 from sklearn.tree import DecisionTreeClassifier
 from sklearn.model_selection import train_test_split
+from sklearn.utils.validation import check_is_fitted
 from loguru import logger
 
 sys.path.append('..')
-from pytextclassifier.base_classifier import ClassifierABC, load_data
-from pytextclassifier.tokenizer import Tokenizer
+from pytextclassifier.ann_knn import AnnKNNClassifier
+from pytextclassifier.base_classifier import ClassifierABC, load_data, load_data_chunks
+from pytextclassifier.linear_scorer import LinearScorer
+from pytextclassifier.linear_svm import CalibratedLinearSVC
+from pytextclassifier.tokenizer import Tokenizer, NgramAnalyzer
 
 pwd_path = os.path.abspath(os.path.dirname(__file__))
 default_stopwords_path = os.path.join(pwd_path, 'stopwords.txt')
@@ -30,19 +36,21 @@ default_stopwords_path = os.path.join(pwd_path, 'stopwords.txt')
 
 class ClassicClassifier(ClassifierABC):
     def __init__(self, model_dir, model_name_or_model='lr', feature_name_or_feature='tfidf',
-                 stopwords_path=default_stopwords_path, tokenizer=None):
+                 stopwords_path=default_stopwords_path, tokenizer=None, n_jobs=1, n_features=2 ** 18):
         """
-        经典机器学习分类模型，支持lr, random_forest, decision_tree, knn, bayes, svm, xgboost
+        经典机器学习分类模型，支持lr, random_forest, decision_tree, knn, bayes, svm, xgboost, sgd
         @param model_dir: 模型保存路径
         @param model_name_or_model:
-        @param feature_name_or_feature:
+        @param feature_name_or_feature: tfidf, count, hashing, hashing_tfidf, or sklearn feature
         @param stopwords_path:
         @param tokenizer: 切词器，默认为jieba切词
+        @param n_jobs: 切词进程数，默认切词器有效，-1为全部cpu
+        @param n_features: hashing特征维度，hashing和hashing_tfidf有效
         """
         self.model_dir = model_dir
         if isinstance(model_name_or_model, str):
             model_name = model_name_or_model.lower()
-            if model_name not in ['lr', 'random_forest', 'decision_tree', 'knn', 'bayes', 'xgboost', 'svm']:
+            if model_name not in ['lr', 'random_forest', 'decision_tree', 'knn', 'bayes', 'xgboost', 'svm', 'sgd']:
                 raise ValueError('model_name not found.')
             logger.debug(f'model_name: {model_name}')
             self.model = self.get_model(model_name)
@@ -52,13 +60,24 @@ class ClassicClassifier(ClassifierABC):
             raise ValueError('model_name_or_model set error.')
         if isinstance(feature_name_or_feature, str):
             feature_name = feature_name_or_feature.lower()
-            if feature_name not in ['tfidf', 'count']:
+            if feature_name not in ['tfidf', 'count', 'hashing', 'hashing_tfidf']:
                 raise ValueError('feature_name not found.')
             logger.debug(f'feature_name: {feature_name}')
+            # token lists are passed to the vectorizer directly, see tokenize_sentences
             if feature_name == 'tfidf':
-                self.feature = TfidfVectorizer(ngram_range=(1, 2))
+                self.feature = TfidfVectorizer(analyzer=NgramAnalyzer(ngram_range=(1, 2)))
+            elif feature_name == 'count':
+                self.feature = CountVectorizer(analyzer=NgramAnalyzer(ngram_range=(1, 2)))
+            elif feature_name == 'hashing':
+                # stateless, no vocabulary: fixed width output, safe for parallel workers and partial_fit
+                self.feature = HashingVectorizer(analyzer=NgramAnalyzer(ngram_range=(1, 2)), n_features=n_features,
+                                                 alternate_sign=False)
             else:
-                self.feature = CountVectorizer(ngram_range=(1, 2))
+                self.feature = Pipeline([
+                    ('hashing', HashingVectorizer(analyzer=NgramAnalyzer(ngram_range=(1, 2)), n_features=n_features,
+                                                  alternate_sign=False, norm=None)),
+                    ('tfidf', TfidfTransformer()),
+                ])
         elif hasattr(feature_name_or_feature, 'fit_transform'):
             self.feature = feature_name_or_feature
         else:
@@ -66,7 +85,11 @@ class ClassicClassifier(ClassifierABC):
         self.is_trained = False
         self.stopwords = set(self.load_list(stopwords_path)) if stopwords_path and os.path.exists(
             stopwords_path) else set()
-        self.tokenizer = tokenizer if tokenizer else Tokenizer()
+        self.tokenizer = tokenizer if tokenizer else Tokenizer(n_jobs=n_jobs)
+        self.stage_timings = {}
+        # tokenize/transform/score seconds of the last predict or predict_proba call
+        self.predict_timings = {}
+        self.scorer = None
 
     def __str__(self):
         return f'ClassicClassifier instance ({self.model}, stopwords size: {len(self.stopwords)})'
@@ -80,14 +103,16 @@ class ClassicClassifier(ClassifierABC):
         elif model_type == "decision_tree":
             model = DecisionTreeClassifier()  # 速度快，准确率低。val mean acc:0.62
         elif model_type == "knn":
-            model = KNeighborsClassifier()  # 速度一般，准确率低。val mean acc:0.675
+            model = AnnKNNClassifier()  # 降维+IVF近似近邻检索，查询耗时与训练集大小亚线性
         elif model_type == "bayes":
             model = MultinomialNB(alpha=0.1, fit_prior=False)  # 速度快，准确率低。val mean acc:0.62
         elif model_type == "xgboost":
             from xgboost import XGBClassifier
             model = XGBClassifier()  # 速度慢，准确率高。val mean acc:0.95
         elif model_type == "svm":
-            model = SVC(kernel='linear', probability=True)  # 速度慢，准确率高，val mean acc:0.945
+            model = CalibratedLinearSVC(method='sigmoid')  # 速度快，准确率高，liblinear线性SVM，留出集sigmoid概率校准
+        elif model_type == "sgd":
+            model = SGDClassifier(loss='log_loss')  # 速度快，支持partial_fit增量训练
         else:
             raise ValueError('model type set error.')
         return model
@@ -100,10 +125,18 @@ class ClassicClassifier(ClassifierABC):
         """
         Tokenize input text
         :param sentences: list of text, eg: [text1, text2, ...]
-        :return: X_tokens
+        :return: X_tokens, token lists if the feature analyzer takes them, else space joined texts
         """
-        X_tokens = [' '.join([w for w in self.tokenizer.tokenize(line) if w not in self.stopwords]) for line in
-                    sentences]
+        if hasattr(self.tokenizer, 'tokenize_batch'):
+            tokens_list = self.tokenizer.tokenize_batch(sentences, stopwords=self.stopwords)
+        else:
+            # custom tokenizer without batch api
+            tokens_list = [[w for w in self.tokenizer.tokenize(line) if w not in self.stopwords] for line in sentences]
+        feature = self.feature.steps[0][1] if isinstance(self.feature, Pipeline) else self.feature
+        if isinstance(getattr(feature, 'analyzer', None), NgramAnalyzer):
+            return tokens_list
+        # string analyzer, eg: custom feature or feature pickled by old version
+        X_tokens = [' '.join(tokens) for tokens in tokens_list]
         return X_tokens
 
     def load_pkl(self, pkl_path):
@@ -148,36 +181,185 @@ class ClassicClassifier(ClassifierABC):
         assert len(X_train) == len(y_train)
         logger.debug(f'X_train sample:\n{X_train[:3]}\ny_train sample:\n{y_train[:3]}')
         logger.debug(f'num_classes:{len(set(y))}')
+        self.stage_timings = {}
         # tokenize text
+        start_time = time.time()
         X_train_tokens = self.tokenize_sentences(X_train)
+        self.stage_timings['tokenize'] = time.time() - start_time
         logger.debug(f'X_train_tokens sample:\n{X_train_tokens[:3]}')
+        start_time = time.time()
         X_train_feat = self.feature.fit_transform(X_train_tokens)
+        self.stage_timings['feature'] = time.time() - start_time
         # fit
+        start_time = time.time()
         self.model.fit(X_train_feat, y_train)
+        self.stage_timings['fit'] = time.time() - start_time
         self.is_trained = True
+        self.export_linear_scorer()
         # evaluate
+        start_time = time.time()
         test_acc = self.evaluate(X_test, y_test)
+        self.stage_timings['evaluate'] = time.time() - start_time
         logger.debug(f'evaluate, X size: {len(X_test)}, y size: {len(y_test)}, acc: {test_acc}')
+        logger.debug('stage timings: ' + ', '.join(f'{k}: {v:.2f}s' for k, v in self.stage_timings.items()))
         # save model
         self.save_model()
         return test_acc
 
+    def train_incremental(self, data_path, header=None, names=('labels', 'text'), delimiter='\t', test_size=0.1,
+                          chunksize=100000, checkpoint_every=10, max_dev_size=10000, classes=None):
+        """
+        Train model out-of-core: read data in chunks, and call model.partial_fit on each chunk
+        The model must support partial_fit, eg: sgd, bayes, Perceptron, PassiveAggressiveClassifier.
+        The feature must be stateless (hashing) or fitted before (load_model), the idf of hashing_tfidf is fitted
+        on the first chunk if not fitted. Train again after load_model to continue on new data.
+        @param data_path: data file path
+        @param header:
+        @param names:
+        @param delimiter:
+        @param test_size: dev ratio, dev samples are split by hashing the text
+        @param chunksize: 每次读取的行数
+        @param checkpoint_every: 每隔多少个chunk保存一次模型
+        @param max_dev_size: 验证集最大样本数
+        @param classes: all labels, scanned from the data if None and the model is not fitted
+        @return: dev accuracy score
+        """
+        if not hasattr(self.model, 'partial_fit'):
+            raise ValueError(f'model {self.model.__class__.__name__} not support partial_fit.')
+        feature_fitted = self._is_fitted(self.feature)
+        if not feature_fitted and not isinstance(self.feature, Pipeline):
+            raise ValueError('feature not fitted, use hashing feature or load a trained model first.')
+
+        def data_chunks():
+            return load_data_chunks(data_path, chunksize=chunksize, test_size=test_size, header=header,
+                                    names=names, delimiter=delimiter)
+
+        if hasattr(self.model, 'classes_'):
+            classes = self.model.classes_
+        elif classes is None:
+            labels = set()
+            for _, y, _ in data_chunks():
+                labels.update(y.tolist())
+            classes = sorted(labels)
+        classes = np.asarray(classes)
+        logger.debug(f'num_classes: {len(classes)}')
+
+        self.stage_timings = {'tokenize': 0.0, 'feature': 0.0, 'fit': 0.0}
+        # stale once the model is updated, exported again by save_model
+        self.scorer = None
+        dev_X, dev_y = [], []
+        num_train = 0
+        chunk_idx = 0
+        for chunk_idx, (X, y, is_dev) in enumerate(data_chunks(), start=1):
+            if len(dev_X) < max_dev_size:
+                dev_X.extend(X[is_dev].tolist()[:max_dev_size - len(dev_X)])
+                dev_y.extend(y[is_dev].tolist()[:max_dev_size - len(dev_y)])
+            X_train, y_train = X[~is_dev], y[~is_dev]
+            if len(X_train) == 0:
+                continue
+            start_time = time.time()
+            X_train_tokens = self.tokenize_sentences(X_train)
+            self.stage_timings['tokenize'] += time.time() - start_time
+            start_time = time.time()
+            if feature_fitted:
+                X_train_feat = self.feature.transform(X_train_tokens)
+            else:
+                X_train_feat = self.feature.fit_transform(X_train_tokens)
+                feature_fitted = True
+            self.stage_timings['feature'] += time.time() - start_time
+            start_time = time.time()
+            self.model.partial_fit(X_train_feat, y_train, classes=classes)
+            self.stage_timings['fit'] += time.time() - start_time
+            self.is_trained = True
+            num_train += len(X_train)
+            if chunk_idx % checkpoint_every == 0:
+                logger.debug(f'chunk: {chunk_idx}, train samples: {num_train}, checkpoint')
+                self.save_model()
+        if not self.is_trained:
+            raise ValueError(f'no train data in {data_path}.')
+        logger.debug(f'chunks: {chunk_idx}, train samples: {num_train}, dev samples: {len(dev_X)}')
+        logger.debug('stage timings: ' + ', '.join(f'{k}: {v:.2f}s' for k, v in self.stage_timings.items()))
+        self.save_model()
+        test_acc = self.evaluate(dev_X, dev_y) if dev_X else None
+        logger.debug(f'evaluate, X size: {len(dev_X)}, acc: {test_acc}')
+        return test_acc
+
+    @staticmethod
+    def _is_fitted(estimator):
+        try:
+            check_is_fitted(estimator)
+            return True
+        except NotFittedError:
+            return False
+
     def predict(self, sentences: list):
         """
         Predict labels and label probability for sentences.
         @param sentences: list, input text list, eg: [text1, text2, ...]
         @return: predict_label, predict_prob
         """
+        X_feat = self._predict_features(sentences)
+        start_time = time.time()
+        if self.scorer is not None:
+            # linear model: one matmul for labels and probs
+            predict_labels, predict_probs = self.scorer.predict(X_feat)
+            predict_probs = predict_probs.tolist()
+        else:
+            predict_labels = self.model.predict(X_feat)
+            probs = self.model.predict_proba(X_feat)
+            label_ids = np.searchsorted(self.model.classes_, predict_labels)
+            predict_probs = probs[np.arange(len(label_ids)), label_ids].tolist()
+        self.predict_timings['score'] = time.time() - start_time
+        return predict_labels, predict_probs
+
+    def predict_proba(self, sentences: list):
+        """
+        Predict the probability of all labels for sentences.
+        @param sentences: list, input text list, eg: [text1, text2, ...]
+        @return: probs, array (n_samples, n_labels), columns in the order of self.labels
+        """
+        X_feat = self._predict_features(sentences)
+        start_time = time.time()
+        if self.scorer is not None:
+            probs = self.scorer.predict_proba(X_feat)
+        else:
+            probs = self.model.predict_proba(X_feat)
+        self.predict_timings['score'] = time.time() - start_time
+        return probs
+
+    def _predict_features(self, sentences):
+        """
+        Tokenize and transform sentences for prediction, timings are recorded in self.predict_timings
+        """
         if not self.is_trained:
             raise ValueError('model not trained.')
-        # tokenize text
+        self.predict_timings = {}
+        start_time = time.time()
         X_tokens = self.tokenize_sentences(sentences)
-        # transform
+        self.predict_timings['tokenize'] = time.time() - start_time
+        start_time = time.time()
         X_feat = self.feature.transform(X_tokens)
-        predict_labels = self.model.predict(X_feat)
-        probs = self.model.predict_proba(X_feat)
-        predict_probs = [prob[np.where(self.model.classes_ == label)][0] for label, prob in zip(predict_labels, probs)]
-        return predict_labels, predict_probs
+        self.predict_timings['transform'] = time.time() - start_time
+        return X_feat
+
+    @property
+    def id_label(self):
+        """
+        Labels in the column order of predict_proba, the classes of the model
+        """
+        classes = self.scorer.classes if self.scorer is not None else self.model.classes_
+        return np.asarray(classes, dtype=object)
+
+    def export_linear_scorer(self):
+        """
+        Export the trained linear model to self.scorer, used by predict
+        @return: LinearScorer, None if the model is not supported, eg: random_forest
+        """
+        try:
+            self.scorer = LinearScorer.from_model(self.model)
+        except ValueError:
+            self.scorer = None
+        return self.scorer
 
     def evaluate_model(self, data_list_or_path, header=None, names=('labels', 'text'), delimiter='\t'):
         X_test, y_test, df = load_data(data_list_or_path, header=header, names=names, delimiter=delimiter)
@@ -207,6 +389,8 @@ class ClassicClassifier(ClassifierABC):
             self.model = self.load_pkl(model_path)
             feature_path = os.path.join(self.model_dir, 'classifier_feature.pkl')
             self.feature = self.load_pkl(feature_path)
+            scorer_path = os.path.join(self.model_dir, 'linear_scorer.npz')
+            self.scorer = LinearScorer.load(scorer_path) if os.path.exists(scorer_path) else None
             logger.info(f'Loaded model: {model_path}.')
             self.is_trained = True
         else:
@@ -226,6 +410,11 @@ class ClassicClassifier(ClassifierABC):
             self.save_pkl(self.feature, feature_path)
             model_path = os.path.join(self.model_dir, 'classifier_model.pkl')
             self.save_pkl(self.model, model_path)
+            scorer_path = os.path.join(self.model_dir, 'linear_scorer.npz')
+            if self.export_linear_scorer() is not None:
+                self.scorer.save(scorer_path)
+            elif os.path.exists(scorer_path):
+                os.remove(scorer_path)
             logger.info(f'Saved model: {model_path}, feature_path: {feature_path}')
         else:
             logger.error('model is not trained, please train model first')
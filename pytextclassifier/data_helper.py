@@ -4,10 +4,13 @@
 @description: 
 """
 import json
+import os
+import queue
 import random
+import threading
+import time
 
 import numpy as np
-import torch
 from loguru import logger
 from tqdm import tqdm
 
@@ -16,6 +19,8 @@ def set_seed(seed):
     """
     Set seed for random number generators.
     """
+    import torch
+
     logger.info(f"Set seed for random, numpy and torch: {seed}")
     random.seed(seed)
     np.random.seed(seed)
@@ -24,15 +29,25 @@ def set_seed(seed):
         torch.cuda.manual_seed_all(seed)
 
 
-def build_vocab(contents, tokenizer, max_size, min_freq, unk_token, pad_token):
-    vocab_dic = {}
-    for line in tqdm(contents):
+def count_vocab(contents, tokenizer, vocab_dic=None):
+    """
+    Count word frequency of contents, update vocab_dic in place if given
+    """
+    vocab_dic = {} if vocab_dic is None else vocab_dic
+    for line in contents:
         line = line.strip()
         if not line:
             continue
         content = line.split('\t')[0]
         for word in tokenizer(content):
             vocab_dic[word] = vocab_dic.get(word, 0) + 1
+    return vocab_dic
+
+
+def finalize_vocab(vocab_dic, max_size, min_freq, unk_token, pad_token):
+    """
+    Word frequency dict to word id map, keep the max_size most frequent words, unk and pad at the end
+    """
     vocab_list = sorted([_ for _ in vocab_dic.items() if _[1] >= min_freq], key=lambda x: x[1], reverse=True)[
                  :max_size]
     vocab_dic = {word_count[0]: idx for idx, word_count in enumerate(vocab_list)}
@@ -40,6 +55,124 @@ def build_vocab(contents, tokenizer, max_size, min_freq, unk_token, pad_token):
     return vocab_dic
 
 
+def build_vocab(contents, tokenizer, max_size, min_freq, unk_token, pad_token):
+    vocab_dic = count_vocab(tqdm(contents), tokenizer)
+    return finalize_vocab(vocab_dic, max_size, min_freq, unk_token, pad_token)
+
+
+def scan_streaming_data(data_chunks, tokenizer, word_vocab_path, label_vocab_path, max_vocab_size=10000,
+                        min_freq=1, unk_token='[UNK]', pad_token='[PAD]', max_dev_size=10000):
+    """
+    First pass over a chunked data stream: build word and label vocab, and keep the dev samples in memory
+    :param data_chunks: iterable of (X, y, is_dev), eg: base_classifier.load_data_chunks
+    :param tokenizer:
+    :param word_vocab_path: loaded if exists, else built and saved
+    :param label_vocab_path: loaded if exists, else built and saved
+    :param max_vocab_size:
+    :param min_freq:
+    :param unk_token:
+    :param pad_token:
+    :param max_dev_size: max number of dev samples kept, the others are still excluded from train
+    :return: word_id_map, label_id_map, dev_X, dev_y
+    """
+    build_word_vocab = not os.path.exists(word_vocab_path)
+    build_label_vocab = not os.path.exists(label_vocab_path)
+    vocab_dic = {}
+    labels = set()
+    dev_X, dev_y = [], []
+    num_train, num_dev = 0, 0
+    for X, y, is_dev in tqdm(data_chunks, desc='Scan chunks'):
+        if build_word_vocab:
+            count_vocab(X, tokenizer, vocab_dic)
+        if build_label_vocab:
+            labels.update(y.tolist())
+        if len(dev_X) < max_dev_size:
+            dev_X.extend(X[is_dev].tolist()[:max_dev_size - len(dev_X)])
+            dev_y.extend(y[is_dev].tolist()[:max_dev_size - len(dev_y)])
+        num_dev += int(is_dev.sum())
+        num_train += int((~is_dev).sum())
+    logger.debug(f"train_data size: {num_train}, dev_data size: {num_dev}, dev_data kept: {len(dev_X)}")
+
+    if build_word_vocab:
+        word_id_map = finalize_vocab(vocab_dic, max_size=max_vocab_size, min_freq=min_freq,
+                                     unk_token=unk_token, pad_token=pad_token)
+        json.dump(word_id_map, open(word_vocab_path, 'w', encoding='utf-8'), ensure_ascii=False, indent=4)
+    else:
+        word_id_map = load_vocab(word_vocab_path)
+    logger.debug(f"word vocab size: {len(word_id_map)}, word_vocab_path: {word_vocab_path}")
+
+    if build_label_vocab:
+        label_id_map = {v: k for k, v in enumerate(sorted(labels))}
+        json.dump(label_id_map, open(label_vocab_path, 'w', encoding='utf-8'), ensure_ascii=False, indent=4)
+    else:
+        label_id_map = load_vocab(label_vocab_path)
+    logger.debug(f"label vocab size: {len(label_id_map)}, label_vocab_path: {label_vocab_path}")
+    return word_id_map, label_id_map, dev_X, dev_y
+
+
+def char_tokenize(text):
+    """
+    Char-level tokenizer, the default of the neural classifiers, a named function so it can be exported
+    :param text: str
+    :return: list of chars
+    """
+    return [y for y in text]
+
+
+def encode_sequences(contents, tokenizer, word_id_map, max_seq_length=128, unk_token='[UNK]', pad_token='[PAD]'):
+    """
+    Tokenize texts and map them to a padded word id matrix, longer texts are truncated to max_seq_length
+    :param contents: list of text
+    :param tokenizer: callable, text -> list of tokens
+    :param word_id_map: dict, word -> id
+    :param max_seq_length: int, width of the id matrix
+    :param unk_token:
+    :param pad_token:
+    :return: word_ids, np.int64 array (n, max_seq_length); seq_lens, np.int64 array (n,), length before padding
+    """
+    unk_id = word_id_map.get(unk_token)
+    pad_id = word_id_map.get(pad_token)
+    word_ids = np.full((len(contents), max_seq_length), pad_id, dtype=np.int64)
+    seq_lens = np.empty(len(contents), dtype=np.int64)
+    for i, content in enumerate(contents):
+        ids = [word_id_map.get(word, unk_id) for word in tokenizer(content)[:max_seq_length]]
+        word_ids[i, :len(ids)] = ids
+        seq_lens[i] = len(ids)
+    return word_ids, seq_lens
+
+
+def encode_labels(y, label_id_map):
+    """
+    :param y: list of labels
+    :param label_id_map: dict, label -> id
+    :return: label_ids, np.int64 array (n,)
+    """
+    label_ids = [label_id_map.get(label) for label in y]
+    if None in label_ids:
+        raise ValueError(f'label not in label vocab: {list(y)[label_ids.index(None)]}')
+    return np.array(label_ids, dtype=np.int64)
+
+
+def ngram_hash(word_ids, n_gram_vocab=250499):
+    """
+    Fasttext bigram and trigram bucket ids of a padded word id matrix, computed with shifted arrays
+    bigram[t] = (ids[t-1] * 14918087) % buckets
+    trigram[t] = (ids[t-2] * 14918087 * 18408749 + ids[t-1] * 14918087) % buckets
+    ids before the start of a row count as 0. The multipliers are reduced modulo buckets first, so the
+    int64 products do not overflow and the buckets are identical to python's big int arithmetic.
+    :param word_ids: np.int64 array (n, seq_length)
+    :param n_gram_vocab: number of hash buckets
+    :return: bigram, trigram, np.int64 arrays (n, seq_length)
+    """
+    prev1 = np.zeros_like(word_ids)
+    prev1[:, 1:] = word_ids[:, :-1]
+    prev2 = np.zeros_like(word_ids)
+    prev2[:, 2:] = word_ids[:, :-2]
+    bigram = prev1 * (14918087 % n_gram_vocab) % n_gram_vocab
+    trigram = (prev2 * (14918087 * 18408749 % n_gram_vocab) + bigram) % n_gram_vocab
+    return bigram, trigram
+
+
 def load_vocab(vocab_path):
     """
     :param vocab_path:
@@ -48,3 +181,194 @@ def load_vocab(vocab_path):
     with open(vocab_path, 'r', encoding='utf-8') as fr:
         vocab = json.load(fr)
     return vocab
+
+
+class StreamingDatasetIterater:
+    """
+    Batch iterator over a stream of (X, y) chunks, texts are featurized chunk by chunk, so memory is bounded by
+    shuffle_buffer_size instead of the data size. Examples are collected in a buffer, the buffer is shuffled and
+    cut into batches when full, the residue smaller than batch_size is carried over to the next buffer.
+    Each iteration reads the stream again from chunk_iter_fn, so it can be used for many epochs.
+    """
+
+    def __init__(self, chunk_iter_fn, featurize_fn, label_id_map, device, batch_size=32,
+                 shuffle_buffer_size=100000, shuffle=True, seed=1):
+        """
+        :param chunk_iter_fn: callable, return an iterable of (X, y)
+        :param featurize_fn: callable, X -> tuple of np.ndarray features, eg: (word_ids, seq_lens)
+        :param label_id_map: dict, label -> id
+        :param device: torch device
+        :param batch_size:
+        :param shuffle_buffer_size: number of examples shuffled together
+        :param shuffle: shuffle examples in the buffer or not
+        :param seed: shuffle seed, changed by epoch
+        """
+        self.chunk_iter_fn = chunk_iter_fn
+        self.featurize_fn = featurize_fn
+        self.label_id_map = label_id_map
+        self.device = device
+        self.batch_size = batch_size
+        self.shuffle_buffer_size = shuffle_buffer_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+
+    def _to_tensor(self, arrays):
+        import torch
+
+        tensors = [torch.from_numpy(np.ascontiguousarray(a)).to(self.device) for a in arrays]
+        return tuple(tensors[:-1]), tensors[-1]
+
+    def _buffers(self):
+        buffer, buffer_size = [], 0
+        for X, y in self.chunk_iter_fn():
+            if len(X) == 0:
+                continue
+            label_ids = np.array([self.label_id_map.get(label) for label in y], dtype=np.int64)
+            buffer.append(tuple(self.featurize_fn(X)) + (label_ids,))
+            buffer_size += len(label_ids)
+            if buffer_size >= self.shuffle_buffer_size:
+                yield [np.concatenate(arrays) for arrays in zip(*buffer)]
+                buffer, buffer_size = [], 0
+        if buffer:
+            yield [np.concatenate(arrays) for arrays in zip(*buffer)]
+
+    def __iter__(self):
+        rng = np.random.RandomState(self.seed + self.epoch)
+        self.epoch += 1
+        residue = None
+        for arrays in self._buffers():
+            if residue is not None:
+                arrays = [np.concatenate(pair) for pair in zip(residue, arrays)]
+            size = len(arrays[-1])
+            order = rng.permutation(size) if self.shuffle else np.arange(size)
+            full_size = size - size % self.batch_size
+            for start in range(0, full_size, self.batch_size):
+                batch_index = order[start: start + self.batch_size]
+                yield self._to_tensor([a[batch_index] for a in arrays])
+            residue = [a[order[full_size:]] for a in arrays] if full_size < size else None
+        if residue is not None:
+            yield self._to_tensor(residue)
+
+
+class BatchLoader:
+    """
+    Batch iterator over in-memory feature arrays, eg: the dataset of build_dataset. Batches are collated with numpy
+    into a ring of preallocated buffers (pinned memory on cuda) by a background thread, prefetch batches ahead of
+    the training step. The order is shuffled every epoch if shuffle.
+    On cpu the yielded tensors share memory with the ring buffers, they are valid until prefetch + 1 more batches
+    are taken; copy them to keep them longer.
+    wait_time is the time the consumer waited for batches, the stall of the training loop on data loading.
+    """
+
+    def __init__(self, arrays, device, batch_size=32, shuffle=False, seed=1, prefetch=2):
+        """
+        :param arrays: tuple of np.ndarray with the same first dim, features in the order of the model inputs,
+            labels last
+        :param device: torch device
+        :param batch_size:
+        :param shuffle: shuffle the samples every epoch or not
+        :param seed: shuffle seed, changed by epoch
+        :param prefetch: number of batches collated ahead
+        """
+        import torch
+
+        self.arrays = [np.ascontiguousarray(a) for a in arrays]
+        self.num_samples = len(self.arrays[-1])
+        if any(len(a) != self.num_samples for a in self.arrays):
+            raise ValueError(f'arrays should have the same length, got {[len(a) for a in self.arrays]}.')
+        self.device = torch.device(device)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.prefetch = max(1, prefetch)
+        self.epoch = 0
+        self.wait_time = 0.0
+        self.num_batches = 0
+        self.pin_memory = self.device.type == 'cuda'
+        # a slot is in the queue (prefetch), held by the consumer (1), or being written by the producer (1)
+        self._slots = [
+            [torch.empty((batch_size,) + a.shape[1:], dtype=torch.from_numpy(a[:0]).dtype, pin_memory=self.pin_memory)
+             for a in self.arrays]
+            for _ in range(self.prefetch + 2)
+        ]
+        self._events = [None] * len(self._slots)
+
+    def __len__(self):
+        return (self.num_samples + self.batch_size - 1) // self.batch_size
+
+    def _produce(self, order, out_queue, stop):
+        try:
+            for batch_index, start in enumerate(range(0, self.num_samples, self.batch_size)):
+                slot_id = batch_index % len(self._slots)
+                if self._events[slot_id] is not None:
+                    # the host to device copy of the previous batch in the slot must be done
+                    self._events[slot_id].synchronize()
+                end = min(start + self.batch_size, self.num_samples)
+                slot = self._slots[slot_id]
+                for array, buffer in zip(self.arrays, slot):
+                    out = buffer.numpy()[:end - start]
+                    if order is None:
+                        np.copyto(out, array[start:end])
+                    else:
+                        np.take(array, order[start:end], axis=0, out=out)
+                if not self._put(out_queue, (slot_id, end - start), stop):
+                    return
+        except Exception as e:
+            self._put(out_queue, e, stop)
+            return
+        self._put(out_queue, None, stop)
+
+    @staticmethod
+    def _put(out_queue, item, stop):
+        """Put unless the consumer stopped, return False if stopped"""
+        while not stop.is_set():
+            try:
+                out_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def __iter__(self):
+        import torch
+
+        order = None
+        if self.shuffle:
+            order = np.random.RandomState(self.seed + self.epoch).permutation(self.num_samples)
+        self.epoch += 1
+        out_queue = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+        producer = threading.Thread(target=self._produce, args=(order, out_queue, stop), daemon=True)
+        producer.start()
+        wait_time, num_batches = 0.0, 0
+        try:
+            while True:
+                start_time = time.time()
+                item = out_queue.get()
+                wait_time += time.time() - start_time
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                slot_id, size = item
+                tensors = [buffer[:size].to(self.device, non_blocking=self.pin_memory)
+                           for buffer in self._slots[slot_id]]
+                if self.pin_memory:
+                    self._events[slot_id] = torch.cuda.Event()
+                    self._events[slot_id].record()
+                num_batches += 1
+                yield tuple(tensors[:-1]), tensors[-1]
+        finally:
+            stop.set()
+            producer.join()
+            self.wait_time += wait_time
+            self.num_batches += num_batches
+
+    def stats(self):
+        """
+        Loader wait of all epochs
+        :return: dict, batches, wait_time(s), wait_per_batch(ms)
+        """
+        return {'batches': self.num_batches, 'wait_time': self.wait_time,
+                'wait_per_batch': self.wait_time / max(self.num_batches, 1) * 1000}
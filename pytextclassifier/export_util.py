@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+@author:XuMing(xuming624@qq.com)
+@description: Export a trained torch classifier to a bundle dir, served by ExportedPredictor without the classifier
+"""
+import copy
+import inspect
+import json
+import os
+
+import torch
+import torch.nn as nn
+from loguru import logger
+
+from pytextclassifier.data_helper import char_tokenize
+from pytextclassifier.predictor import EXPORT_CONFIG_NAME
+
+EXPORT_FORMATS = ('onnx', 'torchscript')
+
+
+class ExportWrapper(nn.Module):
+    """Positional input tensors -> the feature tuple of the model forward, unused features are None"""
+
+    def __init__(self, model, feature_names, input_names):
+        super().__init__()
+        self.model = model
+        self.feature_names = tuple(feature_names)
+        self.input_names = tuple(input_names)
+
+    def forward(self, *inputs):
+        x = [None] * len(self.feature_names)
+        for name, tensor in zip(self.input_names, inputs):
+            x[self.feature_names.index(name)] = tensor
+        return self.model(tuple(x))
+
+
+def export_bundle(classifier, output_dir, format='onnx', input_names=None, config=None):
+    """
+    Export a trained TextCNN, TextRNN or FastText classifier, the bundle dir has:
+        model.onnx or model.pt: traced graph, inputs are the padded int64 feature arrays, output is the logits
+        word_vocab.json, label_vocab.json: vocab of the classifier
+        export_config.json: featurize params, read by ExportedPredictor
+    :param classifier: trained classifier with model, feature_names, _featurize, word_id_map and label_id_map
+    :param output_dir: bundle dir
+    :param format: onnx or torchscript
+    :param input_names: features used by the model forward, all feature_names if None
+    :param config: extra featurize params, eg: n_gram_vocab
+    :return: output_dir
+    """
+    if format not in EXPORT_FORMATS:
+        raise ValueError(f'format should be onnx or torchscript, got {format}.')
+    if not classifier.is_trained:
+        raise ValueError('model not trained.')
+    input_names = tuple(input_names or classifier.feature_names)
+    os.makedirs(output_dir, exist_ok=True)
+    # trace on cpu, the exported graph has no device
+    model = ExportWrapper(copy.deepcopy(classifier.model).cpu().eval(), classifier.feature_names, input_names)
+    features = dict(zip(classifier.feature_names, classifier._featurize(['export', ''])))
+    example_inputs = tuple(torch.from_numpy(features[name]) for name in input_names)
+    if format == 'onnx':
+        model_file = 'model.onnx'
+        dynamic_axes = {name: {0: 'batch_size'} for name in input_names + ('logits',)}
+        kwargs = {}
+        if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+            # the torchscript based exporter, packed lstm and no onnxscript dependency
+            kwargs['dynamo'] = False
+        with torch.no_grad():
+            torch.onnx.export(model, example_inputs, os.path.join(output_dir, model_file),
+                              input_names=list(input_names), output_names=['logits'], dynamic_axes=dynamic_axes,
+                              **kwargs)
+    else:
+        model_file = 'model.pt'
+        with torch.no_grad():
+            traced = torch.jit.trace(model, example_inputs)
+        traced.save(os.path.join(output_dir, model_file))
+    json.dump(classifier.word_id_map, open(os.path.join(output_dir, 'word_vocab.json'), 'w', encoding='utf-8'),
+              ensure_ascii=False, indent=4)
+    json.dump(classifier.label_id_map, open(os.path.join(output_dir, 'label_vocab.json'), 'w', encoding='utf-8'),
+              ensure_ascii=False, indent=4)
+    export_config = {
+        'classifier': classifier.__class__.__name__,
+        'format': format,
+        'model_file': model_file,
+        'input_names': list(input_names),
+        'max_seq_length': classifier.max_seq_length,
+        'unk_token': classifier.unk_token,
+        'pad_token': classifier.pad_token,
+        # custom tokenizer is not exported, pass it to ExportedPredictor
+        'tokenizer': 'char' if classifier.tokenizer is char_tokenize else 'custom',
+    }
+    export_config.update(config or {})
+    json.dump(export_config, open(os.path.join(output_dir, EXPORT_CONFIG_NAME), 'w', encoding='utf-8'),
+              ensure_ascii=False, indent=4)
+    logger.info(f'export {format} done. bundle dir: {output_dir}')
+    return output_dir
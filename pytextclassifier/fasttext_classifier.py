@@ -18,14 +18,33 @@ from sklearn import metrics
 from sklearn.model_selection import train_test_split
 
 sys.path.append('..')
-from pytextclassifier.base_classifier import ClassifierABC, load_data
-from pytextclassifier.data_helper import set_seed, build_vocab, load_vocab
+from pytextclassifier.base_classifier import ClassifierABC, load_data, load_data_chunks
+from pytextclassifier.data_helper import set_seed, build_vocab, load_vocab, encode_sequences, ngram_hash
+from pytextclassifier.data_helper import char_tokenize
+from pytextclassifier.data_helper import scan_streaming_data, StreamingDatasetIterater, BatchLoader, encode_labels
+from pytextclassifier.memmap_dataset import is_compiled_dataset, load_compiled_dataset, compile_dataset
+from pytextclassifier.memmap_dataset import MemmapDatasetIterater
+from pytextclassifier.export_util import export_bundle
+from pytextclassifier.predict_util import predict_proba_batches, topk, evaluate_batches
+from pytextclassifier.quantize_util import quantize_model, model_size
 from pytextclassifier.time_util import get_time_spend
 
 pwd_path = os.path.abspath(os.path.dirname(__file__))
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
 
+def build_features(X, tokenizer, word_id_map, max_seq_length=128, unk_token='[UNK]', pad_token='[PAD]',
+                   n_gram_vocab=250499):
+    """
+    Fasttext features of a batch of texts
+    @return: word_ids, seq_lens, bigram, trigram; np.int64 arrays
+    """
+    word_ids, seq_lens = encode_sequences(X, tokenizer, word_id_map, max_seq_length=max_seq_length,
+                                          unk_token=unk_token, pad_token=pad_token)
+    bigram, trigram = ngram_hash(word_ids, n_gram_vocab)
+    return word_ids, seq_lens, bigram, trigram
+
+
 def build_dataset(tokenizer, X, y, word_vocab_path, label_vocab_path, max_vocab_size=10000,
                   max_seq_length=128, unk_token='[UNK]', pad_token='[PAD]', n_gram_vocab=250499):
     if os.path.exists(word_vocab_path):
@@ -46,117 +65,52 @@ def build_dataset(tokenizer, X, y, word_vocab_path, label_vocab_path, max_vocab_
         logger.debug('save label_vocab_path: {}'.format(label_vocab_path))
     logger.debug(f"label vocab size: {len(label_id_map)}, label_vocab_path: {label_vocab_path}")
 
-    def biGramHash(sequence, t, buckets):
-        t1 = sequence[t - 1] if t - 1 >= 0 else 0
-        return (t1 * 14918087) % buckets
-
-    def triGramHash(sequence, t, buckets):
-        t1 = sequence[t - 1] if t - 1 >= 0 else 0
-        t2 = sequence[t - 2] if t - 2 >= 0 else 0
-        return (t2 * 14918087 * 18408749 + t1 * 14918087) % buckets
-
-    def load_dataset(X, y, max_seq_length=128):
-        contents = []
-        for content, label in zip(X, y):
-            words_line = []
-            token = tokenizer(content)
-            seq_len = len(token)
-            if max_seq_length:
-                if len(token) < max_seq_length:
-                    token.extend([pad_token] * (max_seq_length - len(token)))
-                else:
-                    token = token[:max_seq_length]
-                    seq_len = max_seq_length
-            # word to id
-            for word in token:
-                words_line.append(word_id_map.get(word, word_id_map.get(unk_token)))
-            label_id = label_id_map.get(label)
-            # fasttext ngram
-            buckets = n_gram_vocab
-            bigram = []
-            trigram = []
-            # ------ngram------
-            for i in range(max_seq_length):
-                bigram.append(biGramHash(words_line, i, buckets))
-                trigram.append(triGramHash(words_line, i, buckets))
-            # -----------------
-            contents.append((words_line, label_id, seq_len, bigram, trigram))
-        return contents
-
-    dataset = load_dataset(X, y, max_seq_length)
+    word_ids, seq_lens, bigram, trigram = build_features(X, tokenizer, word_id_map, max_seq_length=max_seq_length,
+                                                         unk_token=unk_token, pad_token=pad_token,
+                                                         n_gram_vocab=n_gram_vocab)
+    dataset = (word_ids, seq_lens, bigram, trigram, encode_labels(y, label_id_map))
     return dataset, word_id_map, label_id_map
 
 
-class DatasetIterater:
-    def __init__(self, dataset, device, batch_size=32):
-        self.batch_size = batch_size
-        self.dataset = dataset
-        self.n_batches = len(dataset) // batch_size if len(dataset) > batch_size else 1
-        self.residue = False  # 记录batch数量是否为整数
-        if len(dataset) % self.n_batches != 0:
-            self.residue = True
-        self.index = 0
-        self.device = device
-
-    def _to_tensor(self, datas):
-        x = torch.LongTensor([_[0] for _ in datas]).to(self.device)
-        y = torch.LongTensor([_[1] for _ in datas]).to(self.device)
-        bigram = torch.LongTensor([_[3] for _ in datas]).to(self.device)
-        trigram = torch.LongTensor([_[4] for _ in datas]).to(self.device)
-
-        # pad_token前的长度(超过max_seq_length的设为max_seq_length)
-        seq_len = torch.LongTensor([_[2] for _ in datas]).to(self.device)
-        return (x, seq_len, bigram, trigram), y
-
-    def __next__(self):
-        if self.residue and self.index == self.n_batches:
-            batches = self.dataset[self.index * self.batch_size: len(self.dataset)]
-            self.index += 1
-            batches = self._to_tensor(batches)
-            return batches
-
-        elif self.index >= self.n_batches:
-            self.index = 0
-            raise StopIteration
-        else:
-            batches = self.dataset[self.index * self.batch_size: (self.index + 1) * self.batch_size]
-            self.index += 1
-            batches = self._to_tensor(batches)
-            return batches
-
-    def __iter__(self):
-        return self
-
-    def __len__(self):
-        if self.residue:
-            return self.n_batches + 1
-        else:
-            return self.n_batches
-
-
-def build_iterator(dataset, device, batch_size=32):
-    return DatasetIterater(dataset, device, batch_size)
-
-
 class FastTextModel(nn.Module):
     """Bag of Tricks for Efficient Text Classification"""
 
-    def __init__(self, vocab_size, num_classes, embed_size=200, n_gram_vocab=250499, hidden_size=256, dropout_rate=0.5):
+    def __init__(self, vocab_size, num_classes, embed_size=200, n_gram_vocab=250499, hidden_size=256, dropout_rate=0.5,
+                 sparse=False, ngram_table_sizes=None):
+        """
+        FastText model
+        @param sparse: sparse gradients of the embeddings, only the rows looked up by a batch, see SparseAdam
+        @param ngram_table_sizes: (bigram rows, trigram rows) of a pruned model, hash buckets are mapped to
+            the rows by the bigram_remap and trigram_remap buffers, see prune_ngram_buckets
+        """
         super().__init__()
-        self.embedding = nn.Embedding(vocab_size, embed_size, padding_idx=vocab_size - 1)
-        self.embedding_ngram2 = nn.Embedding(n_gram_vocab, embed_size)
-        self.embedding_ngram3 = nn.Embedding(n_gram_vocab, embed_size)
+        bigram_size, trigram_size = ngram_table_sizes or (n_gram_vocab, n_gram_vocab)
+        self.embedding = nn.Embedding(vocab_size, embed_size, padding_idx=vocab_size - 1, sparse=sparse)
+        self.embedding_ngram2 = nn.Embedding(bigram_size, embed_size, sparse=sparse)
+        self.embedding_ngram3 = nn.Embedding(trigram_size, embed_size, sparse=sparse)
+        if ngram_table_sizes:
+            # int32, half the size of the int64 ids
+            self.register_buffer('bigram_remap', torch.zeros(n_gram_vocab, dtype=torch.int32))
+            self.register_buffer('trigram_remap', torch.zeros(n_gram_vocab, dtype=torch.int32))
+        else:
+            self.bigram_remap = None
+            self.trigram_remap = None
         self.dropout = nn.Dropout(dropout_rate)
         self.fc1 = nn.Linear(embed_size * 3, hidden_size)
         self.fc2 = nn.Linear(hidden_size, num_classes)
 
     def forward(self, x):
-        out_word = self.embedding(x[0])
-        out_bigram = self.embedding_ngram2(x[2])
-        out_trigram = self.embedding_ngram3(x[3])
+        # mean of each embedding before the concat, same result as the mean of the concat,
+        # without the (batch_size, seq_len, embed_size * 3) tensor
+        bigram, trigram = x[2], x[3]
+        if self.bigram_remap is not None:
+            # pruned model, hash bucket -> row of the compact table
+            bigram, trigram = self.bigram_remap[bigram], self.trigram_remap[trigram]
+        out_word = self.embedding(x[0]).mean(dim=1)
+        out_bigram = self.embedding_ngram2(bigram).mean(dim=1)
+        out_trigram = self.embedding_ngram3(trigram).mean(dim=1)
         out = torch.cat((out_word, out_bigram, out_trigram), -1)
 
-        out = out.mean(dim=1)
         out = self.dropout(out)
         out = self.fc1(out)
         out = F.relu(out)
@@ -164,13 +118,56 @@ class FastTextModel(nn.Module):
         return out
 
 
+def ngram_table_sizes(state_dict):
+    """(bigram rows, trigram rows) of a pruned model state_dict, None if not pruned"""
+    if 'bigram_remap' not in state_dict:
+        return None
+    return state_dict['embedding_ngram2.weight'].shape[0], state_dict['embedding_ngram3.weight'].shape[0]
+
+
+def prune_ngram_buckets(model, bigram_counts, trigram_counts, min_count=1):
+    """
+    Drop the n-gram hash buckets seen less than min_count times in training, and remap them to a compact table,
+    the kept buckets have the same vectors, the dropped ones are mapped to an extra zero row.
+    @param model: trained FastTextModel, pruned or not
+    @param bigram_counts: np.int64 array (n_gram_vocab,), counts of the bigram buckets in training
+    @param trigram_counts: np.int64 array (n_gram_vocab,)
+    @param min_count: int
+    @return: pruned FastTextModel
+    """
+    n_gram_vocab = len(bigram_counts)
+    keeps = [np.flatnonzero(counts >= min_count) for counts in (bigram_counts, trigram_counts)]
+    state_dict = model.state_dict()
+    for keep, table_name, remap_name in zip(keeps, ('embedding_ngram2', 'embedding_ngram3'),
+                                            ('bigram_remap', 'trigram_remap')):
+        table = state_dict[f'{table_name}.weight']
+        keep = torch.from_numpy(keep).to(table.device)
+        # rows of the kept buckets in the current table
+        rows = state_dict[remap_name][keep] if remap_name in state_dict else keep
+        weight = torch.zeros(len(keep) + 1, table.shape[1], dtype=table.dtype, device=table.device)
+        weight[:-1] = table[rows]
+        remap = torch.full((n_gram_vocab,), len(keep), dtype=torch.int32, device=table.device)
+        remap[keep] = torch.arange(len(keep), dtype=torch.int32, device=table.device)
+        state_dict[f'{table_name}.weight'] = weight
+        state_dict[remap_name] = remap
+    pruned = FastTextModel(model.embedding.num_embeddings, model.fc2.out_features, model.embedding.embedding_dim,
+                           n_gram_vocab, model.fc1.out_features, model.dropout.p,
+                           ngram_table_sizes=ngram_table_sizes(state_dict))
+    pruned.load_state_dict(state_dict)
+    return pruned.to(model.fc1.weight.device)
+
+
 class FastTextClassifier(ClassifierABC):
+    feature_names = ('word_ids', 'seq_lens', 'bigram', 'trigram')
+
     def __init__(
             self,
             model_dir,
             dropout_rate=0.5, batch_size=64, max_seq_length=128,
             embed_size=200, hidden_size=256, n_gram_vocab=250499,
             max_vocab_size=10000, unk_token='[UNK]', pad_token='[PAD]', tokenizer=None,
+            sparse_embedding=False,
+            count_ngram_buckets=False,
     ):
         """
         初始化
@@ -185,25 +182,41 @@ class FastTextClassifier(ClassifierABC):
         @param unk_token: 未知字
         @param pad_token: padding符号
         @param tokenizer: 切词器
+        @param sparse_embedding: 稀疏梯度训练embedding(SparseAdam)，每步只更新batch用到的行
+        @param count_ngram_buckets: 训练第一个epoch统计ngram桶的出现次数，保存到model_dir/ngram_counts.npz，
+            prune_ngram_buckets需要
         """
         self.model_dir = model_dir
         self.is_trained = False
         self.model = None
-        logger.debug(f'device: {device}')
+        self.device = device
+        self.quantized = False
+        logger.debug(f'device: {self.device}')
         self.dropout_rate = dropout_rate
         self.batch_size = batch_size
         self.max_seq_length = max_seq_length
         self.embed_size = embed_size
         self.hidden_size = hidden_size
         self.n_gram_vocab = n_gram_vocab
+        self.sparse_embedding = sparse_embedding
+        self.count_ngram_buckets = count_ngram_buckets
         self.max_vocab_size = max_vocab_size
         self.unk_token = unk_token
         self.pad_token = pad_token
-        self.tokenizer = tokenizer if tokenizer else lambda x: [y for y in x]  # char-level
+        self.tokenizer = tokenizer if tokenizer else char_tokenize  # char-level
 
     def __str__(self):
         return f'FasttextClassifier instance ({self.model})'
 
+    def _featurize(self, X):
+        """Texts to model input arrays, in the order of feature_names"""
+        return build_features(X, self.tokenizer, self.word_id_map, max_seq_length=self.max_seq_length,
+                              unk_token=self.unk_token, pad_token=self.pad_token, n_gram_vocab=self.n_gram_vocab)
+
+    def _dataset_meta(self):
+        """Featurize params, a compiled dataset is only valid for the same ones"""
+        return {'max_seq_length': self.max_seq_length, 'n_gram_vocab': self.n_gram_vocab}
+
     def train(
             self,
             data_list_or_path,
@@ -213,7 +226,7 @@ class FastTextClassifier(ClassifierABC):
     ):
         """
         Train model with data_list_or_path and save model to model_dir
-        @param data_list_or_path:
+        @param data_list_or_path: data list, file path, or compiled dataset dir (see compile_dataset)
         @param header:
         @param names:
         @param delimiter:
@@ -227,8 +240,7 @@ class FastTextClassifier(ClassifierABC):
         logger.debug('train model...')
         SEED = 1
         set_seed(SEED)
-        # load data
-        X, y, data_df = load_data(data_list_or_path, header=header, names=names, delimiter=delimiter)
+        self.device, self.quantized = device, False
         model_dir = self.model_dir
         if model_dir:
             os.makedirs(model_dir, exist_ok=True)
@@ -236,24 +248,44 @@ class FastTextClassifier(ClassifierABC):
         label_vocab_path = os.path.join(model_dir, 'label_vocab.json')
         save_model_path = os.path.join(model_dir, 'model.pth')
 
-        dataset, self.word_id_map, self.label_id_map = build_dataset(self.tokenizer, X, y, word_vocab_path,
-                                                                     label_vocab_path,
-                                                                     max_vocab_size=self.max_vocab_size,
-                                                                     max_seq_length=self.max_seq_length,
-                                                                     unk_token=self.unk_token, pad_token=self.pad_token,
-                                                                     n_gram_vocab=self.n_gram_vocab)
-        train_data, dev_data = train_test_split(dataset, test_size=test_size, random_state=SEED)
-        logger.debug(f"train_data size: {len(train_data)}, dev_data size: {len(dev_data)}")
-        logger.debug(f'train_data sample:\n{train_data[:3]}\ndev_data sample:\n{dev_data[:3]}')
-        train_iter = build_iterator(train_data, device, self.batch_size)
-        dev_iter = build_iterator(dev_data, device, self.batch_size)
+        if is_compiled_dataset(data_list_or_path):
+            # pre-tokenized dataset, see compile_dataset, the dev split is taken at compile time
+            manifest, self.word_id_map, self.label_id_map = load_compiled_dataset(data_list_or_path,
+                                                                                  self._dataset_meta())
+            json.dump(self.word_id_map, open(word_vocab_path, 'w', encoding='utf-8'), ensure_ascii=False, indent=4)
+            json.dump(self.label_id_map, open(label_vocab_path, 'w', encoding='utf-8'), ensure_ascii=False, indent=4)
+            logger.debug(f"compiled dataset: {data_list_or_path}, samples: {manifest['num_samples']}")
+            train_iter = MemmapDatasetIterater(data_list_or_path, self.device, self.batch_size, split='train',
+                                               shuffle=True, seed=SEED)
+            dev_iter = None
+            if manifest['num_samples']['dev']:
+                dev_iter = MemmapDatasetIterater(data_list_or_path, self.device, self.batch_size, split='dev')
+        else:
+            # load data
+            X, y, data_df = load_data(data_list_or_path, header=header, names=names, delimiter=delimiter)
+            dataset, self.word_id_map, self.label_id_map = build_dataset(
+                self.tokenizer, X, y,
+                word_vocab_path,
+                label_vocab_path,
+                max_vocab_size=self.max_vocab_size,
+                max_seq_length=self.max_seq_length,
+                unk_token=self.unk_token, pad_token=self.pad_token,
+                n_gram_vocab=self.n_gram_vocab
+            )
+            splits = train_test_split(*dataset, test_size=test_size, random_state=SEED)
+            train_data, dev_data = tuple(splits[0::2]), tuple(splits[1::2])
+            logger.debug(f"train_data size: {len(train_data[-1])}, dev_data size: {len(dev_data[-1])}")
+            logger.debug(f'train_data sample:\n{[a[:3] for a in train_data]}\n'
+                         f'dev_data sample:\n{[a[:3] for a in dev_data]}')
+            train_iter = BatchLoader(train_data, self.device, self.batch_size, shuffle=True, seed=SEED)
+            dev_iter = BatchLoader(dev_data, self.device, self.batch_size)
         # create model
         vocab_size = len(self.word_id_map)
         num_classes = len(self.label_id_map)
         logger.debug(f'vocab_size:{vocab_size}', 'num_classes:', num_classes)
         self.model = FastTextModel(vocab_size, num_classes, self.embed_size, self.n_gram_vocab, self.hidden_size,
-                                   self.dropout_rate)
-        self.model.to(device)
+                                   self.dropout_rate, sparse=self.sparse_embedding)
+        self.model.to(self.device)
         # init_network(self.model)
         logger.info(self.model.parameters)
         # train model
@@ -263,6 +295,123 @@ class FastTextClassifier(ClassifierABC):
         logger.debug('train model done')
         return history
 
+    def train_streaming(
+            self,
+            data_path,
+            header=None, names=('labels', 'text'), delimiter='\t', test_size=0.1,
+            chunksize=100000, shuffle_buffer_size=100000, max_dev_size=10000,
+            num_epochs=20, learning_rate=1e-3,
+            require_improvement=1000, evaluate_during_training_steps=100
+    ):
+        """
+        Train model with a large data file in streaming mode and save model to model_dir,
+        the file is read in chunks, memory is bounded by chunksize, shuffle_buffer_size and max_dev_size
+        @param data_path: data file path
+        @param header:
+        @param names:
+        @param delimiter:
+        @param test_size: dev ratio, dev samples are split by hashing the text
+        @param chunksize: 每次读取的行数
+        @param shuffle_buffer_size: shuffle缓冲区大小
+        @param max_dev_size: 验证集最大样本数
+        @param num_epochs: epoch数
+        @param learning_rate: 学习率
+        @param require_improvement: 若超过1000batch效果还没提升，则提前结束训练
+        @param evaluate_during_training_steps: 每隔多少step评估一次模型
+        @return:
+        """
+        logger.debug('train model in streaming mode...')
+        SEED = 1
+        set_seed(SEED)
+        self.device, self.quantized = device, False
+        model_dir = self.model_dir
+        if model_dir:
+            os.makedirs(model_dir, exist_ok=True)
+        word_vocab_path = os.path.join(model_dir, 'word_vocab.json')
+        label_vocab_path = os.path.join(model_dir, 'label_vocab.json')
+        save_model_path = os.path.join(model_dir, 'model.pth')
+
+        def data_chunks():
+            return load_data_chunks(data_path, chunksize=chunksize, test_size=test_size, header=header,
+                                    names=names, delimiter=delimiter)
+
+        def train_chunks():
+            for X, y, is_dev in data_chunks():
+                yield X[~is_dev], y[~is_dev]
+
+        # first pass: vocab and dev data
+        self.word_id_map, self.label_id_map, dev_X, dev_y = scan_streaming_data(
+            data_chunks(), self.tokenizer,
+            word_vocab_path,
+            label_vocab_path,
+            max_vocab_size=self.max_vocab_size,
+            unk_token=self.unk_token, pad_token=self.pad_token,
+            max_dev_size=max_dev_size
+        )
+        train_iter = StreamingDatasetIterater(train_chunks, self._featurize, self.label_id_map, self.device,
+                                              self.batch_size, shuffle_buffer_size=shuffle_buffer_size, seed=SEED)
+        dev_iter = None
+        if dev_X:
+            dev_iter = StreamingDatasetIterater(lambda: [(dev_X, dev_y)], self._featurize, self.label_id_map,
+                                                self.device, self.batch_size, shuffle=False)
+        # create model
+        vocab_size = len(self.word_id_map)
+        num_classes = len(self.label_id_map)
+        logger.debug(f'vocab_size:{vocab_size}', 'num_classes:', num_classes)
+        self.model = FastTextModel(vocab_size, num_classes, self.embed_size, self.n_gram_vocab, self.hidden_size,
+                                   self.dropout_rate, sparse=self.sparse_embedding)
+        self.model.to(self.device)
+        logger.info(self.model.parameters)
+        # train model
+        history = self.train_model_from_data_iterator(save_model_path, train_iter, dev_iter, num_epochs, learning_rate,
+                                                      require_improvement, evaluate_during_training_steps)
+        self.is_trained = True
+        logger.debug('train model done')
+        return history
+
+    def compile_dataset(
+            self,
+            data_list_or_path,
+            output_dir,
+            header=None, names=('labels', 'text'), delimiter='\t', test_size=0.1,
+            chunksize=100000, shard_size=1000000
+    ):
+        """
+        Tokenize data once and save the model inputs to a compiled dataset dir of .npy shards,
+        train and evaluate_model read it by memmap instead of tokenizing again.
+        The vocab in model_dir is used if exists, else it is built from the data and saved to model_dir.
+        @param data_list_or_path: file path, or data list of (label, text) / DataFrame loaded in memory
+        @param output_dir: compiled dataset dir
+        @param header:
+        @param names:
+        @param delimiter:
+        @param test_size: dev ratio, dev samples are split by hashing the text
+        @param chunksize: 每次读取的行数
+        @param shard_size: 每个shard的样本数
+        @return: output_dir
+        """
+        model_dir = self.model_dir
+        if model_dir:
+            os.makedirs(model_dir, exist_ok=True)
+        word_vocab_path = os.path.join(model_dir, 'word_vocab.json')
+        label_vocab_path = os.path.join(model_dir, 'label_vocab.json')
+
+        def data_chunks():
+            return load_data_chunks(data_list_or_path, chunksize=chunksize, test_size=test_size, header=header,
+                                    names=names, delimiter=delimiter)
+
+        self.word_id_map, self.label_id_map, _, _ = scan_streaming_data(
+            data_chunks(), self.tokenizer,
+            word_vocab_path,
+            label_vocab_path,
+            max_vocab_size=self.max_vocab_size,
+            unk_token=self.unk_token, pad_token=self.pad_token,
+            max_dev_size=0
+        )
+        compile_dataset(data_chunks(), output_dir, self._featurize, self.feature_names,
+                        self.word_id_map, self.label_id_map, meta=self._dataset_meta(), shard_size=shard_size)
+        return output_dir
+
     def train_model_from_data_iterator(
             self, save_model_path, train_iter, dev_iter,
             num_epochs=10, learning_rate=1e-3,
@@ -270,7 +419,18 @@ class FastTextClassifier(ClassifierABC):
         history = []
         # train
         start_time = time.time()
-        optimizer = torch.optim.Adam(self.model.parameters(), lr=learning_rate)
+        if self.sparse_embedding:
+            # embedding tables by SparseAdam, only the looked up rows and their moments are updated
+            embedding_params = [p for n, p in self.model.named_parameters() if n.startswith('embedding')]
+            dense_params = [p for n, p in self.model.named_parameters() if not n.startswith('embedding')]
+            optimizers = [torch.optim.SparseAdam(embedding_params, lr=learning_rate),
+                          torch.optim.Adam(dense_params, lr=learning_rate)]
+        else:
+            optimizers = [torch.optim.Adam(self.model.parameters(), lr=learning_rate)]
+        if self.count_ngram_buckets:
+            # hash bucket counts of the first epoch, for prune_ngram_buckets
+            bigram_counts = torch.zeros(self.n_gram_vocab, dtype=torch.long, device=self.device)
+            trigram_counts = torch.zeros(self.n_gram_vocab, dtype=torch.long, device=self.device)
 
         total_batch = 0  # 记录进行到多少batch
         dev_best_loss = 1e10
@@ -283,9 +443,16 @@ class FastTextClassifier(ClassifierABC):
                 outputs = self.model(trains)
                 loss = F.cross_entropy(outputs, labels)
                 # compute gradient and do SGD step
-                optimizer.zero_grad()
+                for optimizer in optimizers:
+                    optimizer.zero_grad()
                 loss.backward()
-                optimizer.step()
+                for optimizer in optimizers:
+                    optimizer.step()
+                if epoch == 0 and self.count_ngram_buckets:
+                    bigram = trains[2].reshape(-1)
+                    trigram = trains[3].reshape(-1)
+                    bigram_counts.scatter_add_(0, bigram, torch.ones_like(bigram))
+                    trigram_counts.scatter_add_(0, trigram, torch.ones_like(trigram))
                 if total_batch % evaluate_during_training_steps == 0:
                     # 输出在训练集和验证集上的效果
                     y_true = labels.cpu()
@@ -312,84 +479,62 @@ class FastTextClassifier(ClassifierABC):
                     history.append(msg)
                     self.model.train()
                 total_batch += 1
-                if total_batch - last_improve > require_improvement:
+                # without a dev set there is no loss to improve, train all epochs
+                if dev_iter is not None and total_batch - last_improve > require_improvement:
                     # 验证集loss超过1000batch没下降，结束训练
                     logger.debug("No optimization for a long time, auto-stopping...")
                     flag = True
                     break
+            if isinstance(train_iter, BatchLoader):
+                logger.debug(f'loader stats: {train_iter.stats()}')
             if flag:
                 break
+        if dev_iter is None:
+            # no dev set to select the best model, save the last one
+            torch.save(self.model.state_dict(), save_model_path)
+            logger.debug(f'Saved model: {save_model_path}')
+        if self.count_ngram_buckets:
+            np.savez(os.path.join(os.path.dirname(save_model_path), 'ngram_counts.npz'),
+                     bigram=bigram_counts.cpu().numpy(), trigram=trigram_counts.cpu().numpy())
         return history
 
+    def predict_proba(self, sentences: list):
+        """
+        Predict the probability of all labels for sentences.
+        @param sentences: list, input text list, eg: [text1, text2, ...]
+        @return: probs, np.float32 array (n_samples, n_labels), columns in the order of self.labels
+        """
+        if not self.is_trained:
+            raise ValueError('model not trained.')
+        return predict_proba_batches(self.model, self._featurize, sentences, len(self.label_id_map), self.device,
+                                     batch_size=self.batch_size)
+
     def predict(self, sentences: list):
         """
         Predict labels and label probability for sentences.
         @param sentences: list, input text list, eg: [text1, text2, ...]
         @return: predict_label, predict_prob
         """
-        if not self.is_trained:
-            raise ValueError('model not trained.')
-        self.model.eval()
-
-        def biGramHash(sequence, t, buckets):
-            t1 = sequence[t - 1] if t - 1 >= 0 else 0
-            return (t1 * 14918087) % buckets
-
-        def triGramHash(sequence, t, buckets):
-            t1 = sequence[t - 1] if t - 1 >= 0 else 0
-            t2 = sequence[t - 2] if t - 2 >= 0 else 0
-            return (t2 * 14918087 * 18408749 + t1 * 14918087) % buckets
-
-        def load_dataset(X, max_seq_length=128):
-            contents = []
-            for content in X:
-                words_line = []
-                token = self.tokenizer(content)
-                seq_len = len(token)
-                if max_seq_length:
-                    if len(token) < max_seq_length:
-                        token.extend([self.pad_token] * (max_seq_length - len(token)))
-                    else:
-                        token = token[:max_seq_length]
-                        seq_len = max_seq_length
-                # word to id
-                for word in token:
-                    words_line.append(self.word_id_map.get(word, self.word_id_map.get(self.unk_token)))
-                # fasttext ngram
-                buckets = self.n_gram_vocab
-                bigram = []
-                trigram = []
-                # ------ngram------
-                for i in range(max_seq_length):
-                    bigram.append(biGramHash(words_line, i, buckets))
-                    trigram.append(triGramHash(words_line, i, buckets))
-                # -----------------
-                contents.append((words_line, 0, seq_len, bigram, trigram))
-            return contents
-
-        data = load_dataset(sentences, self.max_seq_length)
-        data_iter = build_iterator(data, device, self.batch_size)
-        # predict probs
-        predict_all = np.array([], dtype=int)
-        proba_all = np.array([], dtype=float)
-        with torch.no_grad():
-            for texts, _ in data_iter:
-                outputs = self.model(texts)
-                logit = F.softmax(outputs, dim=1).detach().cpu().numpy()
-                pred = np.argmax(logit, axis=1)
-                proba = np.max(logit, axis=1)
-
-                predict_all = np.append(predict_all, pred)
-                proba_all = np.append(proba_all, proba)
-        id_label_map = {v: k for k, v in self.label_id_map.items()}
-        predict_labels = [id_label_map.get(i) for i in predict_all]
-        predict_probs = proba_all.tolist()
+        label_ids, top_probs = topk(self.predict_proba(sentences), k=1)
+        predict_labels = self.id_label[label_ids[:, 0]].tolist()
+        predict_probs = top_probs[:, 0].astype(np.float64).tolist()
         return predict_labels, predict_probs
 
     def evaluate_model(self, data_list_or_path, header=None,
                        names=('labels', 'text'), delimiter='\t'):
+        """
+        Evaluate model with data_list_or_path
+        @param data_list_or_path: data list, file path, or compiled dataset dir (see compile_dataset)
+        @return: accuracy score
+        """
+        self.load_model(quantized=self.quantized)
+        if is_compiled_dataset(data_list_or_path):
+            manifest, word_id_map, label_id_map = load_compiled_dataset(data_list_or_path, self._dataset_meta())
+            if word_id_map != self.word_id_map or label_id_map != self.label_id_map:
+                raise ValueError(f'vocab of {data_list_or_path} does not match the model, compile the dataset again.')
+            data_iter = MemmapDatasetIterater(data_list_or_path, self.device, self.batch_size)
+            return self.evaluate(data_iter)[0]
         X_test, y_test, df = load_data(data_list_or_path, header=header, names=names, delimiter=delimiter)
-        self.load_model()
         data, word_id_map, label_id_map = build_dataset(self.tokenizer, X_test, y_test,
                                                         self.word_vocab_path,
                                                         self.label_vocab_path,
@@ -397,7 +542,7 @@ class FastTextClassifier(ClassifierABC):
                                                         max_seq_length=self.max_seq_length,
                                                         unk_token=self.unk_token,
                                                         pad_token=self.pad_token, n_gram_vocab=self.n_gram_vocab)
-        data_iter = build_iterator(data, device, self.batch_size)
+        data_iter = BatchLoader(data, self.device, self.batch_size)
         return self.evaluate(data_iter)[0]
 
     def evaluate(self, data_iter):
@@ -408,29 +553,32 @@ class FastTextClassifier(ClassifierABC):
         """
         if not self.model:
             raise ValueError('model not trained.')
-        self.model.eval()
-        loss_total = 0.0
-        predict_all = np.array([], dtype=int)
-        labels_all = np.array([], dtype=int)
-        with torch.no_grad():
-            for texts, labels in data_iter:
-                outputs = self.model(texts)
-                loss = F.cross_entropy(outputs, labels)
-                loss_total += loss
-                labels = labels.cpu().numpy()
-                predic = torch.max(outputs, 1)[1].cpu().numpy()
-                labels_all = np.append(labels_all, labels)
-                predict_all = np.append(predict_all, predic)
-            logger.debug(f"evaluate, last batch, y_true: {labels}, y_pred: {predic}")
-        acc = metrics.accuracy_score(labels_all, predict_all)
-        return acc, loss_total / len(data_iter)
-
-    def load_model(self):
+        result = evaluate_batches(self.model, data_iter, len(self.label_id_map))
+        logger.debug(f"evaluate, samples: {result['num_samples']}, acc: {result['accuracy']:.4f}, "
+                     f"loss: {result['loss']:.4f}")
+        return result['accuracy'], result['loss']
+
+    def export(self, output_dir=None, format='onnx'):
+        """
+        Export the trained model with vocab to a bundle dir, served by ExportedPredictor without the classifier
+        @param output_dir: bundle dir, default model_dir/export
+        @param format: onnx or torchscript
+        @return: output_dir
+        """
+        if not self.is_trained or self.quantized:
+            # export the fp32 model
+            self.load_model()
+        return export_bundle(self, output_dir or os.path.join(self.model_dir, 'export'), format=format,
+                             input_names=('word_ids', 'bigram', 'trigram'),
+                             config={'n_gram_vocab': self.n_gram_vocab})
+
+    def load_model(self, quantized=False):
         """
         Load model from model_dir
+        @param quantized: load the quantized model saved by quantize(), runs on cpu
         @return:
         """
-        model_path = os.path.join(self.model_dir, 'model.pth')
+        model_path = os.path.join(self.model_dir, 'model_quantized.pth' if quantized else 'model.pth')
         if os.path.exists(model_path):
             self.word_vocab_path = os.path.join(self.model_dir, 'word_vocab.json')
             self.label_vocab_path = os.path.join(self.model_dir, 'label_vocab.json')
@@ -438,16 +586,87 @@ class FastTextClassifier(ClassifierABC):
             self.label_id_map = load_vocab(self.label_vocab_path)
             vocab_size = len(self.word_id_map)
             num_classes = len(self.label_id_map)
+            if quantized:
+                # quantized modules are pickled, the file is written by quantize()
+                checkpoint = torch.load(model_path, map_location='cpu', weights_only=False)
+                state_dict = checkpoint['state_dict']
+            else:
+                state_dict = torch.load(model_path, map_location=device)
+            # the n-gram tables of a pruned model are smaller
             self.model = FastTextModel(vocab_size, num_classes, self.embed_size, self.n_gram_vocab, self.hidden_size,
-                                       self.dropout_rate)
-            self.model.load_state_dict(torch.load(model_path, map_location=device))
-            self.model.to(device)
+                                       self.dropout_rate, ngram_table_sizes=ngram_table_sizes(state_dict))
+            if quantized:
+                self.model = quantize_model(self.model, embedding_dtype=checkpoint['embedding_dtype'])
+                self.device = torch.device('cpu')
+            else:
+                self.device = device
+            self.model.load_state_dict(state_dict)
+            self.model.to(self.device)
+            self.quantized = quantized
             self.is_trained = True
         else:
             logger.error(f'{model_path} not exists.')
             self.is_trained = False
         return self.is_trained
 
+    def prune_ngram_buckets(self, min_count=1):
+        """
+        Drop the n-gram hash buckets seen less than min_count times in training (counted in the first epoch
+        of a model trained with count_ngram_buckets=True),
+        and save the model with compact n-gram tables to model_dir/model.pth, predictions change only for
+        the dropped buckets, which are mapped to a zero vector. Prune again with a larger min_count to drop more.
+        @param min_count: 训练中出现次数少于min_count的ngram桶被删除
+        @return: dict, kept buckets and model file size (MB) before and after pruning
+        """
+        counts_path = os.path.join(self.model_dir, 'ngram_counts.npz')
+        if not os.path.exists(counts_path):
+            raise ValueError(f'{counts_path} not exists, train the model with count_ngram_buckets=True first.')
+        if not self.load_model():
+            raise ValueError('model not trained.')
+        model_path = os.path.join(self.model_dir, 'model.pth')
+        result = {'size': model_size(model_path)}
+        with np.load(counts_path) as counts:
+            self.model = prune_ngram_buckets(self.model, counts['bigram'], counts['trigram'], min_count=min_count)
+        torch.save(self.model.state_dict(), model_path)
+        result['bigram_buckets'] = self.model.embedding_ngram2.num_embeddings - 1
+        result['trigram_buckets'] = self.model.embedding_ngram3.num_embeddings - 1
+        result['pruned_size'] = model_size(model_path)
+        logger.info(f'pruned model: {model_path}, {result}')
+        return result
+
+    def quantize(self, data_list_or_path=None, embedding_dtype='int8', header=None, names=('labels', 'text'),
+                 delimiter='\t'):
+        """
+        Quantize the trained model for cpu inference and save it to model_dir/model_quantized.pth,
+        Linear and LSTM layers are int8 dynamic quantized, embeddings are stored as embedding_dtype,
+        load it by load_model(quantized=True)
+        @param data_list_or_path: dev data, the accuracy of the fp32 and the quantized model is evaluated on it
+        @param embedding_dtype: fp16, int8 (per-row scale) or fp32
+        @param header:
+        @param names:
+        @param delimiter:
+        @return: dict, model file size (MB) and dev accuracy of the fp32 and the quantized model
+        """
+        if not self.load_model():
+            raise ValueError('model not trained.')
+        result = {'fp32_size': model_size(os.path.join(self.model_dir, 'model.pth'))}
+        if data_list_or_path is not None:
+            result['fp32_acc'] = self.evaluate_model(data_list_or_path, header=header, names=names,
+                                                     delimiter=delimiter)
+        quantized_path = os.path.join(self.model_dir, 'model_quantized.pth')
+        self.model = quantize_model(self.model, embedding_dtype=embedding_dtype)
+        self.device = torch.device('cpu')
+        self.quantized = True
+        torch.save({'embedding_dtype': embedding_dtype, 'state_dict': self.model.state_dict()}, quantized_path)
+        result['quantized_size'] = model_size(quantized_path)
+        if data_list_or_path is not None:
+            # evaluate_model loads the saved quantized model again
+            result['quantized_acc'] = self.evaluate_model(data_list_or_path, header=header, names=names,
+                                                          delimiter=delimiter)
+            result['acc_delta'] = result['quantized_acc'] - result['fp32_acc']
+        logger.info(f'quantized model: {quantized_path}, ' + ', '.join(f'{k}: {v:.4f}' for k, v in result.items()))
+        return result
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Text Classification')
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+@author:XuMing(xuming624@qq.com)
+@description: Linear scorer, predict of linear classifiers with one sparse matmul, numpy and scipy only
+"""
+import json
+
+import numpy as np
+import scipy.sparse as sp
+
+
+def softmax(scores):
+    scores = scores - scores.max(axis=1, keepdims=True)
+    np.exp(scores, out=scores)
+    scores /= scores.sum(axis=1, keepdims=True)
+    return scores
+
+
+def sigmoid(scores):
+    return 1.0 / (1.0 + np.exp(-scores))
+
+
+class LinearScorer(object):
+    """
+    Linear scorer exported from a trained sklearn linear classifier:
+        scores = X * W^T + b
+        softmax link: probs = softmax(scores), eg: multinomial LogisticRegression, MultinomialNB
+        ovr link: probs = sigmoid(scores) normalized by row, or [1 - p, p] for binary, eg: SGDClassifier
+    Weights are CSR if sparse enough, else dense. Saved as npz, loaded without sklearn.
+    """
+
+    def __init__(self, weights, intercept, classes, link='softmax'):
+        """
+        :param weights: (n_classes, n_features) array or sparse matrix, one row for binary ovr
+        :param intercept: (n_classes,) array
+        :param classes: labels of the classes
+        :param link: softmax or ovr
+        """
+        if link not in ('softmax', 'ovr'):
+            raise ValueError(f'link should be softmax or ovr, got {link}.')
+        self.weights = weights
+        self.intercept = np.asarray(intercept, dtype=np.float64)
+        self.classes = np.asarray(classes)
+        if self.classes.dtype.kind == 'U':
+            self.classes = self.classes.astype(object)
+        self.link = link
+        # X * W^T, csc of W^T keeps the sparse matmul fast
+        self._weights_t = weights.T.tocsc() if sp.issparse(weights) else np.ascontiguousarray(weights.T)
+
+    def __str__(self):
+        return f'LinearScorer(n_classes: {len(self.classes)}, n_features: {self.weights.shape[1]}, link: {self.link})'
+
+    @classmethod
+    def from_model(cls, model, sparse_threshold=0.5):
+        """
+        Export a trained sklearn model, raise ValueError if the model is not supported
+        :param model: LogisticRegression, MultinomialNB, SGDClassifier(loss='log_loss'),
+            or a model with export_linear_scorer method
+        :param sparse_threshold: save weights as CSR if the nonzero ratio is less than it
+        :return: LinearScorer
+        """
+        from sklearn.linear_model import LogisticRegression, SGDClassifier
+        from sklearn.naive_bayes import MultinomialNB
+
+        if hasattr(model, 'export_linear_scorer'):
+            return model.export_linear_scorer()
+        if isinstance(model, MultinomialNB):
+            weights, intercept, link = model.feature_log_prob_, model.class_log_prior_, 'softmax'
+        elif isinstance(model, LogisticRegression):
+            weights, intercept = model.coef_, model.intercept_
+            multi_class = getattr(model, 'multi_class', 'auto')
+            if multi_class == 'auto':
+                multi_class = 'ovr' if model.solver == 'liblinear' else 'multinomial'
+            link = 'ovr' if len(model.classes_) == 2 or multi_class == 'ovr' else 'softmax'
+        elif isinstance(model, SGDClassifier) and model.loss == 'log_loss':
+            weights, intercept, link = model.coef_, model.intercept_, 'ovr'
+        else:
+            raise ValueError(f'model {model.__class__.__name__} not supported by LinearScorer.')
+        if not hasattr(model, 'classes_'):
+            raise ValueError('model not trained.')
+        weights = np.asarray(weights, dtype=np.float64)
+        if np.count_nonzero(weights) < sparse_threshold * weights.size:
+            weights = sp.csr_matrix(weights)
+        return cls(weights, intercept, model.classes_, link=link)
+
+    def decision_function(self, X):
+        """
+        :param X: (n_samples, n_features) sparse matrix or array
+        :return: scores, (n_samples, n_classes) array, (n_samples, 1) for binary ovr
+        """
+        scores = X @ self._weights_t
+        if sp.issparse(scores):
+            scores = scores.toarray()
+        scores = np.asarray(scores, dtype=np.float64)
+        scores += self.intercept
+        return scores
+
+    def predict_proba(self, X):
+        """
+        :param X: (n_samples, n_features) sparse matrix or array
+        :return: probs, (n_samples, n_classes) array
+        """
+        scores = self.decision_function(X)
+        if self.link == 'softmax':
+            return softmax(scores)
+        probs = sigmoid(scores)
+        if probs.shape[1] == 1:
+            return np.hstack([1 - probs, probs])
+        probs /= probs.sum(axis=1, keepdims=True)
+        return probs
+
+    def predict(self, X):
+        """
+        :param X: (n_samples, n_features) sparse matrix or array
+        :return: predict_labels, predict_probs; array of labels and array of their probability
+        """
+        probs = self.predict_proba(X)
+        label_ids = probs.argmax(axis=1)
+        return self.classes[label_ids], probs[np.arange(len(label_ids)), label_ids]
+
+    def save(self, path):
+        """Save to npz file"""
+        arrays = {
+            'intercept': self.intercept,
+            'classes': np.array(json.dumps(self.classes.tolist(), ensure_ascii=False)),
+            'link': np.array(self.link),
+        }
+        if sp.issparse(self.weights):
+            weights = self.weights.tocsr()
+            arrays.update(weights_data=weights.data, weights_indices=weights.indices, weights_indptr=weights.indptr,
+                          weights_shape=np.array(weights.shape))
+        else:
+            arrays['weights'] = self.weights
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """Load from npz file"""
+        with np.load(path) as f:
+            if 'weights' in f:
+                weights = f['weights']
+            else:
+                weights = sp.csr_matrix((f['weights_data'], f['weights_indices'], f['weights_indptr']),
+                                        shape=tuple(f['weights_shape']))
+            classes = json.loads(str(f['classes']))
+            return cls(weights, f['intercept'], classes, link=str(f['link']))
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+@author:XuMing(xuming624@qq.com)
+@description: Linear SVM with probability calibration fitted on a held-out slice
+"""
+import numpy as np
+from sklearn.base import BaseEstimator, ClassifierMixin
+from sklearn.isotonic import IsotonicRegression
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import train_test_split
+from sklearn.svm import LinearSVC
+
+from pytextclassifier.linear_scorer import LinearScorer
+
+
+class CalibratedLinearSVC(BaseEstimator, ClassifierMixin):
+    """
+    LinearSVC (liblinear, linear time in the number of samples) with one probability calibrator per class,
+    fitted on the decision scores of a held-out slice:
+        sigmoid: Platt scaling, p = sigmoid(a * score + b), stays linear, exported to LinearScorer
+        isotonic: IsotonicRegression of the score
+    Probabilities of the classes are normalized to sum to 1, as sklearn CalibratedClassifierCV does.
+    """
+
+    def __init__(self, C=1.0, method='sigmoid', calibration_size=0.1, max_iter=1000, random_state=1):
+        """
+        :param C: LinearSVC regularization
+        :param method: sigmoid or isotonic
+        :param calibration_size: ratio of the held-out slice for calibration
+        :param max_iter: LinearSVC max_iter
+        :param random_state: split and LinearSVC seed
+        """
+        self.C = C
+        self.method = method
+        self.calibration_size = calibration_size
+        self.max_iter = max_iter
+        self.random_state = random_state
+
+    def fit(self, X, y):
+        if self.method not in ('sigmoid', 'isotonic'):
+            raise ValueError(f'method should be sigmoid or isotonic, got {self.method}.')
+        y = np.asarray(y)
+        self.classes_ = np.unique(y)
+        if len(self.classes_) < 2:
+            raise ValueError('need at least 2 classes.')
+        try:
+            X_fit, X_cal, y_fit, y_cal = train_test_split(X, y, test_size=self.calibration_size,
+                                                          random_state=self.random_state, stratify=y)
+        except ValueError:
+            # too few samples of some class to stratify
+            X_fit, X_cal, y_fit, y_cal = train_test_split(X, y, test_size=self.calibration_size,
+                                                          random_state=self.random_state)
+        if len(np.unique(y_fit)) < len(self.classes_):
+            # calibrate on train data rather than drop a class
+            X_fit, y_fit, X_cal, y_cal = X, y, X, y
+        self.svc_ = LinearSVC(C=self.C, max_iter=self.max_iter, random_state=self.random_state)
+        self.svc_.fit(X_fit, y_fit)
+        self.coef_ = self.svc_.coef_
+        self.intercept_ = self.svc_.intercept_
+
+        scores = self._scores(X_cal)
+        # binary: one score for the positive class
+        targets = [self.classes_[-1]] if scores.shape[1] == 1 else self.classes_
+        self.calibrators_ = []
+        for k, label in enumerate(targets):
+            y_k = (y_cal == label).astype(int)
+            if self.method == 'sigmoid':
+                if 0 < y_k.sum() < len(y_k):
+                    lr = LogisticRegression(C=1e4).fit(scores[:, k:k + 1], y_k)
+                    self.calibrators_.append((float(lr.coef_[0, 0]), float(lr.intercept_[0])))
+                else:
+                    self.calibrators_.append((1.0, 0.0))
+            else:
+                self.calibrators_.append(IsotonicRegression(out_of_bounds='clip').fit(scores[:, k], y_k))
+        return self
+
+    def _scores(self, X):
+        scores = self.svc_.decision_function(X)
+        return scores.reshape(-1, 1) if scores.ndim == 1 else scores
+
+    def decision_function(self, X):
+        return self.svc_.decision_function(X)
+
+    def predict_proba(self, X):
+        scores = self._scores(X)
+        probs = np.empty_like(scores, dtype=np.float64)
+        for k, calibrator in enumerate(self.calibrators_):
+            if self.method == 'sigmoid':
+                a, b = calibrator
+                probs[:, k] = 1.0 / (1.0 + np.exp(-(a * scores[:, k] + b)))
+            else:
+                probs[:, k] = calibrator.predict(scores[:, k])
+        if probs.shape[1] == 1:
+            return np.hstack([1 - probs, probs])
+        denominator = probs.sum(axis=1, keepdims=True)
+        zero_rows = denominator[:, 0] == 0
+        probs[zero_rows] = 1.0 / probs.shape[1]
+        denominator[zero_rows] = 1.0
+        probs /= denominator
+        return probs
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+    def export_linear_scorer(self):
+        """
+        Sigmoid calibration folded into the weights: sigmoid(a * (w.x + c) + b) = sigmoid((a * w).x + a * c + b)
+        :return: LinearScorer, raise ValueError for isotonic calibration
+        """
+        if self.method != 'sigmoid':
+            raise ValueError('only sigmoid calibration is linear.')
+        if not hasattr(self, 'calibrators_'):
+            raise ValueError('model not trained.')
+        a = np.array([c[0] for c in self.calibrators_])
+        b = np.array([c[1] for c in self.calibrators_])
+        return LinearScorer(self.coef_ * a[:, None], self.intercept_ * a + b, self.classes_, link='ovr')
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+@author:XuMing(xuming624@qq.com)
+@description: Pre-tokenized dataset, fixed-width .npy shards read by memmap, with a json manifest
+keyed by the vocab hash
+
+compiled dataset dir:
+    manifest.json
+    word_vocab.json
+    label_vocab.json
+    train-00000.word_ids.npy, train-00000.seq_lens.npy, train-00000.labels.npy, ...
+    dev-00000.word_ids.npy, ...
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+import torch
+from loguru import logger
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def vocab_hash(word_id_map, label_id_map, meta=None):
+    """
+    Hash of the vocab and the featurize params, compiled ids are only valid for the same hash
+    """
+    content = json.dumps([word_id_map, label_id_map, meta or {}], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def is_compiled_dataset(path):
+    return isinstance(path, str) and os.path.isfile(os.path.join(path, MANIFEST_NAME))
+
+
+def _write_shard(output_dir, split, index, arrays, names, rng):
+    # shuffle rows once at compile time, so contiguous batches are mixed at train time
+    order = rng.permutation(len(arrays[-1]))
+    files = {}
+    for name, array in zip(names, arrays):
+        file_name = f'{split}-{index:05d}.{name}.npy'
+        np.save(os.path.join(output_dir, file_name), np.ascontiguousarray(array[order]))
+        files[name] = file_name
+    return {'split': split, 'size': len(order), 'files': files}
+
+
+def compile_dataset(data_chunks, output_dir, featurize_fn, feature_names, word_id_map, label_id_map, meta=None,
+                    shard_size=1000000, seed=1):
+    """
+    Featurize data chunks and write them to .npy shards
+    :param data_chunks: iterable of (X, y, is_dev), eg: base_classifier.load_data_chunks
+    :param output_dir: compiled dataset dir
+    :param featurize_fn: callable, X -> tuple of np.ndarray features
+    :param feature_names: names of the featurize_fn outputs, eg: ('word_ids', 'seq_lens')
+    :param word_id_map:
+    :param label_id_map:
+    :param meta: dict, featurize params, eg: {'max_seq_length': 128}
+    :param shard_size: max number of samples per shard
+    :param seed: row shuffle seed
+    :return: manifest
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    names = list(feature_names) + ['labels']
+    rng = np.random.RandomState(seed)
+    buffers = {'train': [], 'dev': []}
+    shards = []
+
+    def write(split, arrays):
+        index = sum(1 for shard in shards if shard['split'] == split)
+        shards.append(_write_shard(output_dir, split, index, arrays, names, rng))
+
+    for X, y, is_dev in data_chunks:
+        if len(X) == 0:
+            continue
+        label_ids = [label_id_map.get(label) for label in y]
+        if None in label_ids:
+            raise ValueError(f'label not in label vocab: {y.tolist()[label_ids.index(None)]}')
+        arrays = tuple(featurize_fn(X)) + (np.array(label_ids, dtype=np.int64),)
+        for split, mask in (('train', ~is_dev), ('dev', is_dev)):
+            if not mask.any():
+                continue
+            buffers[split].append(tuple(a[mask] for a in arrays))
+            buffer_size = sum(len(b[-1]) for b in buffers[split])
+            if buffer_size < shard_size:
+                continue
+            merged = [np.concatenate(a) for a in zip(*buffers[split])]
+            start = 0
+            while buffer_size - start >= shard_size:
+                write(split, [a[start: start + shard_size] for a in merged])
+                start += shard_size
+            buffers[split] = [tuple(a[start:] for a in merged)] if start < buffer_size else []
+    for split in ('train', 'dev'):
+        if buffers[split]:
+            write(split, [np.concatenate(a) for a in zip(*buffers[split])])
+
+    json.dump(word_id_map, open(os.path.join(output_dir, 'word_vocab.json'), 'w', encoding='utf-8'),
+              ensure_ascii=False, indent=4)
+    json.dump(label_id_map, open(os.path.join(output_dir, 'label_vocab.json'), 'w', encoding='utf-8'),
+              ensure_ascii=False, indent=4)
+    manifest = {
+        'vocab_hash': vocab_hash(word_id_map, label_id_map, meta),
+        'meta': meta or {},
+        'feature_names': list(feature_names),
+        'num_samples': {split: sum(s['size'] for s in shards if s['split'] == split) for split in ('train', 'dev')},
+        'shards': shards,
+    }
+    json.dump(manifest, open(os.path.join(output_dir, MANIFEST_NAME), 'w', encoding='utf-8'), indent=4)
+    logger.debug(f"compiled dataset: {output_dir}, samples: {manifest['num_samples']}, shards: {len(shards)}")
+    return manifest
+
+
+def load_compiled_dataset(data_dir, meta=None):
+    """
+    Load manifest and vocab of a compiled dataset
+    :param data_dir: compiled dataset dir
+    :param meta: featurize params of the classifier, must be the same as the compiled ones
+    :return: manifest, word_id_map, label_id_map
+    """
+    if not is_compiled_dataset(data_dir):
+        raise ValueError(f'{data_dir} is not a compiled dataset.')
+    manifest = json.load(open(os.path.join(data_dir, MANIFEST_NAME), 'r', encoding='utf-8'))
+    word_id_map = json.load(open(os.path.join(data_dir, 'word_vocab.json'), 'r', encoding='utf-8'))
+    label_id_map = json.load(open(os.path.join(data_dir, 'label_vocab.json'), 'r', encoding='utf-8'))
+    if vocab_hash(word_id_map, label_id_map, manifest['meta']) != manifest['vocab_hash']:
+        raise ValueError(f'vocab of {data_dir} does not match its manifest, compile the dataset again.')
+    if meta is not None and meta != manifest['meta']:
+        raise ValueError(f"compiled with {manifest['meta']}, but the classifier uses {meta}, "
+                         f"compile the dataset again.")
+    return manifest, word_id_map, label_id_map
+
+
+class MemmapDatasetIterater:
+    """
+    Batch iterator over a compiled dataset, batches are contiguous slices of the memmap shards, shared with
+    the tensors by torch.from_numpy without copy. Shuffle permutes the batch order over all shards.
+    """
+
+    def __init__(self, data_dir, device, batch_size=32, split=None, shuffle=False, seed=1):
+        """
+        :param data_dir: compiled dataset dir
+        :param device: torch device
+        :param batch_size:
+        :param split: 'train', 'dev', or None for all shards
+        :param shuffle: shuffle the batch order or not
+        :param seed: shuffle seed, changed by epoch
+        """
+        manifest = json.load(open(os.path.join(data_dir, MANIFEST_NAME), 'r', encoding='utf-8'))
+        self.data_dir = data_dir
+        self.feature_names = manifest['feature_names']
+        self.shards = [s for s in manifest['shards'] if split is None or s['split'] == split]
+        self.device = device
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self._arrays = None
+
+    def _load(self):
+        if self._arrays is None:
+            # copy-on-write mapping: pages are shared with the file, and arrays are writable for torch.from_numpy
+            self._arrays = [
+                {name: np.load(os.path.join(self.data_dir, file_name), mmap_mode='c')
+                 for name, file_name in shard['files'].items()}
+                for shard in self.shards
+            ]
+        return self._arrays
+
+    def __iter__(self):
+        arrays = self._load()
+        batches = [(i, start) for i, shard in enumerate(self.shards)
+                   for start in range(0, shard['size'], self.batch_size)]
+        if self.shuffle:
+            rng = np.random.RandomState(self.seed + self.epoch)
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+        self.epoch += 1
+        for i, start in batches:
+            end = start + self.batch_size
+            features = tuple(torch.from_numpy(arrays[i][name][start:end]).to(self.device)
+                             for name in self.feature_names)
+            labels = torch.from_numpy(arrays[i]['labels'][start:end]).to(self.device)
+            yield features, labels
+
+    def __len__(self):
+        return sum((shard['size'] + self.batch_size - 1) // self.batch_size for shard in self.shards)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+@author:XuMing(xuming624@qq.com)
+@description: Batch prediction and evaluation core of the torch classifiers (FastText, TextCNN, TextRNN),
+outputs are written into preallocated arrays and metrics are accumulated in one pass, linear in the data size.
+torch is imported by the functions that run a model only, topk and id_label_array are numpy only.
+"""
+import numpy as np
+
+
+def id_label_array(label_id_map):
+    """
+    :param label_id_map: dict, label -> id
+    :return: np.ndarray of object, labels in id order, map label ids with id_label[label_ids]
+    """
+    id_label = np.empty(len(label_id_map), dtype=object)
+    for label, label_id in label_id_map.items():
+        id_label[label_id] = label
+    return id_label
+
+
+def predict_proba_batches(model, featurize_fn, sentences, num_classes, device, batch_size=64):
+    """
+    Softmax probs of sentences, featurized and predicted batch by batch
+    :param model: nn.Module, called with a tuple of input tensors
+    :param featurize_fn: callable, texts -> tuple of np.ndarray features
+    :param sentences: list of text
+    :param num_classes:
+    :param device: torch device
+    :param batch_size:
+    :return: probs, np.float32 array (n_samples, num_classes), columns in label id order
+    """
+    import torch
+    import torch.nn.functional as F
+
+    probs = np.empty((len(sentences), num_classes), dtype=np.float32)
+    model.eval()
+    with torch.no_grad():
+        for start in range(0, len(sentences), batch_size):
+            features = featurize_fn(sentences[start: start + batch_size])
+            inputs = tuple(torch.from_numpy(feature).to(device) for feature in features)
+            outputs = model(inputs)
+            probs[start: start + len(outputs)] = F.softmax(outputs.float(), dim=1).cpu().numpy()
+    return probs
+
+
+def topk(probs, k=1):
+    """
+    Top k label ids and probs of each row, argpartition then sort the k columns only
+    :param probs: np.ndarray (n_samples, num_classes)
+    :param k: int, clipped to num_classes
+    :return: ids, np.int64 array (n_samples, k); top_probs, array (n_samples, k); sorted by prob desc
+    """
+    k = max(1, min(k, probs.shape[1]))
+    if k == 1:
+        ids = probs.argmax(axis=1)[:, None]
+    else:
+        ids = np.argpartition(-probs, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(probs, ids, axis=1), axis=1, kind='stable')
+        ids = np.take_along_axis(ids, order, axis=1)
+    return ids.astype(np.int64), np.take_along_axis(probs, ids, axis=1)
+
+
+def evaluate_batches(model, data_iter, num_classes):
+    """
+    Evaluate the model over a batch iterator in one pass, the loss is summed as a float and the predictions
+    are counted into a confusion matrix, no per-sample arrays are kept
+    :param model: nn.Module
+    :param data_iter: iterable of (inputs, labels) tensors, eg: BatchLoader
+    :param num_classes:
+    :return: dict, accuracy, loss (mean per sample), confusion_matrix (num_classes, num_classes), rows are
+        the true labels, num_samples
+    """
+    import torch
+    import torch.nn.functional as F
+
+    confusion = np.zeros(num_classes * num_classes, dtype=np.int64)
+    loss_total = 0.0
+    model.eval()
+    with torch.no_grad():
+        for inputs, labels in data_iter:
+            outputs = model(inputs)
+            loss_total += F.cross_entropy(outputs.float(), labels, reduction='sum').item()
+            pairs = labels * num_classes + outputs.argmax(dim=1)
+            confusion += np.bincount(pairs.cpu().numpy(), minlength=num_classes * num_classes)
+    confusion = confusion.reshape(num_classes, num_classes)
+    num_samples = int(confusion.sum())
+    return {
+        'accuracy': float(np.trace(confusion)) / max(num_samples, 1),
+        'loss': loss_total / max(num_samples, 1),
+        'confusion_matrix': confusion,
+        'num_samples': num_samples,
+    }
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+@author:XuMing(xuming624@qq.com)
+@description: Lightweight predictor of an exported bundle (see export), onnxruntime or TorchScript,
+without building the classifier and its nn.Module; torch is not imported for onnx bundles.
+"""
+import json
+import os
+
+import numpy as np
+
+from pytextclassifier.data_helper import char_tokenize, encode_sequences, ngram_hash
+from pytextclassifier.predict_util import id_label_array, topk
+
+EXPORT_CONFIG_NAME = 'export_config.json'
+
+
+class ExportedPredictor(object):
+    def __init__(self, bundle_dir, tokenizer=None, batch_size=64, providers=None):
+        """
+        Load an exported bundle
+        :param bundle_dir: dir written by export of TextCNNClassifier, TextRNNClassifier or FastTextClassifier
+        :param tokenizer: required if the classifier has a custom tokenizer, char-level by default
+        :param batch_size:
+        :param providers: onnxruntime execution providers, cpu if None
+        """
+        config_path = os.path.join(bundle_dir, EXPORT_CONFIG_NAME)
+        if not os.path.exists(config_path):
+            raise ValueError(f'{config_path} not exists, export the model first.')
+        with open(config_path, 'r', encoding='utf-8') as f:
+            self.config = json.load(f)
+        if tokenizer is None:
+            if self.config['tokenizer'] != 'char':
+                raise ValueError('the model is exported with a custom tokenizer, pass the tokenizer.')
+            tokenizer = char_tokenize
+        self.tokenizer = tokenizer
+        self.batch_size = batch_size
+        with open(os.path.join(bundle_dir, 'word_vocab.json'), 'r', encoding='utf-8') as f:
+            self.word_id_map = json.load(f)
+        with open(os.path.join(bundle_dir, 'label_vocab.json'), 'r', encoding='utf-8') as f:
+            self.label_id_map = json.load(f)
+        self.id_label = id_label_array(self.label_id_map)
+        self.input_names = self.config['input_names']
+        model_path = os.path.join(bundle_dir, self.config['model_file'])
+        if self.config['format'] == 'onnx':
+            import onnxruntime
+
+            self.session = onnxruntime.InferenceSession(model_path, providers=providers or ['CPUExecutionProvider'])
+            self._run = lambda inputs: self.session.run(None, dict(zip(self.input_names, inputs)))[0]
+        else:
+            import torch
+
+            self.module = torch.jit.load(model_path, map_location='cpu')
+
+            def run(inputs):
+                with torch.no_grad():
+                    return self.module(*[torch.from_numpy(a) for a in inputs]).numpy()
+
+            self._run = run
+
+    def __str__(self):
+        return f"ExportedPredictor instance ({self.config['classifier']}, {self.config['format']})"
+
+    def _featurize(self, X):
+        """Texts to the input arrays of the graph, same as the classifier featurize"""
+        word_ids, seq_lens = encode_sequences(X, self.tokenizer, self.word_id_map,
+                                              max_seq_length=self.config['max_seq_length'],
+                                              unk_token=self.config['unk_token'], pad_token=self.config['pad_token'])
+        features = {'word_ids': word_ids, 'seq_lens': seq_lens}
+        if 'bigram' in self.input_names or 'trigram' in self.input_names:
+            features['bigram'], features['trigram'] = ngram_hash(word_ids, self.config['n_gram_vocab'])
+        return [features[name] for name in self.input_names]
+
+    def predict_proba(self, sentences):
+        """
+        :param sentences: list, input text list
+        :return: probs, (n_samples, n_classes) float32 array, columns in label id order
+        """
+        probs = np.empty((len(sentences), len(self.id_label)), dtype=np.float32)
+        for start in range(0, len(sentences), self.batch_size):
+            batch = sentences[start: start + self.batch_size]
+            logits = np.asarray(self._run(self._featurize(batch)), dtype=np.float32)
+            # softmax
+            logits -= logits.max(axis=1, keepdims=True)
+            np.exp(logits, out=logits)
+            probs[start: start + len(batch)] = logits / logits.sum(axis=1, keepdims=True)
+        return probs
+
+    def predict(self, sentences: list):
+        """
+        Predict labels and label probability for sentences, same outputs as the classifier predict
+        :param sentences: list, input text list, eg: [text1, text2, ...]
+        :return: predict_label, predict_prob
+        """
+        label_ids, top_probs = topk(self.predict_proba(sentences), k=1)
+        return self.id_label[label_ids[:, 0]].tolist(), top_probs[:, 0].astype(np.float64).tolist()
+
+    def predict_topk(self, sentences: list, k=3):
+        """
+        Top k labels and their probability for sentences, ranked by probability
+        :param sentences: list, input text list
+        :param k: number of labels of each sentence, clipped to the number of labels
+        :return: topk_labels, topk_probs; lists of k labels and k probabilities of each sentence
+        """
+        label_ids, top_probs = topk(self.predict_proba(sentences), k=k)
+        return self.id_label[label_ids].tolist(), top_probs.astype(np.float64).tolist()
+
+    @property
+    def labels(self):
+        """Labels in the column order of predict_proba"""
+        return self.id_label.tolist()
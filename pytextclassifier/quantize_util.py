@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+@author:XuMing(xuming624@qq.com)
+@description: Post-training quantization of the lightweight torch classifiers (FastText, TextCNN, TextRNN),
+int8 dynamic quantization of Linear/LSTM layers and fp16 or int8 (per-row scale) embedding storage, cpu only
+"""
+import os
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+EMBEDDING_DTYPES = ('fp16', 'int8', 'fp32')
+
+
+class QuantizedEmbedding(nn.Module):
+    """
+    Inference embedding stored as fp16, or int8 with a fp32 scale per row: row = weight_int8 * scale,
+    scale = max(abs(row)) / 127. Only the looked up rows are dequantized.
+    """
+
+    def __init__(self, num_embeddings, embedding_dim, dtype='int8'):
+        super().__init__()
+        if dtype not in ('fp16', 'int8'):
+            raise ValueError(f'dtype should be fp16 or int8, got {dtype}.')
+        self.num_embeddings = num_embeddings
+        self.embedding_dim = embedding_dim
+        self.dtype = dtype
+        if dtype == 'fp16':
+            self.register_buffer('weight', torch.zeros(num_embeddings, embedding_dim, dtype=torch.float16))
+        else:
+            self.register_buffer('weight', torch.zeros(num_embeddings, embedding_dim, dtype=torch.int8))
+            self.register_buffer('scale', torch.ones(num_embeddings, 1))
+
+    def extra_repr(self):
+        return f'{self.num_embeddings}, {self.embedding_dim}, dtype={self.dtype}'
+
+    @classmethod
+    def from_embedding(cls, embedding, dtype='int8'):
+        """
+        :param embedding: nn.Embedding
+        :param dtype: fp16 or int8
+        :return: QuantizedEmbedding
+        """
+        module = cls(embedding.num_embeddings, embedding.embedding_dim, dtype=dtype)
+        weight = embedding.weight.detach().float().cpu()
+        if dtype == 'fp16':
+            module.weight.copy_(weight.half())
+        else:
+            scale = weight.abs().max(dim=1, keepdim=True)[0] / 127.0
+            scale[scale == 0] = 1.0
+            module.weight.copy_(torch.round(weight / scale).clamp(-127, 127).to(torch.int8))
+            module.scale.copy_(scale)
+        return module
+
+    def forward(self, input):
+        if self.dtype == 'fp16':
+            return F.embedding(input, self.weight).float()
+        return F.embedding(input, self.weight).float() * F.embedding(input, self.scale)
+
+
+def quantize_model(model, embedding_dtype='int8'):
+    """
+    Quantize a trained fp32 model in place for cpu inference:
+        nn.Embedding -> QuantizedEmbedding of embedding_dtype, kept as fp32 if embedding_dtype is fp32
+        nn.Linear, nn.LSTM -> int8 dynamic quantized modules (weights int8, activations quantized on the fly)
+    Quantize a new fp32 model of the same structure, then load_state_dict, to load saved quantized weights.
+    :param model: nn.Module
+    :param embedding_dtype: fp16, int8 or fp32
+    :return: quantized model, in eval mode
+    """
+    if embedding_dtype not in EMBEDDING_DTYPES:
+        raise ValueError(f'embedding_dtype should be one of {EMBEDDING_DTYPES}, got {embedding_dtype}.')
+    model = model.cpu().eval()
+    if embedding_dtype != 'fp32':
+        for parent in list(model.modules()):
+            for name, child in list(parent.named_children()):
+                if isinstance(child, nn.Embedding):
+                    setattr(parent, name, QuantizedEmbedding.from_embedding(child, dtype=embedding_dtype))
+    return torch.ao.quantization.quantize_dynamic(model, {nn.Linear, nn.LSTM}, dtype=torch.qint8)
+
+
+def model_size(path):
+    """File size in MB"""
+    return os.path.getsize(path) / 1024 / 1024
@@ -7,9 +7,9 @@ import os
 from codecs import open
 import pickle
 from sklearn.cluster import MiniBatchKMeans
-from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
 from loguru import logger
-from pytextclassifier.tokenizer import Tokenizer
+from pytextclassifier.tokenizer import NgramAnalyzer, Tokenizer
 
 pwd_path = os.path.abspath(os.path.dirname(__file__))
 default_stopwords_path = os.path.join(pwd_path, 'stopwords.txt')
@@ -21,9 +21,11 @@ class TextCluster(object):
             model_dir,
             model=None, tokenizer=None, feature=None,
             stopwords_path=default_stopwords_path,
-            n_clusters=3, n_init=10, ngram_range=(1, 2), **kwargs
+            n_clusters=3, n_init=10, ngram_range=(1, 2), n_features=2 ** 20, **kwargs
     ):
         self.model_dir = model_dir
+        self.ngram_range = ngram_range
+        self.n_features = n_features  # 流式训练hashing特征维度
         self.model = model if model else MiniBatchKMeans(n_clusters=n_clusters, n_init=n_init)
         self.tokenizer = tokenizer if tokenizer else Tokenizer()
         self.feature = feature if feature else TfidfVectorizer(ngram_range=ngram_range, **kwargs)
@@ -44,18 +46,40 @@ class TextCluster(object):
         :return: list, text list
         """
         contents = []
-        if not os.path.exists(file_path):
-            raise ValueError('file not found. path: {}'.format(file_path))
-        with open(file_path, "r", encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                if use_col:
-                    contents.append(line.split(sep)[use_col])
-                else:
-                    contents.append(line)
+        for chunk in TextCluster.load_file_data_chunks(file_path, sep=sep, use_col=use_col):
+            contents.extend(chunk)
         logger.info('load file done. path: {}, size: {}'.format(file_path, len(contents)))
         return contents
 
+    @staticmethod
+    def load_file_data_chunks(file_path, sep='\t', use_col=1, chunksize=100000):
+        """
+        Load text file chunk by chunk, format(txt): text
+        :param file_path: str, or list of file paths, eg: daily feed files
+        :param sep: \t
+        :param use_col: int or None
+        :param chunksize: lines of a chunk
+        :return: generator of text list
+        """
+        file_paths = [file_path] if isinstance(file_path, str) else list(file_path)
+        for path in file_paths:
+            if not os.path.exists(path):
+                raise ValueError('file not found. path: {}'.format(path))
+        contents = []
+        for path in file_paths:
+            with open(path, "r", encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if use_col:
+                        contents.append(line.split(sep)[use_col])
+                    else:
+                        contents.append(line)
+                    if len(contents) >= chunksize:
+                        yield contents
+                        contents = []
+        if contents:
+            yield contents
+
     @staticmethod
     def load_list(path):
         """
@@ -114,10 +138,16 @@ class TextCluster(object):
         """
         Encoding input text
         :param sentences: list of text, eg: [text1, text2, ...]
-        :return: X_tokens
+        :return: X_tokens, token lists if the feature analyzer takes them, else space joined texts
         """
-        X_tokens = [' '.join([w for w in self.tokenizer.tokenize(line) if w not in self.stopwords]) for line in
-                    sentences]
+        if hasattr(self.tokenizer, 'tokenize_batch'):
+            tokens_list = self.tokenizer.tokenize_batch(sentences, stopwords=self.stopwords)
+        else:
+            # custom tokenizer without batch api
+            tokens_list = [[w for w in self.tokenizer.tokenize(line) if w not in self.stopwords] for line in sentences]
+        if isinstance(getattr(self.feature, 'analyzer', None), NgramAnalyzer):
+            return tokens_list
+        X_tokens = [' '.join(tokens) for tokens in tokens_list]
         return X_tokens
 
     def train(self, sentences):
@@ -134,6 +164,54 @@ class TextCluster(object):
         self.model.fit(feature)
         labels = self.model.labels_
         logger.debug('cluster labels:{}'.format(labels))
+        self.save_model()
+
+        self.is_trained = True
+        return feature, labels
+
+    def train_streaming(self, file_path, sep='\t', use_col=1, chunksize=10000, checkpoint_every=10):
+        """
+        Train model chunk by chunk, the whole feature matrix is never in memory:
+        texts are featurized by a stateless HashingVectorizer of n_features dims, and the model is updated by
+        MiniBatchKMeans.partial_fit on each chunk, centroids are saved every checkpoint_every chunks.
+        Train again after load_model to continue on new data, eg: the next daily feed.
+        :param file_path: str, or list of file paths
+        :param sep: \t
+        :param use_col: int or None
+        :param chunksize: lines of a chunk, not less than n_clusters
+        :param checkpoint_every: 每隔多少个chunk保存一次模型
+        :return: model
+        """
+        if not hasattr(self.model, 'partial_fit'):
+            raise ValueError('model {} not support partial_fit.'.format(self.model.__class__.__name__))
+        if not isinstance(self.feature, HashingVectorizer):
+            # tfidf vocab and idf need the whole corpus, hashing is stateless
+            self.feature = HashingVectorizer(analyzer=NgramAnalyzer(ngram_range=self.ngram_range),
+                                             n_features=self.n_features, alternate_sign=False)
+        logger.debug('train model streaming, feature: {}'.format(self.feature))
+        num_samples = 0
+        chunk_idx = 0
+        for chunk_idx, sentences in enumerate(
+                self.load_file_data_chunks(file_path, sep=sep, use_col=use_col, chunksize=chunksize), start=1):
+            X_tokens = self.tokenize_sentences(sentences)
+            feature = self.feature.transform(X_tokens)
+            self.model.partial_fit(feature)
+            self.is_trained = True
+            num_samples += len(sentences)
+            if chunk_idx % checkpoint_every == 0:
+                logger.debug('chunk: {}, samples: {}, checkpoint'.format(chunk_idx, num_samples))
+                self.save_model()
+        if not self.is_trained:
+            raise ValueError('no data in {}.'.format(file_path))
+        logger.debug('chunks: {}, samples: {}'.format(chunk_idx, num_samples))
+        self.save_model()
+        return self.model
+
+    def save_model(self):
+        """
+        Save feature and model to model_dir
+        :return: None
+        """
         model_dir = self.model_dir
         if model_dir:
             os.makedirs(model_dir, exist_ok=True)
@@ -143,9 +221,6 @@ class TextCluster(object):
         self.save_pkl(self.model, model_path)
         logger.info('save done. feature path: {}, model path: {}'.format(feature_path, model_path))
 
-        self.is_trained = True
-        return feature, labels
-
     def predict(self, X):
         """
         Predict label
@@ -13,13 +13,20 @@ import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.nn.utils.rnn import pack_padded_sequence, pad_packed_sequence
 from loguru import logger
 from sklearn import metrics
 from sklearn.model_selection import train_test_split
 
 sys.path.append('..')
-from pytextclassifier.base_classifier import ClassifierABC, load_data
-from pytextclassifier.data_helper import set_seed, build_vocab, load_vocab
+from pytextclassifier.base_classifier import ClassifierABC, load_data, load_data_chunks
+from pytextclassifier.data_helper import set_seed, build_vocab, load_vocab, encode_sequences, char_tokenize
+from pytextclassifier.data_helper import scan_streaming_data, StreamingDatasetIterater, BatchLoader, encode_labels
+from pytextclassifier.memmap_dataset import is_compiled_dataset, load_compiled_dataset, compile_dataset
+from pytextclassifier.memmap_dataset import MemmapDatasetIterater
+from pytextclassifier.export_util import export_bundle
+from pytextclassifier.predict_util import predict_proba_batches, topk, evaluate_batches
+from pytextclassifier.quantize_util import quantize_model, model_size
 from pytextclassifier.time_util import get_time_spend
 
 pwd_path = os.path.abspath(os.path.dirname(__file__))
@@ -44,78 +51,12 @@ def build_dataset(tokenizer, X, y, word_vocab_path, label_vocab_path, max_seq_le
         json.dump(label_id_map, open(label_vocab_path, 'w', encoding='utf-8'), ensure_ascii=False, indent=4)
     logger.debug(f"label vocab size: {len(label_id_map)}, label_vocab_path: {label_vocab_path}")
 
-    def load_dataset(X, y, max_seq_length=128):
-        contents = []
-        for content, label in zip(X, y):
-            words_line = []
-            token = tokenizer(content)
-            seq_len = len(token)
-            if max_seq_length:
-                if len(token) < max_seq_length:
-                    token.extend([pad_token] * (max_seq_length - len(token)))
-                else:
-                    token = token[:max_seq_length]
-                    seq_len = max_seq_length
-            # word to id
-            for word in token:
-                words_line.append(word_id_map.get(word, word_id_map.get(unk_token)))
-            label_id = label_id_map.get(label)
-            contents.append((words_line, label_id, seq_len))
-        return contents
-
-    dataset = load_dataset(X, y, max_seq_length)
+    word_ids, seq_lens = encode_sequences(X, tokenizer, word_id_map, max_seq_length=max_seq_length,
+                                          unk_token=unk_token, pad_token=pad_token)
+    dataset = (word_ids, seq_lens, encode_labels(y, label_id_map))
     return dataset, word_id_map, label_id_map
 
 
-class DatasetIterater:
-    def __init__(self, dataset, device, batch_size=32):
-        self.batch_size = batch_size
-        self.dataset = dataset
-        self.n_batches = len(dataset) // batch_size if len(dataset) > batch_size else 1
-        self.residue = False  # 记录batch数量是否为整数
-        if len(dataset) % self.n_batches != 0:
-            self.residue = True
-        self.index = 0
-        self.device = device
-
-    def _to_tensor(self, datas):
-        x = torch.LongTensor([_[0] for _ in datas]).to(self.device)
-        y = torch.LongTensor([_[1] for _ in datas]).to(self.device)
-
-        # pad前的长度(超过max_seq_length的设为max_seq_length)
-        seq_len = torch.LongTensor([_[2] for _ in datas]).to(self.device)
-        return (x, seq_len), y
-
-    def __next__(self):
-        if self.residue and self.index == self.n_batches:
-            batches = self.dataset[self.index * self.batch_size: len(self.dataset)]
-            self.index += 1
-            batches = self._to_tensor(batches)
-            return batches
-
-        elif self.index >= self.n_batches:
-            self.index = 0
-            raise StopIteration
-        else:
-            batches = self.dataset[self.index * self.batch_size: (self.index + 1) * self.batch_size]
-            self.index += 1
-            batches = self._to_tensor(batches)
-            return batches
-
-    def __iter__(self):
-        return self
-
-    def __len__(self):
-        if self.residue:
-            return self.n_batches + 1
-        else:
-            return self.n_batches
-
-
-def build_iterator(dataset, device, batch_size=32):
-    return DatasetIterater(dataset, device, batch_size)
-
-
 class TextRNNAttModel(nn.Module):
     """Attention-Based Bidirectional Long Short-Term Memory Networks for Relation Classification"""
 
@@ -149,12 +90,25 @@ class TextRNNAttModel(nn.Module):
         self.fc2 = nn.Linear(int(hidden_size / 2), num_classes)
 
     def forward(self, x):
-        emb = self.embedding(x[0])  # [batch_size, seq_len, embeding]=[128, 32, 300]
-        H, _ = self.lstm(emb)  # [batch_size, seq_len, hidden_size * num_direction]=[128, 32, 256]
+        word_ids, seq_lens = x[0], x[1]
+        # empty text has no token, pack at least 1 step
+        lengths = seq_lens.clamp(min=1, max=word_ids.size(1))
+        # cut the padding of the batch, no lstm steps on it, outputs are independent of max_seq_length
+        # keep the full width when traced for export, a python int would be a constant of the graph
+        max_len = word_ids.size(1) if torch.jit.is_tracing() else int(lengths.max())
+        emb = self.embedding(word_ids[:, :max_len])  # [batch_size, seq_len, embeding]=[128, 32, 300]
+        # pack sorts by length and pad_packed restores the order
+        packed = pack_padded_sequence(emb, lengths.cpu(), batch_first=True, enforce_sorted=False)
+        H, _ = self.lstm(packed)
+        H, _ = pad_packed_sequence(H, batch_first=True, total_length=max_len)  # [128, 32, 256]
 
         M = self.tanh1(H)  # [128, 32, 256]
         # M = torch.tanh(torch.matmul(H, self.u))
-        alpha = F.softmax(torch.matmul(M, self.w), dim=1).unsqueeze(-1)  # [128, 32, 1]
+        scores = torch.matmul(M, self.w)  # [128, 32]
+        # no attention weight on pad positions
+        mask = torch.arange(max_len, device=scores.device).unsqueeze(0) < lengths.unsqueeze(1)
+        scores = scores.masked_fill(~mask, float('-inf'))
+        alpha = F.softmax(scores, dim=1).unsqueeze(-1)  # [128, 32, 1]
         out = H * alpha  # [128, 32, 256]
         out = torch.sum(out, 1)  # [128, 256]
         out = F.relu(out)
@@ -164,6 +118,8 @@ class TextRNNAttModel(nn.Module):
 
 
 class TextRNNClassifier(ClassifierABC):
+    feature_names = ('word_ids', 'seq_lens')
+
     def __init__(
             self,
             model_dir,
@@ -190,7 +146,9 @@ class TextRNNClassifier(ClassifierABC):
         self.model_dir = model_dir
         self.is_trained = False
         self.model = None
-        logger.debug(f'device: {device}')
+        self.device = device
+        self.quantized = False
+        logger.debug(f'device: {self.device}')
         self.hidden_size = hidden_size
         self.num_layers = num_layers
         self.dropout_rate = dropout_rate
@@ -200,11 +158,20 @@ class TextRNNClassifier(ClassifierABC):
         self.max_vocab_size = max_vocab_size
         self.unk_token = unk_token
         self.pad_token = pad_token
-        self.tokenizer = tokenizer if tokenizer else lambda x: [y for y in x]  # char-level
+        self.tokenizer = tokenizer if tokenizer else char_tokenize  # char-level
 
     def __str__(self):
         return f'TextRNNClassifier instance ({self.model})'
 
+    def _featurize(self, X):
+        """Texts to model input arrays, in the order of feature_names"""
+        return encode_sequences(X, self.tokenizer, self.word_id_map, max_seq_length=self.max_seq_length,
+                                unk_token=self.unk_token, pad_token=self.pad_token)
+
+    def _dataset_meta(self):
+        """Featurize params, a compiled dataset is only valid for the same ones"""
+        return {'max_seq_length': self.max_seq_length}
+
     def train(
             self,
             data_list_or_path,
@@ -214,7 +181,7 @@ class TextRNNClassifier(ClassifierABC):
     ):
         """
         Train model with data_list_or_path and save model to model_dir
-        @param data_list_or_path:
+        @param data_list_or_path: data list, file path, or compiled dataset dir (see compile_dataset)
         @param header:
         @param names:
         @param delimiter:
@@ -228,8 +195,94 @@ class TextRNNClassifier(ClassifierABC):
         logger.debug('train model...')
         SEED = 1
         set_seed(SEED)
-        # load data
-        X, y, data_df = load_data(data_list_or_path, header=header, names=names, delimiter=delimiter)
+        self.device, self.quantized = device, False
+        model_dir = self.model_dir
+        if model_dir:
+            os.makedirs(model_dir, exist_ok=True)
+        word_vocab_path = os.path.join(model_dir, 'word_vocab.json')
+        label_vocab_path = os.path.join(model_dir, 'label_vocab.json')
+        save_model_path = os.path.join(model_dir, 'model.pth')
+
+        if is_compiled_dataset(data_list_or_path):
+            # pre-tokenized dataset, see compile_dataset, the dev split is taken at compile time
+            manifest, self.word_id_map, self.label_id_map = load_compiled_dataset(data_list_or_path,
+                                                                                  self._dataset_meta())
+            json.dump(self.word_id_map, open(word_vocab_path, 'w', encoding='utf-8'), ensure_ascii=False, indent=4)
+            json.dump(self.label_id_map, open(label_vocab_path, 'w', encoding='utf-8'), ensure_ascii=False, indent=4)
+            logger.debug(f"compiled dataset: {data_list_or_path}, samples: {manifest['num_samples']}")
+            train_iter = MemmapDatasetIterater(data_list_or_path, self.device, self.batch_size, split='train',
+                                               shuffle=True, seed=SEED)
+            dev_iter = None
+            if manifest['num_samples']['dev']:
+                dev_iter = MemmapDatasetIterater(data_list_or_path, self.device, self.batch_size, split='dev')
+        else:
+            # load data
+            X, y, data_df = load_data(data_list_or_path, header=header, names=names, delimiter=delimiter)
+            dataset, self.word_id_map, self.label_id_map = build_dataset(
+                self.tokenizer, X, y,
+                word_vocab_path,
+                label_vocab_path,
+                max_vocab_size=self.max_vocab_size,
+                max_seq_length=self.max_seq_length,
+                unk_token=self.unk_token, pad_token=self.pad_token
+            )
+            splits = train_test_split(*dataset, test_size=test_size, random_state=SEED)
+            train_data, dev_data = tuple(splits[0::2]), tuple(splits[1::2])
+            logger.debug(f"train_data size: {len(train_data[-1])}, dev_data size: {len(dev_data[-1])}")
+            logger.debug(f'train_data sample:\n{[a[:3] for a in train_data]}\n'
+                         f'dev_data sample:\n{[a[:3] for a in dev_data]}')
+            train_iter = BatchLoader(train_data, self.device, self.batch_size, shuffle=True, seed=SEED)
+            dev_iter = BatchLoader(dev_data, self.device, self.batch_size)
+        # create model
+        vocab_size = len(self.word_id_map)
+        num_classes = len(self.label_id_map)
+        logger.debug(f'vocab_size:{vocab_size}', 'num_classes:', num_classes)
+        self.model = TextRNNAttModel(
+            vocab_size, num_classes,
+            embed_size=self.embed_size,
+            hidden_size=self.hidden_size,
+            num_layers=self.num_layers,
+            dropout_rate=self.dropout_rate
+        )
+        self.model.to(self.device)
+        # init_network(self.model)
+        logger.info(self.model.parameters)
+        # train model
+        history = self.train_model_from_data_iterator(save_model_path, train_iter, dev_iter, num_epochs, learning_rate,
+                                                      require_improvement, evaluate_during_training_steps)
+        self.is_trained = True
+        logger.debug('train model done')
+        return history
+
+    def train_streaming(
+            self,
+            data_path,
+            header=None, names=('labels', 'text'), delimiter='\t', test_size=0.1,
+            chunksize=100000, shuffle_buffer_size=100000, max_dev_size=10000,
+            num_epochs=20, learning_rate=1e-3,
+            require_improvement=1000, evaluate_during_training_steps=100
+    ):
+        """
+        Train model with a large data file in streaming mode and save model to model_dir,
+        the file is read in chunks, memory is bounded by chunksize, shuffle_buffer_size and max_dev_size
+        @param data_path: data file path
+        @param header:
+        @param names:
+        @param delimiter:
+        @param test_size: dev ratio, dev samples are split by hashing the text
+        @param chunksize: 每次读取的行数
+        @param shuffle_buffer_size: shuffle缓冲区大小
+        @param max_dev_size: 验证集最大样本数
+        @param num_epochs: epoch数
+        @param learning_rate: 学习率
+        @param require_improvement: 若超过1000batch效果还没提升，则提前结束训练
+        @param evaluate_during_training_steps: 每隔多少step评估一次模型
+        @return:
+        """
+        logger.debug('train model in streaming mode...')
+        SEED = 1
+        set_seed(SEED)
+        self.device, self.quantized = device, False
         model_dir = self.model_dir
         if model_dir:
             os.makedirs(model_dir, exist_ok=True)
@@ -237,19 +290,29 @@ class TextRNNClassifier(ClassifierABC):
         label_vocab_path = os.path.join(model_dir, 'label_vocab.json')
         save_model_path = os.path.join(model_dir, 'model.pth')
 
-        dataset, self.word_id_map, self.label_id_map = build_dataset(
-            self.tokenizer, X, y,
+        def data_chunks():
+            return load_data_chunks(data_path, chunksize=chunksize, test_size=test_size, header=header,
+                                    names=names, delimiter=delimiter)
+
+        def train_chunks():
+            for X, y, is_dev in data_chunks():
+                yield X[~is_dev], y[~is_dev]
+
+        # first pass: vocab and dev data
+        self.word_id_map, self.label_id_map, dev_X, dev_y = scan_streaming_data(
+            data_chunks(), self.tokenizer,
             word_vocab_path,
             label_vocab_path,
             max_vocab_size=self.max_vocab_size,
-            max_seq_length=self.max_seq_length,
-            unk_token=self.unk_token, pad_token=self.pad_token
+            unk_token=self.unk_token, pad_token=self.pad_token,
+            max_dev_size=max_dev_size
         )
-        train_data, dev_data = train_test_split(dataset, test_size=test_size, random_state=SEED)
-        logger.debug(f"train_data size: {len(train_data)}, dev_data size: {len(dev_data)}")
-        logger.debug(f'train_data sample:\n{train_data[:3]}\ndev_data sample:\n{dev_data[:3]}')
-        train_iter = build_iterator(train_data, device, self.batch_size)
-        dev_iter = build_iterator(dev_data, device, self.batch_size)
+        train_iter = StreamingDatasetIterater(train_chunks, self._featurize, self.label_id_map, self.device,
+                                              self.batch_size, shuffle_buffer_size=shuffle_buffer_size, seed=SEED)
+        dev_iter = None
+        if dev_X:
+            dev_iter = StreamingDatasetIterater(lambda: [(dev_X, dev_y)], self._featurize, self.label_id_map,
+                                                self.device, self.batch_size, shuffle=False)
         # create model
         vocab_size = len(self.word_id_map)
         num_classes = len(self.label_id_map)
@@ -261,8 +324,7 @@ class TextRNNClassifier(ClassifierABC):
             num_layers=self.num_layers,
             dropout_rate=self.dropout_rate
         )
-        self.model.to(device)
-        # init_network(self.model)
+        self.model.to(self.device)
         logger.info(self.model.parameters)
         # train model
         history = self.train_model_from_data_iterator(save_model_path, train_iter, dev_iter, num_epochs, learning_rate,
@@ -271,6 +333,49 @@ class TextRNNClassifier(ClassifierABC):
         logger.debug('train model done')
         return history
 
+    def compile_dataset(
+            self,
+            data_list_or_path,
+            output_dir,
+            header=None, names=('labels', 'text'), delimiter='\t', test_size=0.1,
+            chunksize=100000, shard_size=1000000
+    ):
+        """
+        Tokenize data once and save the model inputs to a compiled dataset dir of .npy shards,
+        train and evaluate_model read it by memmap instead of tokenizing again.
+        The vocab in model_dir is used if exists, else it is built from the data and saved to model_dir.
+        @param data_list_or_path: file path, or data list of (label, text) / DataFrame loaded in memory
+        @param output_dir: compiled dataset dir
+        @param header:
+        @param names:
+        @param delimiter:
+        @param test_size: dev ratio, dev samples are split by hashing the text
+        @param chunksize: 每次读取的行数
+        @param shard_size: 每个shard的样本数
+        @return: output_dir
+        """
+        model_dir = self.model_dir
+        if model_dir:
+            os.makedirs(model_dir, exist_ok=True)
+        word_vocab_path = os.path.join(model_dir, 'word_vocab.json')
+        label_vocab_path = os.path.join(model_dir, 'label_vocab.json')
+
+        def data_chunks():
+            return load_data_chunks(data_list_or_path, chunksize=chunksize, test_size=test_size, header=header,
+                                    names=names, delimiter=delimiter)
+
+        self.word_id_map, self.label_id_map, _, _ = scan_streaming_data(
+            data_chunks(), self.tokenizer,
+            word_vocab_path,
+            label_vocab_path,
+            max_vocab_size=self.max_vocab_size,
+            unk_token=self.unk_token, pad_token=self.pad_token,
+            max_dev_size=0
+        )
+        compile_dataset(data_chunks(), output_dir, self._featurize, self.feature_names,
+                        self.word_id_map, self.label_id_map, meta=self._dataset_meta(), shard_size=shard_size)
+        return output_dir
+
     def train_model_from_data_iterator(self, save_model_path, train_iter, dev_iter,
                                        num_epochs=10, learning_rate=1e-3,
                                        require_improvement=1000, evaluate_during_training_steps=100):
@@ -319,66 +424,59 @@ class TextRNNClassifier(ClassifierABC):
                     history.append(msg)
                     self.model.train()
                 total_batch += 1
-                if total_batch - last_improve > require_improvement:
+                # without a dev set there is no loss to improve, train all epochs
+                if dev_iter is not None and total_batch - last_improve > require_improvement:
                     # 验证集loss超过1000batch没下降，结束训练
                     logger.debug("No optimization for a long time, auto-stopping...")
                     flag = True
                     break
+            if isinstance(train_iter, BatchLoader):
+                logger.debug(f'loader stats: {train_iter.stats()}')
             if flag:
                 break
+        if dev_iter is None:
+            # no dev set to select the best model, save the last one
+            torch.save(self.model.state_dict(), save_model_path)
+            logger.debug(f'Saved model: {save_model_path}')
         return history
 
+    def predict_proba(self, sentences: list):
+        """
+        Predict the probability of all labels for sentences.
+        @param sentences: list, input text list, eg: [text1, text2, ...]
+        @return: probs, np.float32 array (n_samples, n_labels), columns in the order of self.labels
+        """
+        if not self.is_trained:
+            raise ValueError('model not trained.')
+        return predict_proba_batches(self.model, self._featurize, sentences, len(self.label_id_map), self.device,
+                                     batch_size=self.batch_size)
+
     def predict(self, sentences: list):
         """
         Predict labels and label probability for sentences.
         @param sentences: list, input text list, eg: [text1, text2, ...]
         @return: predict_label, predict_prob
         """
-        if not self.is_trained:
-            raise ValueError('model not trained.')
-        self.model.eval()
-
-        def load_dataset(X, max_seq_length=128):
-            contents = []
-            for content in X:
-                words_line = []
-                token = self.tokenizer(content)
-                seq_len = len(token)
-                if max_seq_length:
-                    if len(token) < max_seq_length:
-                        token.extend([self.pad_token] * (max_seq_length - len(token)))
-                    else:
-                        token = token[:max_seq_length]
-                        seq_len = max_seq_length
-                # word to id
-                for word in token:
-                    words_line.append(self.word_id_map.get(word, self.word_id_map.get(self.unk_token)))
-                contents.append((words_line, 0, seq_len))
-            return contents
-
-        data = load_dataset(sentences, self.max_seq_length)
-        data_iter = build_iterator(data, device, self.batch_size)
-        # predict prob
-        predict_all = np.array([], dtype=int)
-        proba_all = np.array([], dtype=float)
-        with torch.no_grad():
-            for texts, _ in data_iter:
-                outputs = self.model(texts)
-                logit = F.softmax(outputs, dim=1).detach().cpu().numpy()
-                pred = np.argmax(logit, axis=1)
-                proba = np.max(logit, axis=1)
-
-                predict_all = np.append(predict_all, pred)
-                proba_all = np.append(proba_all, proba)
-        id_label_map = {v: k for k, v in self.label_id_map.items()}
-        predict_labels = [id_label_map.get(i) for i in predict_all]
-        predict_probs = proba_all.tolist()
+        label_ids, top_probs = topk(self.predict_proba(sentences), k=1)
+        predict_labels = self.id_label[label_ids[:, 0]].tolist()
+        predict_probs = top_probs[:, 0].astype(np.float64).tolist()
         return predict_labels, predict_probs
 
     def evaluate_model(self, data_list_or_path, header=None,
                        names=('labels', 'text'), delimiter='\t'):
+        """
+        Evaluate model with data_list_or_path
+        @param data_list_or_path: data list, file path, or compiled dataset dir (see compile_dataset)
+        @return: accuracy score
+        """
+        self.load_model(quantized=self.quantized)
+        if is_compiled_dataset(data_list_or_path):
+            manifest, word_id_map, label_id_map = load_compiled_dataset(data_list_or_path, self._dataset_meta())
+            if word_id_map != self.word_id_map or label_id_map != self.label_id_map:
+                raise ValueError(f'vocab of {data_list_or_path} does not match the model, compile the dataset again.')
+            data_iter = MemmapDatasetIterater(data_list_or_path, self.device, self.batch_size)
+            return self.evaluate(data_iter)[0]
         X_test, y_test, df = load_data(data_list_or_path, header=header, names=names, delimiter=delimiter)
-        self.load_model()
         data, word_id_map, label_id_map = build_dataset(
             self.tokenizer, X_test, y_test,
             self.word_vocab_path,
@@ -388,7 +486,7 @@ class TextRNNClassifier(ClassifierABC):
             unk_token=self.unk_token,
             pad_token=self.pad_token,
         )
-        data_iter = build_iterator(data, device, self.batch_size)
+        data_iter = BatchLoader(data, self.device, self.batch_size)
         return self.evaluate(data_iter)[0]
 
     def evaluate(self, data_iter):
@@ -399,29 +497,31 @@ class TextRNNClassifier(ClassifierABC):
         """
         if not self.model:
             raise ValueError('model not trained.')
-        self.model.eval()
-        loss_total = 0.0
-        predict_all = np.array([], dtype=int)
-        labels_all = np.array([], dtype=int)
-        with torch.no_grad():
-            for texts, labels in data_iter:
-                outputs = self.model(texts)
-                loss = F.cross_entropy(outputs, labels)
-                loss_total += loss
-                labels = labels.cpu().numpy()
-                predic = torch.max(outputs, 1)[1].cpu().numpy()
-                labels_all = np.append(labels_all, labels)
-                predict_all = np.append(predict_all, predic)
-            logger.debug(f"evaluate, last batch, y_true: {labels}, y_pred: {predic}")
-        acc = metrics.accuracy_score(labels_all, predict_all)
-        return acc, loss_total / len(data_iter)
-
-    def load_model(self):
+        result = evaluate_batches(self.model, data_iter, len(self.label_id_map))
+        logger.debug(f"evaluate, samples: {result['num_samples']}, acc: {result['accuracy']:.4f}, "
+                     f"loss: {result['loss']:.4f}")
+        return result['accuracy'], result['loss']
+
+    def export(self, output_dir=None, format='onnx'):
+        """
+        Export the trained model with vocab to a bundle dir, served by ExportedPredictor without the classifier
+        @param output_dir: bundle dir, default model_dir/export
+        @param format: onnx or torchscript
+        @return: output_dir
+        """
+        if not self.is_trained or self.quantized:
+            # export the fp32 model
+            self.load_model()
+        return export_bundle(self, output_dir or os.path.join(self.model_dir, 'export'), format=format,
+                             input_names=('word_ids', 'seq_lens'))
+
+    def load_model(self, quantized=False):
         """
         Load model from model_dir
+        @param quantized: load the quantized model saved by quantize(), runs on cpu
         @return:
         """
-        model_path = os.path.join(self.model_dir, 'model.pth')
+        model_path = os.path.join(self.model_dir, 'model_quantized.pth' if quantized else 'model.pth')
         if os.path.exists(model_path):
             self.word_vocab_path = os.path.join(self.model_dir, 'word_vocab.json')
             self.label_vocab_path = os.path.join(self.model_dir, 'label_vocab.json')
@@ -436,14 +536,56 @@ class TextRNNClassifier(ClassifierABC):
                 num_layers=self.num_layers,
                 dropout_rate=self.dropout_rate
             )
-            self.model.load_state_dict(torch.load(model_path, map_location=device))
-            self.model.to(device)
+            if quantized:
+                # quantized modules are pickled, the file is written by quantize()
+                checkpoint = torch.load(model_path, map_location='cpu', weights_only=False)
+                self.model = quantize_model(self.model, embedding_dtype=checkpoint['embedding_dtype'])
+                self.model.load_state_dict(checkpoint['state_dict'])
+                self.device = torch.device('cpu')
+            else:
+                self.model.load_state_dict(torch.load(model_path, map_location=device))
+                self.device = device
+            self.model.to(self.device)
+            self.quantized = quantized
             self.is_trained = True
         else:
             logger.error(f'{model_path} not exists.')
             self.is_trained = False
         return self.is_trained
 
+    def quantize(self, data_list_or_path=None, embedding_dtype='int8', header=None, names=('labels', 'text'),
+                 delimiter='\t'):
+        """
+        Quantize the trained model for cpu inference and save it to model_dir/model_quantized.pth,
+        Linear and LSTM layers are int8 dynamic quantized, embeddings are stored as embedding_dtype,
+        load it by load_model(quantized=True)
+        @param data_list_or_path: dev data, the accuracy of the fp32 and the quantized model is evaluated on it
+        @param embedding_dtype: fp16, int8 (per-row scale) or fp32
+        @param header:
+        @param names:
+        @param delimiter:
+        @return: dict, model file size (MB) and dev accuracy of the fp32 and the quantized model
+        """
+        if not self.load_model():
+            raise ValueError('model not trained.')
+        result = {'fp32_size': model_size(os.path.join(self.model_dir, 'model.pth'))}
+        if data_list_or_path is not None:
+            result['fp32_acc'] = self.evaluate_model(data_list_or_path, header=header, names=names,
+                                                     delimiter=delimiter)
+        quantized_path = os.path.join(self.model_dir, 'model_quantized.pth')
+        self.model = quantize_model(self.model, embedding_dtype=embedding_dtype)
+        self.device = torch.device('cpu')
+        self.quantized = True
+        torch.save({'embedding_dtype': embedding_dtype, 'state_dict': self.model.state_dict()}, quantized_path)
+        result['quantized_size'] = model_size(quantized_path)
+        if data_list_or_path is not None:
+            # evaluate_model loads the saved quantized model again
+            result['quantized_acc'] = self.evaluate_model(data_list_or_path, header=header, names=names,
+                                                          delimiter=delimiter)
+            result['acc_delta'] = result['quantized_acc'] - result['fp32_acc']
+        logger.info(f'quantized model: {quantized_path}, ' + ', '.join(f'{k}: {v:.4f}' for k, v in result.items()))
+        return result
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Text Classification')
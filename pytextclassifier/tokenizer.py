@@ -3,7 +3,15 @@
 @author:XuMing(xuming624@qq.com)
 @description: Tokenization
 """
+import os
 import re
+from multiprocessing import Pool
+
+import jieba
+from loguru import logger
+
+re_han = re.compile("([\u4E00-\u9Fa5a-zA-Z0-9+#&]+)", re.U)
+re_chinese = re.compile("[\u4E00-\u9Fa5]", re.U)
 
 
 def tokenize_words(text):
@@ -12,18 +20,68 @@ def tokenize_words(text):
     sentences = split_2_short_text(text, include_symbol=True)
     for sentence, idx in sentences:
         if is_any_chinese_string(sentence):
-            import jieba
             output.extend(jieba.lcut(sentence))
         else:
             output.extend(whitespace_tokenize(sentence))
     return output
 
 
+def tokenize_words_jieba_parallel(texts, n_jobs):
+    """
+    Word segmentation of texts with jieba parallel mode, the chinese blocks of all texts are joined by
+    newline and cut by one jieba call, jieba splits the lines to its process pool
+    :param texts: list of text
+    :param n_jobs: number of jieba processes
+    :return: list of token list
+    """
+    layouts = []
+    chinese_blocks = []
+    for text in texts:
+        layout = []
+        for sentence, idx in split_2_short_text(text, include_symbol=True):
+            if is_any_chinese_string(sentence):
+                layout.append(len(chinese_blocks))
+                chinese_blocks.append(sentence)
+            else:
+                layout.append(whitespace_tokenize(sentence))
+        layouts.append(layout)
+    try:
+        jieba.enable_parallel(n_jobs)
+    except NotImplementedError:
+        logger.warning('jieba parallel mode is not supported on this platform, cut in the main process.')
+    try:
+        words = jieba.lcut('\n'.join(chinese_blocks)) if chinese_blocks else []
+    finally:
+        jieba.disable_parallel()
+    cut_blocks = [[]]
+    for word in words:
+        if word == '\n':
+            cut_blocks.append([])
+        else:
+            cut_blocks[-1].append(word)
+    output = []
+    for layout in layouts:
+        tokens = []
+        for item in layout:
+            tokens.extend(cut_blocks[item] if isinstance(item, int) else item)
+        output.append(tokens)
+    return output
+
+
 class Tokenizer(object):
     """Given Full tokenization."""
 
-    def __init__(self, lower=True):
+    def __init__(self, lower=True, n_jobs=1, parallel_threshold=10000, use_jieba_parallel=False):
+        """
+        :param lower: lowercase text
+        :param n_jobs: number of processes for tokenize_batch, -1 for all cpus
+        :param parallel_threshold: tokenize_batch uses processes only for batches at least this large
+        :param use_jieba_parallel: use jieba parallel mode instead of the process pool
+        """
         self.lower = lower
+        self.n_jobs = n_jobs
+        self.parallel_threshold = parallel_threshold
+        self.use_jieba_parallel = use_jieba_parallel
 
     def tokenize(self, text):
         """Tokenizes a piece of text."""
@@ -37,6 +95,73 @@ class Tokenizer(object):
         res = tokenize_words(text)
         return res
 
+    def tokenize_batch(self, texts, stopwords=None):
+        """
+        Tokenizes a batch of texts.
+        :param texts: list of text
+        :param stopwords: set, removed from the tokens if given
+        :return: list of token list
+        """
+        if self.lower:
+            texts = [text.lower() for text in texts]
+        else:
+            texts = list(texts)
+        n_jobs = os.cpu_count() if self.n_jobs == -1 else self.n_jobs
+        if n_jobs > 1 and len(texts) >= self.parallel_threshold:
+            if self.use_jieba_parallel:
+                tokens_list = tokenize_words_jieba_parallel(texts, n_jobs)
+            else:
+                with Pool(n_jobs) as pool:
+                    tokens_list = pool.map(tokenize_words, texts, chunksize=max(1, len(texts) // (n_jobs * 4)))
+        else:
+            tokens_list = [tokenize_words(text) for text in texts]
+        if stopwords:
+            tokens_list = [[w for w in tokens if w not in stopwords] for tokens in tokens_list]
+        return tokens_list
+
+
+class NgramAnalyzer(object):
+    """
+    Callable analyzer for sklearn vectorizers, token list -> word n-grams.
+    Pre-tokenized lists go to the vectorizer without the join and re-split of strings, tokens are filtered by
+    the sklearn default token_pattern and lowercased, so the n-grams are the same as the string analyzer ones.
+    """
+
+    def __init__(self, ngram_range=(1, 2), token_pattern=r"(?u)\b\w\w+\b", lowercase=True):
+        self.ngram_range = ngram_range
+        self.token_pattern = token_pattern
+        self.lowercase = lowercase
+        self._re_token = re.compile(token_pattern)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_re_token']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._re_token = re.compile(self.token_pattern)
+
+    def __call__(self, tokens):
+        if isinstance(tokens, str):
+            # space joined text, eg: feature explain tools
+            tokens = tokens.split()
+        words = []
+        for token in tokens:
+            if self.lowercase:
+                token = token.lower()
+            if self._re_token.fullmatch(token):
+                words.append(token)
+            else:
+                words.extend(self._re_token.findall(token))
+        min_n, max_n = self.ngram_range
+        if max_n == 1:
+            return words
+        ngrams = words[:] if min_n == 1 else []
+        for n in range(max(min_n, 2), min(max_n, len(words)) + 1):
+            ngrams.extend(' '.join(words[i: i + n]) for i in range(len(words) - n + 1))
+        return ngrams
+
 
 def split_2_short_text(text, include_symbol=True):
     """
@@ -45,7 +170,6 @@ def split_2_short_text(text, include_symbol=True):
     :param include_symbol: bool
     :return: (sentence, idx)
     """
-    re_han = re.compile("([\u4E00-\u9Fa5a-zA-Z0-9+#&]+)", re.U)
     result = []
     blocks = re_han.split(text)
     start_idx = 0
@@ -73,7 +197,7 @@ def is_all_chinese_string(string):
 
 def is_any_chinese_string(string):
     """判断是否有中文汉字"""
-    return any(is_chinese(c) for c in string)
+    return re_chinese.search(string) is not None
 
 
 def whitespace_tokenize(text):
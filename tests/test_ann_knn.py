@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+@author:XuMing(xuming624@qq.com)
+@description:
+"""
+import shutil
+import unittest
+
+import numpy as np
+import sys
+
+sys.path.append('..')
+from pytextclassifier import ClassicClassifier
+from pytextclassifier.ann_knn import IVFIndex, l2_normalize
+
+data = [
+    ('education', 'Student debt to cost Britain billions within decades'),
+    ('education', 'Chinese education for TV experiment'),
+    ('sports', 'Middle East and Asia boost investment in top level sports'),
+    ('sports', 'Summit Series look launches HBO Canada sports doc series: Mudhar'),
+    ('finance', 'Stocks rally as central bank holds interest rates'),
+    ('finance', 'Bank shares fall after quarterly earnings miss'),
+]
+
+
+class AnnKNNTestCase(unittest.TestCase):
+    def test_ivf_full_probe_is_exact(self):
+        rng = np.random.RandomState(1)
+        vectors = l2_normalize(rng.randn(500, 16)).astype(np.float32)
+        queries = l2_normalize(rng.randn(20, 16)).astype(np.float32)
+        index = IVFIndex(n_lists=10, n_probe=10).build(vectors)
+        ids, sims = index.search(queries, k=5)
+        exact = np.argsort(-(queries @ vectors.T), axis=1)[:, :5]
+        self.assertEqual(ids.tolist(), exact.tolist())
+        # small n_probe still returns k neighbours
+        ids, _ = IVFIndex(n_lists=100, n_probe=1).build(vectors).search(queries, k=20)
+        self.assertTrue((ids >= 0).all())
+
+    def test_knn_model(self):
+        m = ClassicClassifier('models/knn', model_name_or_model='knn')
+        m.train(data * 3)
+        self.assertIsNone(m.scorer)
+        r, p = m.predict([d[1] for d in data])
+        self.assertEqual(list(r), [d[0] for d in data])
+        new_m = ClassicClassifier('models/knn', model_name_or_model='knn')
+        new_m.load_model()
+        r1, p1 = new_m.predict([d[1] for d in data])
+        self.assertEqual(list(r), list(r1))
+        np.testing.assert_allclose(p, p1)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree('models')
+
+
+if __name__ == '__main__':
+    unittest.main()
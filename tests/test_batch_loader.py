@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+@author:XuMing(xuming624@qq.com)
+@description:
+"""
+import unittest
+
+import numpy as np
+import sys
+import torch
+
+sys.path.append('..')
+from pytextclassifier.data_helper import BatchLoader
+
+
+class BatchLoaderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.word_ids = np.arange(103 * 4, dtype=np.int64).reshape(103, 4)
+        self.labels = np.arange(103, dtype=np.int64)
+
+    def test_order(self):
+        loader = BatchLoader((self.word_ids, self.labels), 'cpu', batch_size=10, prefetch=2)
+        self.assertEqual(len(loader), 11)
+        labels = []
+        for (word_ids,), y in loader:
+            self.assertTrue(torch.equal(word_ids, torch.from_numpy(self.word_ids[y.numpy()])))
+            labels.extend(y.tolist())
+        self.assertEqual(labels, self.labels.tolist())
+        self.assertEqual(loader.stats()['batches'], 11)
+
+    def test_shuffle(self):
+        loader = BatchLoader((self.word_ids, self.labels), 'cpu', batch_size=10, shuffle=True)
+        epochs = []
+        for _ in range(2):
+            labels = []
+            for (word_ids,), y in loader:
+                self.assertTrue(torch.equal(word_ids, torch.from_numpy(self.word_ids[y.numpy()])))
+                labels.extend(y.tolist())
+            self.assertEqual(sorted(labels), self.labels.tolist())
+            epochs.append(labels)
+        self.assertNotEqual(epochs[0], epochs[1])
+
+    def test_break(self):
+        loader = BatchLoader((self.word_ids, self.labels), 'cpu', batch_size=1, prefetch=1)
+        for i, _ in enumerate(loader):
+            if i == 3:
+                break
+        # the producer thread is stopped, the loader can be iterated again
+        self.assertEqual(sum(1 for _ in loader), 103)
+
+    def test_length_mismatch(self):
+        with self.assertRaises(ValueError):
+            BatchLoader((self.word_ids, self.labels[:10]), 'cpu')
+
+
+if __name__ == '__main__':
+    unittest.main()
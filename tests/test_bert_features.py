@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+@author:XuMing(xuming624@qq.com)
+@description:
+"""
+import os
+import pickle
+import shutil
+import unittest
+
+import numpy as np
+import sys
+from transformers import BertTokenizer, BertTokenizerFast
+
+sys.path.append('..')
+from pytextclassifier.bert_classfication_utils import BertClassificationArgs, ClassificationDataset
+from pytextclassifier.bert_classfication_utils import LazyClassificationDataset, LINE_OFFSETS_SUFFIX
+from pytextclassifier.bert_classfication_utils import get_tokenizer_pool, close_tokenizer_pool
+from pytextclassifier.bert_classfication_utils import InputExample, convert_examples_to_features, load_tokenizer
+from pytextclassifier.bert_classfication_utils import pool_windows, vote_windows
+
+texts = ['北京欢迎你', '上海房价上涨', '教育改革', '体育新闻报道很多']
+vocab = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]'] + sorted(set(''.join(texts)))
+
+
+def get_args(**kwargs):
+    args = BertClassificationArgs()
+    args.update_from_dict({'cache_dir': 'models/cache', 'max_seq_length': 8, 'reprocess_input_data': False,
+                           'silent': True, **kwargs})
+    return args
+
+
+class FeatureCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        os.makedirs('models/cache', exist_ok=True)
+        with open('models/vocab.txt', 'w', encoding='utf-8') as f:
+            f.write('\n'.join(vocab))
+        self.tokenizer = BertTokenizer('models/vocab.txt')
+
+    def tearDown(self):
+        shutil.rmtree('models')
+
+    def test_cache(self):
+        args = get_args()
+        dataset = ClassificationDataset((texts, [0, 1, 0, 1]), self.tokenizer, args, 'train', False,
+                                        'classification', False)
+        expected = self.tokenizer(texts, max_length=8, truncation=True, padding='max_length')
+        self.assertEqual(len(dataset), 4)
+        for i in range(4):
+            features, label = dataset[i]
+            self.assertEqual(features['input_ids'].tolist(), expected['input_ids'][i])
+            self.assertEqual(label.item(), [0, 1, 0, 1][i])
+        self.assertIsInstance(dataset.arrays['input_ids'], np.memmap)
+        self.assertEqual(os.listdir('models/cache'), [os.path.basename(dataset.cache_path)])
+
+        # same content: the cache is reused, pickled without the arrays
+        cached = ClassificationDataset((texts, [0, 1, 0, 1]), self.tokenizer, args, 'dev', False,
+                                       'classification', False)
+        self.assertEqual(cached.cache_path, dataset.cache_path)
+        self.assertLess(len(pickle.dumps(cached)), 1000)
+        self.assertEqual(pickle.loads(pickle.dumps(cached))[2][0]['input_ids'].tolist(), expected['input_ids'][2])
+
+        # a dataset of the same size, and the same texts with another max_seq_length, are new keys
+        other = ClassificationDataset((texts[::-1], [0, 1, 0, 1]), self.tokenizer, args, 'train', False,
+                                      'classification', False)
+        self.assertNotEqual(other.cache_path, dataset.cache_path)
+        longer = ClassificationDataset((texts, [0, 1, 0, 1]), self.tokenizer, get_args(max_seq_length=16), 'train',
+                                       False, 'classification', False)
+        self.assertNotEqual(longer.cache_path, dataset.cache_path)
+        self.assertEqual(len(os.listdir('models/cache')), 3)
+
+    def test_dynamic_padding(self):
+        args = get_args(dynamic_padding=True)
+        dataset = ClassificationDataset((texts, [0, 1, 0, 1]), self.tokenizer, args, 'train', False,
+                                        'classification', False)
+        expected = self.tokenizer(texts, max_length=8, truncation=True)
+        self.assertEqual(dataset.lengths.tolist(), [len(ids) for ids in expected['input_ids']])
+        for i in range(4):
+            self.assertEqual(dataset[i][0]['input_ids'].tolist(), expected['input_ids'][i])
+
+    def test_tokenizer_pool(self):
+        pool = get_tokenizer_pool(self.tokenizer, 2)
+        for dynamic_padding in [False, True]:
+            args = get_args(dynamic_padding=dynamic_padding, use_multiprocessing=True, process_count=2,
+                            multiprocessing_chunksize=3, no_cache=True)
+            dataset = ClassificationDataset((texts * 2, [0, 1] * 4), self.tokenizer, args, 'train', False,
+                                            'classification', True)
+            single = get_args(dynamic_padding=dynamic_padding, use_multiprocessing=False, no_cache=True)
+            expected = ClassificationDataset((texts * 2, [0, 1] * 4), self.tokenizer, single, 'train', False,
+                                             'classification', True)
+            for name, array in expected.arrays.items():
+                np.testing.assert_array_equal(dataset.arrays[name], array)
+        # the workers are reused across calls
+        self.assertIs(get_tokenizer_pool(self.tokenizer, 2), pool)
+        close_tokenizer_pool()
+
+
+class FastTokenizerTestCase(unittest.TestCase):
+    def setUp(self):
+        os.makedirs('models', exist_ok=True)
+        with open('models/vocab.txt', 'w', encoding='utf-8') as f:
+            f.write('\n'.join(vocab))
+
+    def tearDown(self):
+        shutil.rmtree('models')
+
+    def test_load_tokenizer(self):
+        self.assertIsInstance(load_tokenizer(BertTokenizer, 'models'), BertTokenizerFast)
+        self.assertNotIsInstance(load_tokenizer(BertTokenizerFast, 'models', use_fast=False), BertTokenizerFast)
+
+    def test_convert_examples(self):
+        tokenizer = load_tokenizer(BertTokenizer, 'models')
+        examples = [InputExample(i, text, texts[i - 1], i % 2) for i, text in enumerate(texts)]
+        features = convert_examples_to_features(examples, 8, tokenizer, 'classification', use_multiprocessing=False,
+                                                silent=True)
+        expected = tokenizer(texts, texts[-1:] + texts[:-1], max_length=8, truncation=True, padding='max_length')
+        self.assertEqual([f.input_ids for f in features], expected['input_ids'])
+        self.assertEqual([f.segment_ids for f in features], expected['token_type_ids'])
+        self.assertEqual([f.label_id for f in features], [0, 1, 0, 1])
+
+        # windows of 6 tokens and 2 special tokens, 3 tokens apart, until the end of the text
+        examples = [InputExample(i, text, None, i % 2) for i, text in enumerate(texts)]
+        windows = convert_examples_to_features(examples, 8, tokenizer, 'classification', use_multiprocessing=False,
+                                               silent=True, sliding_window=True, stride=3)
+        self.assertEqual([len(w) for w in windows], [1, 1, 1, 2])
+        ids = tokenizer(texts[3], add_special_tokens=False)['input_ids']
+        self.assertEqual([f.input_ids for f in windows[3]], [[2] + ids[0:6] + [3], [2] + ids[3:8] + [3, 0]])
+        self.assertEqual(windows[3][1].input_mask, [1] * 7 + [0])
+
+
+class SlidingWindowTestCase(unittest.TestCase):
+    def setUp(self):
+        os.makedirs('models', exist_ok=True)
+        with open('models/vocab.txt', 'w', encoding='utf-8') as f:
+            f.write('\n'.join(vocab))
+
+    def tearDown(self):
+        shutil.rmtree('models')
+
+    def test_windows(self):
+        docs = [texts[3] * 3, texts[0]]
+        args = get_args(sliding_window=True, stride=0.5, no_cache=True)
+        for tokenizer in [load_tokenizer(BertTokenizer, 'models'), BertTokenizer('models/vocab.txt')]:
+            dataset = ClassificationDataset((docs, [1, 0]), tokenizer, args, 'dev', False, 'classification', True)
+            # 24 tokens, windows of 6 starting 4 apart
+            self.assertEqual(dataset.window_counts.tolist(), [6, 1])
+            self.assertEqual([dataset[i][1].item() for i in range(len(dataset))], [1] * 6 + [0])
+            self.assertEqual(dataset.lengths.tolist(), [8] * 5 + [6, 7])
+            ids = tokenizer(docs[0], add_special_tokens=False)['input_ids']
+            self.assertEqual(dataset[5][0]['input_ids'].tolist(), [2] + ids[20:] + [3])
+
+    def test_pool(self):
+        outputs = np.array([[1., 0.], [0., 3.], [2., 1.], [0., 1.], [5., 0.]])
+        counts = np.array([3, 2])
+        np.testing.assert_allclose(pool_windows(outputs, counts, 'mean'), [[1., 4 / 3], [2.5, 0.5]])
+        np.testing.assert_allclose(pool_windows(outputs, counts, 'max'), [[2., 3.], [5., 1.]])
+        weights = np.exp([1., 3., 2.])
+        np.testing.assert_allclose(pool_windows(outputs, counts, 'attention')[0],
+                                   (outputs[:3] * weights[:, None]).sum(axis=0) / weights.sum())
+        np.testing.assert_allclose(pool_windows(outputs, counts, 'vote'), [[2 / 3, 1 / 3], [0.5, 0.5]])
+        self.assertEqual(vote_windows(outputs, counts, tie_value=1).tolist(), [0, 1])
+        with self.assertRaises(ValueError):
+            pool_windows(outputs, counts, 'sum')
+
+
+class LazyDatasetTestCase(unittest.TestCase):
+    def setUp(self):
+        os.makedirs('models', exist_ok=True)
+        with open('models/vocab.txt', 'w', encoding='utf-8') as f:
+            f.write('\n'.join(vocab))
+        self.tokenizer = BertTokenizer('models/vocab.txt')
+        self.data_file = 'models/train.tsv'
+        with open(self.data_file, 'w', encoding='utf-8') as f:
+            f.write('text\tlabels\n')
+            for i, text in enumerate(texts):
+                f.write(f'{text}\t{i % 2}\n')
+
+    def tearDown(self):
+        shutil.rmtree('models')
+
+    def test_lazy(self):
+        args = get_args(lazy_loading=True)
+        dataset = LazyClassificationDataset(self.data_file, self.tokenizer, args)
+        self.assertTrue(os.path.exists(self.data_file + LINE_OFFSETS_SUFFIX))
+        self.assertEqual(len(dataset), 4)
+        self.assertEqual(dataset[1], ('上海房价上涨', 1))
+        features, labels = dataset.collate([dataset[i] for i in range(4)])
+        expected = self.tokenizer(texts, max_length=8, truncation=True, padding='max_length')
+        self.assertEqual(features['input_ids'].tolist(), expected['input_ids'])
+        self.assertEqual(labels.tolist(), [0, 1, 0, 1])
+        self.assertEqual(pickle.loads(pickle.dumps(dataset))[3], ('体育新闻报道很多', 1))
+
+        # the index is rebuilt when the file changes
+        with open(self.data_file, 'a', encoding='utf-8') as f:
+            f.write('教育新闻\t0')
+        dataset = LazyClassificationDataset(self.data_file, self.tokenizer, args)
+        self.assertEqual(len(dataset), 5)
+        self.assertEqual(dataset[4], ('教育新闻', 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
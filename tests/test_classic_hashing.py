@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+@author:XuMing(xuming624@qq.com)
+@description: 
+"""
+import os
+import shutil
+import unittest
+
+import sys
+
+sys.path.append('..')
+from pytextclassifier import ClassicClassifier
+
+data = [
+    ('education', 'Student debt to cost Britain billions within decades'),
+    ('education', 'Chinese education for TV experiment'),
+    ('sports', 'Middle East and Asia boost investment in top level sports'),
+    ('sports', 'Summit Series look launches HBO Canada sports doc series: Mudhar')
+]
+
+
+class HashingFeatureTestCase(unittest.TestCase):
+    def test_hashing(self):
+        for feature_name in ['hashing', 'hashing_tfidf']:
+            model_dir = f'models/{feature_name}'
+            m = ClassicClassifier(model_dir, feature_name_or_feature=feature_name, n_features=2 ** 12)
+            m.train(data * 5)
+            new_m = ClassicClassifier(model_dir, feature_name_or_feature=feature_name, n_features=2 ** 12)
+            new_m.load_model()
+            r, _ = new_m.predict(['Middle East and Asia boost investment in top level sports'])
+            print(feature_name, r)
+            self.assertEqual(r[0], 'sports')
+        self.assertTrue(os.path.getsize('models/hashing/classifier_feature.pkl') < 10000)
+
+    def test_train_incremental(self):
+        os.makedirs('models', exist_ok=True)
+        data_path = 'models/train_incremental.txt'
+        with open(data_path, 'w', encoding='utf-8') as f:
+            for i in range(20):
+                for label, text in data:
+                    f.write(f'{label}\t{text} {i}\n')
+        m = ClassicClassifier('models/sgd', model_name_or_model='sgd', feature_name_or_feature='hashing')
+        m.train_incremental(data_path, chunksize=16, checkpoint_every=2)
+        self.assertTrue(os.path.exists('models/sgd/classifier_model.pkl'))
+        r, _ = m.predict(['Chinese education for TV experiment'])
+        print(r)
+        self.assertEqual(r[0], 'education')
+        with self.assertRaises(ValueError):
+            ClassicClassifier('models/lr', model_name_or_model='lr').train_incremental(data_path)
+
+    def test_stage_timings(self):
+        m = ClassicClassifier('models/timings', feature_name_or_feature='hashing', n_features=2 ** 12)
+        m.train(data * 5)
+        self.assertEqual(list(m.stage_timings), ['tokenize', 'feature', 'fit', 'evaluate'])
+        for predict_fn in [m.predict, m.predict_proba]:
+            predict_fn(['Chinese education for TV experiment'])
+            self.assertEqual(list(m.predict_timings), ['tokenize', 'transform', 'score'])
+            self.assertTrue(all(t >= 0 for t in m.predict_timings.values()))
+        # predict does not overwrite the train timings
+        self.assertIn('fit', m.stage_timings)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree('models')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+@author:XuMing(xuming624@qq.com)
+@description:
+"""
+import shutil
+import subprocess
+import unittest
+
+import numpy as np
+import sys
+
+sys.path.append('..')
+from pytextclassifier import TextCNNClassifier, TextRNNClassifier, FastTextClassifier
+from pytextclassifier.predictor import ExportedPredictor
+
+data = [
+    ('education', 'Student debt to cost Britain billions within decades'),
+    ('education', 'Chinese education for TV experiment'),
+    ('sports', 'Middle East and Asia boost investment in top level sports'),
+    ('sports', 'Summit Series look launches HBO Canada sports doc series: Mudhar'),
+    ('finance', 'Stocks rally as central bank holds interest rates'),
+]
+samples = ['Abbott government spends $8 million on higher education media blitz',
+           'Middle East and Asia boost investment in top level sports',
+           '',
+           'Central bank rates and stocks, a longer text than the max_seq_length of the models']
+
+
+class ExportTestCase(unittest.TestCase):
+    def test_parity(self):
+        models = [
+            TextCNNClassifier('models/textcnn', max_seq_length=32, embed_size=16, num_filters=8),
+            TextRNNClassifier('models/textrnn', max_seq_length=32, embed_size=16, hidden_size=16),
+            FastTextClassifier('models/fasttext', max_seq_length=32, embed_size=16, hidden_size=16),
+        ]
+        for m in models:
+            m.train(data * 3, num_epochs=2)
+            m.load_model()
+            r, p = m.predict(samples)
+            for fmt in ['onnx', 'torchscript']:
+                bundle_dir = m.export(f'{m.model_dir}/export_{fmt}', format=fmt)
+                predictor = ExportedPredictor(bundle_dir, batch_size=3)
+                print(predictor)
+                r1, p1 = predictor.predict(samples)
+                self.assertEqual(r, r1)
+                np.testing.assert_allclose(p, p1, rtol=1e-5, atol=1e-6)
+
+    def test_no_torch_import(self):
+        code = ("import sys; sys.path.insert(0, '..'); from pytextclassifier import ExportedPredictor; "
+                "print('torch' in sys.modules)")
+        output = subprocess.check_output([sys.executable, '-c', code], text=True)
+        self.assertEqual(output.strip(), 'False')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree('models', ignore_errors=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -10,9 +10,24 @@ import sys
 
 sys.path.append('..')
 from pytextclassifier import FastTextClassifier
+from pytextclassifier.data_helper import encode_sequences, ngram_hash
+from pytextclassifier.fasttext_classifier import build_features
+import numpy as np
 import torch
 
 
+# n-gram hashes of the original per position implementation, saved models depend on these buckets
+def biGramHash(sequence, t, buckets):
+    t1 = sequence[t - 1] if t - 1 >= 0 else 0
+    return (t1 * 14918087) % buckets
+
+
+def triGramHash(sequence, t, buckets):
+    t1 = sequence[t - 1] if t - 1 >= 0 else 0
+    t2 = sequence[t - 2] if t - 2 >= 0 else 0
+    return (t2 * 14918087 * 18408749 + t1 * 14918087) % buckets
+
+
 class SaveModelTestCase(unittest.TestCase):
     def test_classifier(self):
         m = FastTextClassifier(model_dir='models/fasttext')
@@ -42,5 +57,75 @@ class SaveModelTestCase(unittest.TestCase):
         shutil.rmtree('models')
 
 
+class SparsePruneTestCase(unittest.TestCase):
+    def test_sparse_prune(self):
+        m = FastTextClassifier(model_dir='models/fasttext-sparse', embed_size=16, hidden_size=16, max_seq_length=32,
+                               sparse_embedding=True, count_ngram_buckets=True)
+        data = [
+            ('education', 'Student debt to cost Britain billions within decades'),
+            ('education', 'Chinese education for TV experiment'),
+            ('sports', 'Middle East and Asia boost investment in top level sports'),
+            ('sports', 'Summit Series look launches HBO Canada sports doc series: Mudhar')
+        ]
+        m.train(data * 5, num_epochs=2)
+        m.load_model()
+        samples = [d[1] for d in data]
+        r, p = m.predict(samples)
+        result = m.prune_ngram_buckets()
+        print(result)
+        self.assertLess(result['pruned_size'], result['size'] / 10)
+        # seen n-grams keep their vectors
+        m.load_model()
+        self.assertEqual(m.model.embedding_ngram2.num_embeddings, result['bigram_buckets'] + 1)
+        r1, p1 = m.predict(samples)
+        self.assertEqual(r, r1)
+        for a, b in zip(p, p1):
+            self.assertAlmostEqual(a, b, places=5)
+        # unseen n-grams are mapped to the zero row
+        r2, p2 = m.predict(['zzzz qqqq'])
+        self.assertEqual(len(r2), 1)
+        import shutil
+        shutil.rmtree('models')
+
+    def test_no_counts_by_default(self):
+        m = FastTextClassifier(model_dir='models/fasttext-dense', embed_size=16, hidden_size=16, max_seq_length=32)
+        m.train([('education', 'Chinese education for TV experiment'), ('sports', 'top level sports')] * 5,
+                num_epochs=1)
+        self.assertFalse(os.path.exists('models/fasttext-dense/ngram_counts.npz'))
+        with self.assertRaisesRegex(ValueError, 'count_ngram_buckets'):
+            m.prune_ngram_buckets()
+        import shutil
+        shutil.rmtree('models')
+
+
+class NgramHashTestCase(unittest.TestCase):
+    def test_ngram_hash(self):
+        # large ids check that the vectorized int64 arithmetic does not overflow
+        words = ['w%d' % i for i in range(20)]
+        word_id_map = {word: 1000003 * (i + 7) for i, word in enumerate(words)}
+        word_id_map.update({'[PAD]': 5, '[UNK]': 1})
+        texts = ['w1', 'w2 w3', 'w4 zzz w5', ' '.join(words), '', ' '.join(words[::-1] * 2)]
+        max_seq_length = 8
+        for n_gram_vocab in [250499, 97]:
+            # baseline: pad the tokens to max_seq_length or truncate, then hash every position
+            expected_bigram, expected_trigram = [], []
+            for text in texts:
+                tokens = text.split()[:max_seq_length]
+                tokens += ['[PAD]'] * (max_seq_length - len(tokens))
+                ids = [word_id_map.get(token, word_id_map['[UNK]']) for token in tokens]
+                expected_bigram.append([biGramHash(ids, t, n_gram_vocab) for t in range(max_seq_length)])
+                expected_trigram.append([triGramHash(ids, t, n_gram_vocab) for t in range(max_seq_length)])
+
+            word_ids, _ = encode_sequences(texts, str.split, word_id_map, max_seq_length=max_seq_length)
+            bigram, trigram = ngram_hash(word_ids, n_gram_vocab)
+            self.assertTrue(np.array_equal(bigram, np.array(expected_bigram)))
+            self.assertTrue(np.array_equal(trigram, np.array(expected_trigram)))
+            _, seq_lens, bigram, trigram = build_features(texts, str.split, word_id_map,
+                                                          max_seq_length=max_seq_length, n_gram_vocab=n_gram_vocab)
+            self.assertTrue(np.array_equal(bigram, np.array(expected_bigram)))
+            self.assertTrue(np.array_equal(trigram, np.array(expected_trigram)))
+            self.assertEqual(seq_lens.tolist(), [1, 2, 3, 8, 0, 8])
+
+
 if __name__ == '__main__':
     unittest.main()
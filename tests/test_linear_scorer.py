@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+@author:XuMing(xuming624@qq.com)
+@description: 
+"""
+import os
+import shutil
+import unittest
+
+import numpy as np
+import sys
+
+sys.path.append('..')
+from pytextclassifier import ClassicClassifier
+from pytextclassifier.linear_scorer import LinearScorer
+
+data = [
+    ('education', 'Student debt to cost Britain billions within decades'),
+    ('education', 'Chinese education for TV experiment'),
+    ('sports', 'Middle East and Asia boost investment in top level sports'),
+    ('sports', 'Summit Series look launches HBO Canada sports doc series: Mudhar'),
+    ('finance', 'Stocks rally as central bank holds interest rates'),
+    ('finance', 'Bank shares fall after quarterly earnings miss'),
+]
+samples = ['Abbott government spends $8 million on higher education media blitz',
+           'Middle East and Asia boost investment in top level sports',
+           'Central bank rates and stocks']
+
+
+class LinearScorerTestCase(unittest.TestCase):
+    def test_scorer_parity(self):
+        for model_name in ['lr', 'bayes', 'svm']:
+            for train_data in [data, data[:4]]:
+                m = ClassicClassifier(f'models/{model_name}', model_name_or_model=model_name)
+                m.train(train_data * 3)
+                self.assertIsNotNone(m.scorer)
+                X_feat = m.feature.transform(m.tokenize_sentences(samples))
+                np.testing.assert_allclose(m.scorer.predict_proba(X_feat), m.model.predict_proba(X_feat), atol=1e-10)
+                r, p = m.predict(samples)
+                self.assertEqual(list(r), list(m.model.predict(X_feat)))
+                # load from npz
+                new_m = ClassicClassifier(f'models/{model_name}', model_name_or_model=model_name)
+                new_m.load_model()
+                self.assertIsInstance(new_m.scorer, LinearScorer)
+                r1, p1 = new_m.predict(samples)
+                self.assertEqual(list(r), list(r1))
+                np.testing.assert_allclose(p, p1)
+
+    def test_not_linear(self):
+        m = ClassicClassifier('models/decision_tree', model_name_or_model='decision_tree')
+        m.train(data * 3)
+        self.assertIsNone(m.scorer)
+        self.assertFalse(os.path.exists('models/decision_tree/linear_scorer.npz'))
+        r, p = m.predict(samples)
+        self.assertEqual(len(p), len(samples))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree('models')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+@author:XuMing(xuming624@qq.com)
+@description:
+"""
+import unittest
+
+import numpy as np
+import sys
+import torch
+import torch.nn.functional as F
+from sklearn import metrics
+
+sys.path.append('..')
+from pytextclassifier.data_helper import BatchLoader
+from pytextclassifier.predict_util import id_label_array, topk, evaluate_batches
+
+
+class LinearModel(torch.nn.Module):
+    def __init__(self, num_features, num_classes):
+        super().__init__()
+        self.fc = torch.nn.Linear(num_features, num_classes)
+
+    def forward(self, x):
+        return self.fc(x[0])
+
+
+class PredictUtilTestCase(unittest.TestCase):
+    def test_topk(self):
+        probs = np.random.RandomState(1).rand(50, 7).astype(np.float32)
+        for k in [1, 3, 7, 10]:
+            ids, top_probs = topk(probs, k)
+            expected = np.argsort(-probs, axis=1, kind='stable')[:, :min(k, 7)]
+            np.testing.assert_array_equal(ids, expected)
+            np.testing.assert_array_equal(top_probs, np.take_along_axis(probs, expected, axis=1))
+
+    def test_id_label(self):
+        id_label = id_label_array({'sports': 1, 'education': 0, 'finance': 2})
+        self.assertEqual(id_label[np.array([2, 0, 1])].tolist(), ['finance', 'education', 'sports'])
+
+    def test_evaluate(self):
+        torch.manual_seed(1)
+        model = LinearModel(8, 4)
+        x = np.random.RandomState(1).rand(103, 8).astype(np.float32)
+        y = np.random.RandomState(2).randint(0, 4, 103)
+        result = evaluate_batches(model, BatchLoader((x, y), 'cpu', batch_size=10), 4)
+        with torch.no_grad():
+            outputs = model((torch.from_numpy(x),))
+        y_pred = outputs.argmax(dim=1).numpy()
+        self.assertAlmostEqual(result['accuracy'], metrics.accuracy_score(y, y_pred))
+        self.assertAlmostEqual(result['loss'], F.cross_entropy(outputs, torch.from_numpy(y)).item(), places=5)
+        np.testing.assert_array_equal(result['confusion_matrix'], metrics.confusion_matrix(y, y_pred, labels=range(4)))
+
+
+if __name__ == '__main__':
+    unittest.main()
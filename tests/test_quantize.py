@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+@author:XuMing(xuming624@qq.com)
+@description:
+"""
+import shutil
+import unittest
+
+import sys
+
+sys.path.append('..')
+from pytextclassifier import TextCNNClassifier, TextRNNClassifier, FastTextClassifier
+
+data = [
+    ('education', 'Student debt to cost Britain billions within decades'),
+    ('education', 'Chinese education for TV experiment'),
+    ('sports', 'Middle East and Asia boost investment in top level sports'),
+    ('sports', 'Summit Series look launches HBO Canada sports doc series: Mudhar'),
+]
+
+
+class QuantizeTestCase(unittest.TestCase):
+    def test_quantize(self):
+        models = [
+            (TextCNNClassifier, dict(model_dir='models/textcnn', max_seq_length=32, embed_size=16, num_filters=8)),
+            (TextRNNClassifier, dict(model_dir='models/textrnn', max_seq_length=32, embed_size=16, hidden_size=16)),
+            (FastTextClassifier, dict(model_dir='models/fasttext', max_seq_length=32, embed_size=16, hidden_size=16)),
+        ]
+        for model_class, kwargs in models:
+            m = model_class(**kwargs)
+            m.train(data * 3, num_epochs=2)
+            for embedding_dtype in ['int8', 'fp16']:
+                result = m.quantize(data, embedding_dtype=embedding_dtype)
+                print(result)
+                self.assertLess(result['quantized_size'], result['fp32_size'])
+                self.assertEqual(result['acc_delta'], result['quantized_acc'] - result['fp32_acc'])
+                r, p = m.predict([d[1] for d in data])
+                new_m = model_class(**kwargs)
+                new_m.load_model(quantized=True)
+                self.assertTrue(new_m.quantized)
+                r1, p1 = new_m.predict([d[1] for d in data])
+                self.assertEqual(r, r1)
+                self.assertEqual(p, p1)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree('models', ignore_errors=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+@author:XuMing(xuming624@qq.com)
+@description: 
+"""
+import os
+import shutil
+import unittest
+
+import sys
+
+sys.path.append('..')
+from pytextclassifier import TextCNNClassifier, FastTextClassifier
+from pytextclassifier.base_classifier import load_data_chunks, hash_dev_mask
+from pytextclassifier.textcluster import TextCluster
+
+data = [
+    ('education', 'Student debt to cost Britain billions within decades'),
+    ('education', 'Chinese education for TV experiment'),
+    ('sports', 'Middle East and Asia boost investment in top level sports'),
+    ('sports', 'Summit Series look launches HBO Canada sports doc series: Mudhar')
+]
+
+
+class StreamingTestCase(unittest.TestCase):
+    def setUp(self):
+        os.makedirs('models', exist_ok=True)
+        self.data_path = 'models/train_streaming.txt'
+        with open(self.data_path, 'w', encoding='utf-8') as f:
+            for i in range(50):
+                for label, text in data:
+                    f.write(f'{label}\t{text} {i}\n')
+
+    def tearDown(self):
+        shutil.rmtree('models')
+
+    def test_hash_dev_split(self):
+        dev_masks = [is_dev for _, _, is_dev in load_data_chunks(self.data_path, chunksize=7, test_size=0.2)]
+        chunk_dev_size = sum(int(m.sum()) for m in dev_masks)
+        texts = [line.rstrip('\n').split('\t')[1] for line in open(self.data_path, encoding='utf-8')]
+        self.assertEqual(chunk_dev_size, int(hash_dev_mask(texts, test_size=0.2).sum()))
+        self.assertTrue(0 < chunk_dev_size < len(texts))
+
+    def test_train_streaming(self):
+        m = TextCNNClassifier(model_dir='models/textcnn', batch_size=16, max_seq_length=32)
+        m.train_streaming(self.data_path, chunksize=30, shuffle_buffer_size=64, num_epochs=2)
+        m.load_model()
+        r, p = m.predict(['Chinese education for TV experiment 1',
+                          'Middle East and Asia boost investment in top level sports 3'])
+        print(r, p)
+        self.assertEqual(len(r), 2)
+        self.assertTrue(set(r) <= {'education', 'sports'})
+
+    def test_train_streaming_without_dev(self):
+        m = TextCNNClassifier(model_dir='models/textcnn', batch_size=16, max_seq_length=32)
+        m.train_streaming(self.data_path, chunksize=30, test_size=0.0, num_epochs=1)
+        # the last model is saved without a dev set
+        self.assertTrue(TextCNNClassifier(model_dir='models/textcnn', max_seq_length=32).load_model())
+
+    def test_compile_dataset(self):
+        m = FastTextClassifier(model_dir='models/fasttext', batch_size=16, max_seq_length=32)
+        data_dir = m.compile_dataset(self.data_path, 'models/compiled', shard_size=64)
+        m.train(data_dir, num_epochs=1)
+        acc = m.evaluate_model(data_dir)
+        print(acc)
+        self.assertEqual(acc, m.evaluate_model(self.data_path))
+        with self.assertRaises(ValueError):
+            FastTextClassifier(model_dir='models/fasttext', max_seq_length=16).train(data_dir)
+
+    def test_compile_dataset_without_dev(self):
+        m = TextCNNClassifier(model_dir='models/textcnn', batch_size=16, max_seq_length=32)
+        # a data list is compiled like a file, no sample goes to dev
+        data_dir = m.compile_dataset(data * 10, 'models/compiled', test_size=0.0)
+        m.train(data_dir, num_epochs=1)
+        new_m = TextCNNClassifier(model_dir='models/textcnn', max_seq_length=32)
+        self.assertTrue(new_m.load_model())
+        self.assertEqual(len(new_m.predict(['Chinese education for TV experiment'])[0]), 1)
+
+    def test_cluster_train_streaming(self):
+        chunks = list(TextCluster.load_file_data_chunks(self.data_path, chunksize=60))
+        self.assertEqual([len(c) for c in chunks], [60, 60, 60, 20])
+        self.assertEqual(sum(chunks, []), TextCluster.load_file_data(self.data_path))
+        m = TextCluster(model_dir='models/cluster', n_clusters=2, n_features=2 ** 12)
+        m.train_streaming(self.data_path, chunksize=60, checkpoint_every=2)
+        self.assertEqual(m.model.cluster_centers_.shape, (2, 2 ** 12))
+        new_m = TextCluster(model_dir='models/cluster')
+        new_m.load_model()
+        samples = ['Chinese education for TV experiment', 'Middle East and Asia boost investment in top level sports']
+        self.assertEqual(list(m.predict(samples)), list(new_m.predict(samples)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+@author:XuMing(xuming624@qq.com)
+@description:
+"""
+import shutil
+import unittest
+
+import sys
+import torch
+
+sys.path.append('..')
+from pytextclassifier import TextRNNClassifier
+from pytextclassifier.textrnn_classifier import TextRNNAttModel
+
+
+class TextRNNTestCase(unittest.TestCase):
+    def test_padding_independent(self):
+        torch.manual_seed(1)
+        vocab_size = 20
+        model = TextRNNAttModel(vocab_size, num_classes=3, embed_size=8, hidden_size=16).eval()
+        seq_lens = torch.LongTensor([5, 2, 0, 7])
+        word_ids = torch.full((4, 32), vocab_size - 1, dtype=torch.long)
+        for i, n in enumerate(seq_lens.tolist()):
+            word_ids[i, :n] = torch.randint(0, vocab_size - 1, (n,))
+        with torch.no_grad():
+            out = model((word_ids, seq_lens))
+            out_long = model((torch.cat([word_ids, word_ids[:, -16:]], dim=1), seq_lens))
+            out_single = model((word_ids[1:2, :2], seq_lens[1:2]))
+        self.assertEqual(out.shape, (4, 3))
+        torch.testing.assert_close(out, out_long)
+        torch.testing.assert_close(out[1:2], out_single)
+
+    def test_classifier(self):
+        m = TextRNNClassifier(model_dir='models/textrnn', max_seq_length=32, hidden_size=16, embed_size=16)
+        data = [
+            ('education', 'Student debt to cost Britain billions within decades'),
+            ('education', 'Chinese education for TV experiment'),
+            ('sports', 'Middle East and Asia boost investment in top level sports'),
+            ('sports', 'Summit Series look launches HBO Canada sports doc series: Mudhar')
+        ]
+        m.train(data * 5, num_epochs=2)
+        m.load_model()
+        r, p = m.predict(['Chinese education for TV experiment', ''])
+        self.assertEqual(len(r), 2)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree('models')
+
+
+if __name__ == '__main__':
+    unittest.main()
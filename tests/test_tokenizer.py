@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+@author:XuMing(xuming624@qq.com)
+@description: 
+"""
+import unittest
+
+import sys
+
+sys.path.append('..')
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from pytextclassifier.tokenizer import Tokenizer, NgramAnalyzer
+
+texts = [
+    '晚上一个人好孤单，想:找附近的人陪陪我.',
+    "unlabeled example, aug_copy_num is the index of the generated augmented. you don't know.",
+    '名师指导托福语法技巧：名词的复数形式 TOEFL',
+    '',
+]
+
+
+class TokenizerTestCase(unittest.TestCase):
+    def test_tokenize_batch(self):
+        t = Tokenizer()
+        expected = [t.tokenize(text) for text in texts]
+        self.assertEqual(t.tokenize_batch(texts), expected)
+        self.assertEqual(t.tokenize_batch(texts, stopwords={'的', '.'}),
+                         [[w for w in tokens if w not in {'的', '.'}] for tokens in expected])
+
+    def test_tokenize_batch_parallel(self):
+        expected = Tokenizer().tokenize_batch(texts * 10)
+        t = Tokenizer(n_jobs=2, parallel_threshold=10)
+        self.assertEqual(t.tokenize_batch(texts * 10), expected)
+        t = Tokenizer(n_jobs=2, parallel_threshold=10, use_jieba_parallel=True)
+        self.assertEqual(t.tokenize_batch(texts * 10), expected)
+
+    def test_ngram_analyzer(self):
+        tokens_list = Tokenizer(lower=False).tokenize_batch(texts)
+        for ngram_range in [(1, 1), (1, 2), (2, 3)]:
+            analyzer = TfidfVectorizer(ngram_range=ngram_range).build_analyzer()
+            ngram_analyzer = NgramAnalyzer(ngram_range=ngram_range)
+            for tokens in tokens_list:
+                self.assertEqual(ngram_analyzer(tokens), analyzer(' '.join(tokens)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+@author:XuMing(xuming624@qq.com)
+@description:
+"""
+import shutil
+import unittest
+
+import numpy as np
+import sys
+
+sys.path.append('..')
+from pytextclassifier import ClassicClassifier, FastTextClassifier, TextCNNClassifier
+
+data = [
+    ('education', 'Student debt to cost Britain billions within decades'),
+    ('education', 'Chinese education for TV experiment'),
+    ('sports', 'Middle East and Asia boost investment in top level sports'),
+    ('sports', 'Summit Series look launches HBO Canada sports doc series: Mudhar'),
+    ('finance', 'Stocks rally as central bank holds interest rates'),
+]
+samples = ['Abbott government spends $8 million on higher education media blitz',
+           'Middle East and Asia boost investment in top level sports',
+           'Central bank rates and stocks']
+
+
+class TopkTestCase(unittest.TestCase):
+    def test_topk(self):
+        models = [
+            (ClassicClassifier('models/lr', model_name_or_model='lr'), {}),
+            (ClassicClassifier('models/knn', model_name_or_model='knn'), {}),
+            (FastTextClassifier('models/fasttext', max_seq_length=32, embed_size=16, hidden_size=16),
+             {'num_epochs': 2}),
+            (TextCNNClassifier('models/textcnn', max_seq_length=32, embed_size=16, num_filters=8), {'num_epochs': 2}),
+        ]
+        for m, train_kwargs in models:
+            m.train(data * 3, **train_kwargs)
+            m.load_model()
+            labels, probs = m.predict(samples)
+            proba = m.predict_proba(samples)
+            self.assertEqual(proba.shape, (len(samples), 3))
+            np.testing.assert_allclose(proba.sum(axis=1), 1.0, rtol=1e-5)
+            self.assertEqual(sorted(m.labels), ['education', 'finance', 'sports'])
+            topk_labels, topk_probs = m.predict_topk(samples, k=2)
+            print(m.__class__.__name__, topk_labels, topk_probs)
+            self.assertEqual([row[0] for row in topk_labels], list(labels))
+            np.testing.assert_allclose([row[0] for row in topk_probs], probs, rtol=1e-6)
+            for row_labels, row_probs in zip(topk_labels, topk_probs):
+                self.assertEqual(len(row_labels), 2)
+                self.assertGreaterEqual(row_probs[0], row_probs[1])
+            # k is clipped to the number of labels
+            topk_labels, _ = m.predict_topk(samples, k=10)
+            self.assertEqual(sorted(topk_labels[0]), sorted(m.labels))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree('models', ignore_errors=True)
+
+
+if __name__ == '__main__':
+    unittest.main()